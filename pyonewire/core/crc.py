@@ -0,0 +1,188 @@
+"""
+crc.py - 1-Wire CRC8 and CRC16 for the pyonewire package
+
+  Copyright 2008 mike wakerly <opensource@hoho.com>
+
+Both CRCs are the reflected forms used on the bus: CRC8 (x^8 + x^5 + x^4 + 1)
+covers ROM ids and scratchpads, CRC16 (x^16 + x^15 + x^2 + 1) covers memory
+pages. They are computed a byte at a time from precomputed tables; the
+bitwise versions are kept as a reference.
+
+Data can be any sequence of byte values: a list of integers, a str,
+bytearray or memoryview.
+"""
+
+import struct
+
+class CrcError(Exception):
+  """Data read from the bus failed its CRC"""
+
+
+# value of a CRC16 run over data followed by its inverted CRC16, LSB first
+CRC16_RESIDUE = 0xb001
+
+# number of ids from which BadRoms uses NumPy, if it is installed
+NUMPY_THRESHOLD = 256
+
+# the numpy module once imported, False if it is not installed
+_numpy = None
+
+def _Numpy():
+  """Returns the numpy module, or False if it is not installed.
+
+  It is only imported by the first call which could use it, as importing it
+  takes longer than everything else here.
+  """
+  global _numpy
+  if _numpy is None:
+    try:
+      import numpy
+      _numpy = numpy
+    except ImportError:
+      _numpy = False
+  return _numpy
+
+
+def Crc8Bitwise(data, crc=0):
+  """Reference CRC8, one bit at a time."""
+  for byte in bytearray(data):
+    for i in xrange(8):
+      mix = (crc ^ byte) & 0x01
+      crc >>= 1
+      if mix:
+        crc ^= 0x8c
+      byte >>= 1
+  return crc
+
+
+def Crc16Bitwise(data, crc=0):
+  """Reference CRC16, one bit at a time."""
+  for byte in bytearray(data):
+    for i in xrange(8):
+      mix = (crc ^ byte) & 0x01
+      crc >>= 1
+      if mix:
+        crc ^= 0xa001
+      byte >>= 1
+  return crc
+
+
+_CRC8_TABLE = tuple([Crc8Bitwise([i]) for i in xrange(256)])
+_CRC16_TABLE = tuple([Crc16Bitwise([i]) for i in xrange(256)])
+
+
+def Crc8(data, crc=0):
+  """Compute the CRC8 of |data|.
+
+  Args
+    data - byte values
+    crc - CRC to continue from
+  Returns
+    the CRC8, 0 if |data| ends with a valid CRC8
+  """
+  table = _CRC8_TABLE
+  for byte in bytearray(data):
+    crc = table[crc ^ byte]
+  return crc
+
+
+def Crc16(data, crc=0):
+  """Compute the CRC16 of |data|.
+
+  Args
+    data - byte values
+    crc - CRC to continue from
+  Returns
+    the CRC16, CRC16_RESIDUE if |data| ends with a valid inverted CRC16
+  """
+  table = _CRC16_TABLE
+  for byte in bytearray(data):
+    crc = (crc >> 8) ^ table[(crc ^ byte) & 0xff]
+  return crc
+
+
+def CheckCrc8(data):
+  """Returns True if the last byte of |data| is the CRC8 of the others."""
+  return Crc8(data) == 0
+
+
+def CheckCrc16(data, crc=0):
+  """Returns True if |data| ends with the inverted CRC16 of the rest.
+
+  Args
+    data - byte values, ending with the 2 CRC bytes as read from the bus
+    crc - CRC the device seeded its CRC16 with, e.g. from a previous page
+  """
+  return Crc16(data, crc) == CRC16_RESIDUE
+
+
+def CheckRom(rom):
+  """Returns True if the CRC8 in the top byte of a 64 bit id is valid.
+
+  An all zero id, as read from a shorted bus, is rejected.
+  """
+  return bool(rom) and Crc8(struct.pack('<Q', rom)) == 0
+
+
+def BadRoms(roms):
+  """Returns the ids in |roms| that fail CheckRom, in order.
+
+  The ids are packed into one buffer, which is faster than checking them one
+  by one. Large lists are checked with NumPy when it is installed: the CRC
+  is run over all ids at once, a byte column at a time.
+  """
+  roms = list(roms)
+  numpy = len(roms) >= NUMPY_THRESHOLD and _Numpy()
+  if numpy:
+    return _BadRomsNumpy(numpy, roms)
+  data = bytearray(struct.pack('<%iQ' % len(roms), *roms))
+  table = _CRC8_TABLE
+  ret = []
+  for i, rom in enumerate(roms):
+    crc = 0
+    for byte in data[8*i:8*i+8]:
+      crc = table[crc ^ byte]
+    if crc or not rom:
+      ret.append(rom)
+  return ret
+
+
+def _BadRomsNumpy(numpy, roms):
+  data = numpy.frombuffer(struct.pack('<%iQ' % len(roms), *roms),
+                          dtype=numpy.uint8)
+  data = data.reshape(len(roms), 8)
+  table = numpy.array(_CRC8_TABLE, dtype=numpy.uint8)
+  check = numpy.zeros(len(roms), dtype=numpy.uint8)
+  for i in xrange(8):
+    check = table[check ^ data[:, i]]
+  bad = (check != 0) | (data.max(axis=1) == 0)
+  return [roms[i] for i in numpy.flatnonzero(bad)]
+
+
+def _Benchmark():
+  import random
+  import time
+  rand = random.Random(0)
+  page = [rand.getrandbits(8) for i in xrange(32)]
+  roms = [rand.getrandbits(64) for i in xrange(10000)]
+  rom_bytes = [[(rom >> (8*i)) & 0xff for i in xrange(8)] for rom in roms]
+  assert Crc8(page) == Crc8Bitwise(page)
+  assert Crc16(page) == Crc16Bitwise(page)
+  tests = [
+    ('crc8 bitwise, 10000 ids', lambda: [Crc8Bitwise(b) for b in rom_bytes]),
+    ('crc8 table, 10000 ids', lambda: [Crc8(b) for b in rom_bytes]),
+    ('CheckRom, 10000 ids', lambda: [CheckRom(rom) for rom in roms]),
+    ('BadRoms, 10000 ids', lambda: BadRoms(roms)),
+    ('crc16 bitwise, 1000 pages', lambda: [Crc16Bitwise(page)
+                                            for i in xrange(1000)]),
+    ('crc16 table, 1000 pages', lambda: [Crc16(page) for i in xrange(1000)]),
+  ]
+  print 'NumPy %s' % (_Numpy() and 'installed' or 'missing')
+  for name, fn in tests:
+    start = time.time()
+    fn()
+    print '%-28s %8.2f ms' % (name, (time.time() - start) * 1000)
+
+
+if __name__ == '__main__':
+  _Benchmark()
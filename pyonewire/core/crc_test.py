@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""
+Tests of the crc module
+
+  Copyright 2008 mike wakerly <opensource@hoho.com>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+"""
+
+import random
+import struct
+import unittest
+
+from pyonewire.core import crc
+
+# the example id of Maxim application note 27: family 0x02, CRC8 0xa2
+AN27_ROM = 0xa200000001b81c02L
+
+
+class CrcTest(unittest.TestCase):
+  def setUp(self):
+    self.rand = random.Random(0)
+
+  def testTables(self):
+    for i in xrange(256):
+      self.assertEqual(crc.Crc8([i]), crc.Crc8Bitwise([i]))
+      self.assertEqual(crc.Crc16([i]), crc.Crc16Bitwise([i]))
+    for length in (0, 1, 7, 8, 32, 100):
+      data = [self.rand.getrandbits(8) for i in xrange(length)]
+      seed = self.rand.getrandbits(8)
+      self.assertEqual(crc.Crc8(data, seed), crc.Crc8Bitwise(data, seed))
+      seed = self.rand.getrandbits(16)
+      self.assertEqual(crc.Crc16(data, seed), crc.Crc16Bitwise(data, seed))
+
+  def testKnownValues(self):
+    self.assertEqual(crc.Crc8('123456789'), 0xa1)
+    self.assertEqual(crc.Crc16('123456789'), 0xbb3d)
+    self.assertEqual(crc.Crc8(struct.pack('<Q', AN27_ROM)[:7]), 0xa2)
+
+  def testCheckCrc(self):
+    data = [self.rand.getrandbits(8) for i in xrange(31)]
+    self.assertTrue(crc.CheckCrc8(data + [crc.Crc8(data)]))
+    self.assertFalse(crc.CheckCrc8(data + [crc.Crc8(data) ^ 1]))
+    inverted = crc.Crc16(data) ^ 0xffff
+    page = data + [inverted & 0xff, inverted >> 8]
+    self.assertTrue(crc.CheckCrc16(page))
+    self.assertFalse(crc.CheckCrc16(page[:-1] + [page[-1] ^ 0x80]))
+    seed = 0x1234
+    inverted = crc.Crc16(data, seed) ^ 0xffff
+    self.assertTrue(crc.CheckCrc16(data + [inverted & 0xff, inverted >> 8],
+                                   seed))
+
+  def testCheckRom(self):
+    self.assertTrue(crc.CheckRom(AN27_ROM))
+    self.assertFalse(crc.CheckRom(AN27_ROM ^ (1L << 20)))
+    self.assertFalse(crc.CheckRom(AN27_ROM ^ (1L << 63)))
+    # an all zero id has a valid CRC8, but comes from a shorted bus
+    self.assertFalse(crc.CheckRom(0L))
+
+  def _Roms(self, count):
+    roms = []
+    for i in xrange(count):
+      rom = self.rand.getrandbits(56)
+      if i % 3:
+        rom |= crc.Crc8(struct.pack('<Q', rom)[:7]) << 56
+      roms.append(rom)
+    roms[count / 2] = 0L
+    return roms
+
+  def testBadRoms(self):
+    roms = self._Roms(100)
+    self.assertEqual(crc.BadRoms(roms),
+                     [rom for rom in roms if not crc.CheckRom(rom)])
+    self.assertEqual(crc.BadRoms([]), [])
+
+  @unittest.skipUnless(crc._Numpy(), 'NumPy is not installed')
+  def testBadRomsNumpy(self):
+    roms = self._Roms(crc.NUMPY_THRESHOLD + 10)
+    expected = [rom for rom in roms if not crc.CheckRom(rom)]
+    self.assertEqual(crc.BadRoms(roms), expected)
+    self.assertEqual(crc._BadRomsNumpy(crc._Numpy(), roms[:10]),
+                     crc.BadRoms(roms[:10]))
+
+
+if __name__ == '__main__':
+  unittest.main()
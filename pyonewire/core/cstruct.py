@@ -1,10 +1,126 @@
 """
 cstruct.py
 by mike wakerly - http://hoho.com/mike/
+
+Two ways to describe C structs: cStruct is a flexible record with a
+trailing variable length string allowed, and CompileStruct builds a
+record class for a fixed layout, with one precompiled struct.Struct and
+__slots__ storage, that can unpack from and pack into buffers in place.
+A cStruct without a variable length field is packed through such a record.
 """
 
 import struct
 
+
+class CompiledStruct(object):
+   """
+   Base class of the record classes built by CompileStruct.
+
+   Records are plain attribute holders; the layout is parsed once, when the
+   class is built. Instances can be reused: UnpackFromTuple, unpack and
+   unpack_from overwrite every field in place.
+   """
+   __slots__ = ()
+
+   def __init__(self, *values):
+      self.UnpackFromTuple(values or self._defaults)
+
+   def __str__(self):
+      return '<%s: %s>' % (self.__class__.__name__, ', '.join(
+            ['%s=%s' % x for x in zip(self._fields, self.AsTuple())]))
+
+   def __eq__(self, other):
+      return (self.__class__ is other.__class__ and
+              self.AsTuple() == other.AsTuple())
+
+   def __ne__(self, other):
+      return not self == other
+
+   def unpack(self, datastr):
+      self.UnpackFromTuple(self._struct.unpack(datastr))
+
+   def unpack_from(self, buf, offset=0):
+      """Set the fields from |buf|, any buffer, starting at |offset|."""
+      self.UnpackFromTuple(self._struct.unpack_from(buf, offset))
+
+   def pack(self):
+      return self._struct.pack(*self.AsTuple())
+
+   def pack_into(self, buf, offset=0):
+      """Write the fields into |buf|, a writable buffer, at |offset|."""
+      self._struct.pack_into(buf, offset, *self.AsTuple())
+
+
+_RECORD_TEMPLATE = '''
+def UnpackFromTuple(self, t):
+   %(names)s, = t
+
+def AsTuple(self):
+   return (%(names)s,)
+'''
+
+def CompileStruct(name, fields, byte_order='<'):
+   """
+   Build a record class for a fixed struct layout.
+
+   Fields are given as for cStruct, as (format, name) or (format, name,
+   default) tuples, and every format must have a fixed size. The record is
+   packed with |byte_order|, standard sizes and no padding by default:
+
+      Header = CompileStruct('Header', ( ('B', 'type'), ('H', 'length') ))
+      h = Header()
+      h.unpack_from(buf, 4)
+      h.length += 1
+      h.pack_into(buf, 4)
+   """
+   names = tuple([f[1] for f in fields])
+   defaults = []
+   for f in fields:
+      if len(f) == 3:
+         defaults.append(f[2])
+      elif f[0].endswith('s'):
+         defaults.append('')
+      else:
+         defaults.append(0)
+   fmt = byte_order + ''.join([f[0] for f in fields])
+   namespace = {}
+   exec _RECORD_TEMPLATE % {
+      'names': ', '.join(['self.%s' % n for n in names])} in namespace
+   return type(name, (CompiledStruct,), {
+      '__slots__': names,
+      '_fields': names,
+      '_defaults': tuple(defaults),
+      '_struct': struct.Struct(fmt),
+      'size': struct.calcsize(fmt),
+      'UnpackFromTuple': namespace['UnpackFromTuple'],
+      'AsTuple': namespace['AsTuple'],
+   })
+
+
+# CompileStruct record class for each fixed cStruct layout, keyed by the
+# field formats
+_records = {}
+
+def _RecordClass(formats):
+   """Returns the CompileStruct class for a cStruct layout, or None.
+
+   A cStruct packs each field on its own, so the layout is only compiled
+   when no field's size or alignment depends on that. The record fields are
+   named by position, as the cStruct keeps the names.
+   """
+   if formats not in _records:
+      fixed = bool(formats)
+      for f in formats:
+         if f == 's' or struct.calcsize(f) != struct.calcsize('=' + f):
+            fixed = False
+      record = None
+      if fixed:
+         fields = [(f, 'f%i' % i) for i, f in enumerate(formats)]
+         record = CompileStruct('cStruct', fields, '=')
+      _records[formats] = record
+   return _records[formats]
+
+
 class cStruct:
    """
    A class to represent C structs in python.
@@ -34,6 +150,8 @@ class cStruct:
       self.__dict__['_fields']  = _fields
       self.__dict__['_formats'] = _formats
       self.__dict__['_values']  = _values
+      record = _RecordClass(tuple([_formats[f] for f in _fields]))
+      self.__dict__['_record']  = record and record()
 
    def __str__(self):
       return '<cStruct: %s>' % ', '.join(['%s=%s' % x for x in (zip(self._fields, self._values.values()))])
@@ -56,6 +174,10 @@ class cStruct:
       pos = 0
       if len(datastr) == 0:
          return
+      if self._record and len(datastr) == self._record.size:
+         self._record.unpack(datastr)
+         self.UnpackFromTuple(self._record.AsTuple())
+         return
       for f in self._fields:
          if pos > len(datastr):
             break
@@ -73,6 +195,9 @@ class cStruct:
 
 
    def pack(self):
+      if self._record:
+         self._record.UnpackFromTuple([self._values[f] for f in self._fields])
+         return self._record.pack()
       ret = ''
       for f in self._fields:
          if self._formats[f] == 's':
@@ -81,3 +206,34 @@ class cStruct:
          else:
             ret += struct.pack(self._formats[f], self._values[f])
       return ret
+
+
+def _Benchmark():
+   import time
+   fields = [('B', 'f%i' % i) for i in xrange(16)]
+   raw = tuple(range(16))
+   buf = bytearray(struct.pack('16B', *raw))
+   Packet = CompileStruct('Packet', fields)
+   packet = Packet()
+
+   def Fresh():
+      p = cStruct(fields)
+      p.UnpackFromTuple(raw)
+
+   tests = [
+      ('cStruct() + UnpackFromTuple', Fresh),
+      ('Packet(*raw)', lambda: Packet(*raw)),
+      ('packet.UnpackFromTuple(raw)', lambda: packet.UnpackFromTuple(raw)),
+      ('packet.unpack_from(buf)', lambda: packet.unpack_from(buf)),
+      ('packet.pack_into(buf)', lambda: packet.pack_into(buf)),
+   ]
+   n = 20000
+   for name, fn in tests:
+      start = time.time()
+      for i in xrange(n):
+         fn()
+      print '%-30s %6.2f us' % (name, (time.time() - start) / n * 1e6)
+
+
+if __name__ == '__main__':
+   _Benchmark()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+Tests of the cstruct module
+
+  Copyright 2008 mike wakerly <opensource@hoho.com>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+"""
+
+import struct
+import unittest
+
+from pyonewire.core import cstruct
+
+Header = cstruct.CompileStruct('Header', (
+    ('B', 'type'),
+    ('H', 'length', 0x1234),
+    ('4s', 'tag'),
+    ('q', 'offset'),
+))
+
+
+class CompileStructTest(unittest.TestCase):
+  def testDefaults(self):
+    header = Header()
+    self.assertEqual(header.AsTuple(), (0, 0x1234, '', 0))
+    self.assertEqual(Header.size, 15)
+
+  def testRoundTrip(self):
+    header = Header(7, 300, 'abcd', -5)
+    data = header.pack()
+    self.assertEqual(data, struct.pack('<BH4sq', 7, 300, 'abcd', -5))
+    other = Header()
+    other.unpack(data)
+    self.assertEqual(other, header)
+    self.assertFalse(other != header)
+
+  def testInPlace(self):
+    buf = bytearray(3 + Header.size)
+    header = Header(1, 2, 'wxyz', 3)
+    header.pack_into(buf, 3)
+    self.assertEqual(str(buf[3:]), header.pack())
+    other = Header()
+    other.unpack_from(buf, 3)
+    self.assertEqual(other.AsTuple(), (1, 2, 'wxyz', 3))
+    # filling in a record again overwrites every field
+    other.unpack_from(bytearray(Header(4, 5, 'abcd', 6).pack()))
+    self.assertEqual(other, Header(4, 5, 'abcd', 6))
+
+  def testSlots(self):
+    header = Header()
+    header.length += 1
+    self.assertEqual(header.length, 0x1235)
+    self.assertFalse(hasattr(header, '__dict__'))
+    self.assertRaises(AttributeError, setattr, header, 'lenght', 1)
+
+  def testEquality(self):
+    Other = cstruct.CompileStruct('Other', (('B', 'type'),))
+    self.assertNotEqual(Header(), Other())
+
+
+class cStructTest(unittest.TestCase):
+  def testFixed(self):
+    fields = (('h', 'shortid'), ('B', 'flags'), ('I', 'count', 5))
+    p = cstruct.cStruct(fields)
+    self.assertEqual(p.count, 5)
+    p.shortid = -2
+    p.flags = 0x80
+    data = p.pack()
+    self.assertEqual(data, struct.pack('=hBI', -2, 0x80, 5))
+    q = cstruct.cStruct(fields)
+    q.unpack(data)
+    self.assertEqual(q, p)
+    self.assertEqual((q.shortid, q.flags, q.count), (-2, 0x80, 5))
+
+  def testString(self):
+    fields = (('B', 'length'), ('s', 'data'))
+    p = cstruct.cStruct(fields)
+    p.length = 3
+    p.data = 'abc'
+    q = cstruct.cStruct(fields)
+    q.unpack(p.pack())
+    self.assertEqual((q.length, q.data), (3, 'abc'))
+
+  def testUnknownField(self):
+    p = cstruct.cStruct((('B', 'a'),))
+    self.assertEqual(p.b, None)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,150 @@
+"""
+inventory.py - on-disk cache of the devices found on each bus
+
+  Copyright 2008 mike wakerly <opensource@hoho.com>
+
+The cache keeps, for every adapter, the 64 bit ids last found on its bus,
+when each was last seen and when the bus was last searched. It is a small
+binary file, little endian throughout:
+
+  header    '1WIV', version (B), number of adapters (H)
+  adapter   name length (B), name, last search time (d), number of ids (I),
+            then per id: id (Q), last seen time (d)
+  trailer   inverted CRC16 of everything before it (H)
+
+Times are seconds since the epoch. Files are replaced atomically, so a
+reader never sees a partial write.
+"""
+
+import logging
+import os
+import struct
+
+from pyonewire.core import crc
+
+MAGIC = '1WIV'
+VERSION = 1
+
+_HEADER = struct.Struct('<4sBH')
+_ADAPTER = struct.Struct('<dI')
+_ENTRY = struct.Struct('<Qd')
+
+
+class InventoryError(Exception):
+  """An inventory file is damaged or of an unknown format"""
+
+
+class Inventory(object):
+  """The devices found on one adapter's bus."""
+  def __init__(self, searched=0.0, seen=None):
+    # time of the last full search
+    self.searched = searched
+    # maps ids to the time they were last seen
+    self.seen = dict(seen or {})
+
+  def GetRoms(self):
+    """Returns the ids, sorted."""
+    return sorted(self.seen)
+
+  def MarkSeen(self, roms, now):
+    for rom in roms:
+      self.seen[rom] = now
+
+  def Replace(self, roms, now):
+    """Replace the ids with the result of a full search made at |now|."""
+    self.seen = dict.fromkeys(roms, now)
+    self.searched = now
+
+
+def Pack(inventories):
+  """Encode a dict of adapter names to Inventory objects.
+
+  Returns
+    the file contents, as a str
+  """
+  parts = [_HEADER.pack(MAGIC, VERSION, len(inventories))]
+  for name in sorted(inventories):
+    inventory = inventories[name]
+    if len(name) > 0xff:
+      raise ValueError, "adapter name too long: %r" % name
+    parts.append(chr(len(name)) + name)
+    parts.append(_ADAPTER.pack(inventory.searched, len(inventory.seen)))
+    entries = sorted(inventory.seen.iteritems())
+    parts.append(struct.pack('<' + 'Qd' * len(entries),
+                             *[v for entry in entries for v in entry]))
+  data = ''.join(parts)
+  check = crc.Crc16(data) ^ 0xffff
+  return data + struct.pack('<H', check)
+
+
+def Unpack(data):
+  """Decode the contents of an inventory file.
+
+  Returns
+    dict mapping adapter names to Inventory objects
+  Raises
+    InventoryError if the data is damaged or of another format
+  """
+  if len(data) < _HEADER.size + 2 or not crc.CheckCrc16(data):
+    raise InventoryError, "bad CRC"
+  magic, version, count = _HEADER.unpack_from(data)
+  if magic != MAGIC or version != VERSION:
+    raise InventoryError, "unknown format %r version %i" % (magic, version)
+  try:
+    ret = {}
+    pos = _HEADER.size
+    for i in xrange(count):
+      size = ord(data[pos])
+      name = data[pos+1:pos+1+size]
+      pos += 1 + size
+      searched, nids = _ADAPTER.unpack_from(data, pos)
+      pos += _ADAPTER.size
+      values = struct.unpack_from('<' + 'Qd' * nids, data, pos)
+      pos += _ENTRY.size * nids
+      ret[name] = Inventory(searched, zip(values[::2], values[1::2]))
+  except (IndexError, struct.error):
+    raise InventoryError, "truncated"
+  if pos != len(data) - 2:
+    raise InventoryError, "trailing data"
+  return ret
+
+
+def Load(path):
+  """Read an inventory file.
+
+  A missing or damaged file is not an error: the devices will simply be
+  searched for.
+
+  Returns
+    dict mapping adapter names to Inventory objects, empty if the file could
+    not be used
+  """
+  try:
+    f = open(path, 'rb')
+  except IOError:
+    return {}
+  try:
+    data = f.read()
+  finally:
+    f.close()
+  try:
+    return Unpack(data)
+  except InventoryError, e:
+    logging.getLogger('inventory').warning('ignoring %s: %s' % (path, e))
+    return {}
+
+
+def Save(path, inventories):
+  """Write an inventory file, replacing it atomically."""
+  data = Pack(inventories)
+  temp = '%s.%i.tmp' % (path, os.getpid())
+  f = open(temp, 'wb')
+  try:
+    try:
+      f.write(data)
+    finally:
+      f.close()
+    os.rename(temp, path)
+  except:
+    os.remove(temp)
+    raise
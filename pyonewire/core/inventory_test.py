@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+Tests of the inventory file format
+
+  Copyright 2008 mike wakerly <opensource@hoho.com>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+from pyonewire.core import inventory
+
+
+def _Inventories():
+  return {
+    'bus0': inventory.Inventory(1000.5, {0x28000001L: 990.0,
+                                         0xff00000000000010L: 1000.5}),
+    'usb 001/004': inventory.Inventory(),
+  }
+
+
+class InventoryTest(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.dir, 'onewire.inv')
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def assertSame(self, loaded, expected):
+    self.assertEqual(sorted(loaded), sorted(expected))
+    for name in expected:
+      self.assertEqual(loaded[name].searched, expected[name].searched)
+      self.assertEqual(loaded[name].seen, expected[name].seen)
+
+  def _Write(self, data):
+    f = open(self.path, 'wb')
+    f.write(data)
+    f.close()
+
+  def testRoundTrip(self):
+    inventories = _Inventories()
+    self.assertSame(inventory.Unpack(inventory.Pack(inventories)),
+                    inventories)
+    inventory.Save(self.path, inventories)
+    self.assertSame(inventory.Load(self.path), inventories)
+    self.assertSame(inventory.Unpack(inventory.Pack({})), {})
+
+  def testCorrupted(self):
+    data = inventory.Pack(_Inventories())
+    for i in (0, 5, len(data) / 2, len(data) - 1):
+      damaged = data[:i] + chr(ord(data[i]) ^ 0x10) + data[i+1:]
+      self.assertRaises(inventory.InventoryError, inventory.Unpack, damaged)
+      self._Write(damaged)
+      self.assertEqual(inventory.Load(self.path), {})
+
+  def testTruncated(self):
+    data = inventory.Pack(_Inventories())
+    for size in (0, 3, 8, len(data) - 2, len(data) - 1):
+      self.assertRaises(inventory.InventoryError, inventory.Unpack,
+                        data[:size])
+      self._Write(data[:size])
+      self.assertEqual(inventory.Load(self.path), {})
+
+  def testMissing(self):
+    self.assertEqual(inventory.Load(self.path), {})
+
+  def testSaveReplaces(self):
+    inventory.Save(self.path, _Inventories())
+    inventory.Save(self.path, {'bus1': inventory.Inventory(5.0)})
+    self.assertEqual(sorted(inventory.Load(self.path)), ['bus1'])
+    self.assertEqual(os.listdir(self.dir), ['onewire.inv'])
+
+  def testSaveFailure(self):
+    inventories = _Inventories()
+    inventory.Save(self.path, inventories)
+    bad = {'x' * 300: inventory.Inventory()}
+    self.assertRaises(ValueError, inventory.Save, self.path, bad)
+    # neither the file nor a temporary file are left half written
+    self.assertSame(inventory.Load(self.path), inventories)
+    self.assertEqual(os.listdir(self.dir), ['onewire.inv'])
+
+
+if __name__ == '__main__':
+  logging.getLogger('inventory').setLevel(logging.ERROR)
+  unittest.main()
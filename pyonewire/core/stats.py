@@ -0,0 +1,178 @@
+"""
+stats.py - lightweight statistics helpers for the pyonewire package
+
+  Copyright 2008 mike wakerly <opensource@hoho.com>
+"""
+
+import bisect
+import collections
+import time
+
+class Histogram(object):
+  """Counts samples into buckets with fixed upper bounds.
+
+  A sample lands in the first bucket whose bound is greater than or equal to
+  it; samples above the last bound are counted in a final overflow bucket.
+  """
+  def __init__(self, bounds):
+    self._bounds = tuple(sorted(bounds))
+    self.Reset()
+
+  def Reset(self):
+    """Discard all samples."""
+    self._counts = [0] * (len(self._bounds) + 1)
+    self._total = 0.0
+    self._num = 0
+
+  def Add(self, value):
+    """Count one sample."""
+    self._counts[bisect.bisect_left(self._bounds, value)] += 1
+    self._total += value
+    self._num += 1
+
+  def GetCounts(self):
+    """Returns a list of (upper bound, count) tuples.
+
+    The upper bound of the overflow bucket is None.
+    """
+    return zip(self._bounds + (None,), self._counts)
+
+  def GetNumSamples(self):
+    return self._num
+
+  def GetMean(self):
+    if not self._num:
+      return 0.0
+    return self._total / self._num
+
+  def __str__(self):
+    parts = []
+    for bound, count in self.GetCounts():
+      if bound is None:
+        parts.append('>%g: %i' % (self._bounds[-1], count))
+      else:
+        parts.append('<=%g: %i' % (bound, count))
+    return '<Histogram: %s>' % ', '.join(parts)
+
+
+class OperationStats(object):
+  """Per-operation metrics, fed by methods wrapped with Instrument.
+
+  Instances are hooks: they are called with the operation name, the time it
+  took, and optionally the endpoint and number of bytes it transferred plus
+  any other named counts (for example the number of polls a wait took).
+  Latency percentiles are computed over the last |samples| calls of each
+  operation.
+  """
+  def __init__(self, samples=1000):
+    self._samples = samples
+    self.Reset()
+
+  def Reset(self):
+    """Discard everything recorded."""
+    self._counts = collections.defaultdict(int)
+    self._times = collections.defaultdict(float)
+    self._recent = {}
+    self._bytes = collections.defaultdict(int)
+    self._counters = collections.defaultdict(int)
+
+  def __call__(self, op, seconds, endpoint=None, nbytes=0, **counts):
+    self._counts[op] += 1
+    self._times[op] += seconds
+    recent = self._recent.get(op)
+    if recent is None:
+      recent = self._recent[op] = collections.deque(maxlen=self._samples)
+    recent.append(seconds)
+    if endpoint is not None:
+      self._bytes[endpoint] += nbytes
+    for name, value in counts.iteritems():
+      self._counters[op, name] += value
+
+  def GetOperations(self):
+    """Returns the sorted names of the operations recorded."""
+    return sorted(self._counts)
+
+  def GetCount(self, op):
+    """Returns the number of calls of |op|."""
+    return self._counts.get(op, 0)
+
+  def GetTotalTime(self, op):
+    """Returns the cumulative time spent in |op|, in seconds."""
+    return self._times.get(op, 0.0)
+
+  def GetPercentile(self, op, percent):
+    """Returns the |percent| percentile of the recent latencies of |op|."""
+    recent = sorted(self._recent.get(op, ()))
+    if not recent:
+      return 0.0
+    index = int(round(percent / 100.0 * (len(recent) - 1)))
+    return recent[index]
+
+  def GetBytes(self, endpoint):
+    """Returns the number of bytes transferred on |endpoint|."""
+    return self._bytes.get(endpoint, 0)
+
+  def GetCounter(self, op, name):
+    """Returns the total of count |name| reported by |op|."""
+    return self._counters.get((op, name), 0)
+
+  def __str__(self):
+    lines = ['%-20s %8s %10s %10s %10s' % ('operation', 'calls', 'total ms',
+                                            'p50 ms', 'p99 ms')]
+    for op in self.GetOperations():
+      lines.append('%-20s %8i %10.2f %10.3f %10.3f' % (
+          op, self.GetCount(op), self.GetTotalTime(op) * 1000,
+          self.GetPercentile(op, 50) * 1000,
+          self.GetPercentile(op, 99) * 1000))
+    for (op, name), value in sorted(self._counters.iteritems()):
+      lines.append('%s %s: %i' % (op, name, value))
+    for endpoint, nbytes in sorted(self._bytes.iteritems()):
+      lines.append('endpoint %s: %i bytes' % (endpoint, nbytes))
+    return '\n'.join(lines)
+
+
+def _Wrap(obj, name, fn, hook, measure):
+  timer = time.time
+  def wrapped(*args, **kwargs):
+    start = timer()
+    ret = fn(*args, **kwargs)
+    elapsed = timer() - start
+    if measure is None:
+      hook(name, elapsed)
+    else:
+      hook(name, elapsed, **measure(obj, args, ret))
+    return ret
+  wrapped.__name__ = fn.__name__
+  wrapped.__doc__ = fn.__doc__
+  wrapped.instrumented = fn
+  return wrapped
+
+
+def Instrument(obj, methods, hook):
+  """Report every call of some methods of |obj| to |hook|.
+
+  The methods are wrapped on the instance only, so Uninstrument puts the
+  original methods back and uninstrumented objects pay nothing.
+
+  Args
+    obj - object to instrument
+    methods - dict mapping method names to None, or to a function called as
+              measure(obj, args, result) that returns a dict of extra
+              arguments for the hook, such as endpoint and nbytes
+    hook - callable as hook(name, seconds, **extra), e.g. an OperationStats
+  """
+  Uninstrument(obj, methods)
+  for name, measure in methods.iteritems():
+    setattr(obj, name, _Wrap(obj, name, getattr(obj, name), hook, measure))
+
+
+def Uninstrument(obj, methods):
+  """Remove the wrappers Instrument put on |obj|."""
+  for name in methods:
+    fn = obj.__dict__.get(name)
+    if hasattr(fn, 'instrumented'):
+      if getattr(fn.instrumented, 'im_self', None) is obj:
+        # a method bound to obj, found on its class
+        del obj.__dict__[name]
+      else:
+        obj.__dict__[name] = fn.instrumented
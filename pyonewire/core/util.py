@@ -1,8 +1,139 @@
-def IdTupleToLong(v):
+import binascii
+import re
+import struct
+
+from pyonewire.core import crc
+
+# formats of ids as text, see FormatId
+FORMAT_HEX = 'hex'      # 28000001234567ab as one 64 bit number: crc first
+FORMAT_BYTES = 'bytes'  # 28 ab 67 45 23 01 00 00, in the order on the bus
+FORMAT_W1 = 'w1'        # 28-000001234567, family and serial as in Linux w1
+
+def IdTupleToLong(v, check_crc=False):
   if len(v) != 8:
     raise ValueError, "Tuple must consist of 8 integers"
-  ret = 0L
-  for i in xrange(8):
-    # this reverses the order of the tuple
-    ret |= (v[i] << (i*8))
+  if check_crc and crc.Crc8(v):
+    raise crc.CrcError, "bad CRC8 in id %s" % (tuple(v),)
+  # the first byte on the bus is the least significant
+  return struct.unpack('<Q', struct.pack('8B', *v))[0]
+
+def IdsFromBuffer(data):
+  """Convert ids as read from the bus, 8 bytes each, to 64 bit ids.
+
+  Args
+    data - str, bytearray or sequence of byte values
+  Returns
+    list of ids
+  """
+  if not isinstance(data, str):
+    data = str(bytearray(data))
+  if len(data) % 8:
+    raise ValueError, "buffer length %i is not a multiple of 8" % len(data)
+  return list(struct.unpack('<%iQ' % (len(data) / 8), data))
+
+def IdsToBuffer(roms):
+  """Returns |roms| as a str of 8 bytes per id, in the order on the bus."""
+  roms = list(roms)
+  return struct.pack('<%iQ' % len(roms), *roms)
+
+def MakeId(family, serial):
+  """Returns the 64 bit id of a family code and 48 bit serial number.
+
+  The CRC8 is computed and placed in the top byte.
+  """
+  rom = (family & 0xff) | ((serial & 0xffffffffffffL) << 8)
+  return rom | (long(crc.Crc8(struct.pack('<Q', rom)[:7])) << 56)
+
+def FormatId(rom, style=FORMAT_HEX):
+  """Format a 64 bit id as text, in one of the FORMAT_ styles."""
+  return FormatIds([rom], style)[0]
+
+def FormatIds(roms, style=FORMAT_HEX):
+  """Format many 64 bit ids as text at once, see FormatId.
+
+  Returns
+    list of strings
+  """
+  if style == FORMAT_HEX:
+    return ['%016x' % rom for rom in roms]
+  if style == FORMAT_W1:
+    return ['%02x-%012x' % (rom & 0xff, (rom >> 8) & 0xffffffffffffL)
+            for rom in roms]
+  if style == FORMAT_BYTES:
+    # hexlify the ids all together, then split the digits up
+    digits = binascii.hexlify(IdsToBuffer(roms))
+    return [' '.join([digits[i+j:i+j+2] for j in xrange(0, 16, 2)])
+            for i in xrange(0, len(digits), 16)]
+  raise ValueError, "unknown id format %r" % style
+
+_W1_ID = re.compile(r'^([0-9a-f]{2})[-.]([0-9a-f]{12})$')
+
+def ParseId(text):
+  """Parse an id written in any of the FORMAT_ styles.
+
+  The OWFS style, 28.000001234567, is accepted as well. The w1 and OWFS
+  styles leave out the CRC8, which is computed.
+
+  Returns
+    the 64 bit id
+  Raises
+    ValueError if |text| is not an id
+  """
+  text = text.strip().lower()
+  match = _W1_ID.match(text)
+  if match:
+    return MakeId(int(match.group(1), 16), long(match.group(2), 16))
+  if ' ' in text:
+    values = [int(part, 16) for part in text.split()]
+    if len(values) != 8 or max(values) > 0xff:
+      raise ValueError, "not an id: %r" % text
+    return IdTupleToLong(values)
+  if len(text) != 16:
+    raise ValueError, "not an id: %r" % text
+  return long(text, 16)
+
+def ParseIds(texts):
+  """Returns the ids of a sequence of strings, see ParseId."""
+  return [ParseId(text) for text in texts]
+
+def GroupByFamily(roms):
+  """Returns a dict mapping family codes to the ids in |roms| of that family.
+
+  The ids keep their order within each family.
+  """
+  ret = {}
+  for rom in roms:
+    family = rom & 0xff
+    if family in ret:
+      ret[family].append(rom)
+    else:
+      ret[family] = [rom]
   return ret
+
+
+def _Benchmark(count=50000):
+  import random
+  import time
+  rand = random.Random(0)
+  roms = [MakeId(rand.choice((0x01, 0x10, 0x28)), rand.getrandbits(48))
+          for i in xrange(count)]
+  data = IdsToBuffer(roms)
+  tests = [
+    ('IdTupleToLong', lambda: [IdTupleToLong(bytearray(data[i:i+8]))
+                               for i in xrange(0, len(data), 8)]),
+    ('IdsFromBuffer', lambda: IdsFromBuffer(data)),
+    ('FormatIds bytes', lambda: FormatIds(roms, FORMAT_BYTES)),
+    ('FormatIds w1', lambda: FormatIds(roms, FORMAT_W1)),
+    ('ParseIds w1', lambda: ParseIds(FormatIds(roms, FORMAT_W1))),
+    ('crc.BadRoms', lambda: crc.BadRoms(roms)),
+    ('GroupByFamily', lambda: GroupByFamily(roms)),
+  ]
+  print '%i ids' % count
+  for name, fn in tests:
+    start = time.time()
+    fn()
+    print '  %-16s %8.1f ms' % (name, (time.time() - start) * 1000)
+
+
+if __name__ == '__main__':
+  _Benchmark()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+"""
+DS18x20 temperature sensor driver for the pyonewire package
+
+  Copyright 2008 mike wakerly <opensource@hoho.com>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+
+All sensors on a bus convert at once: a single Skip ROM + Convert T is
+followed by one conversion time under strong pullup, which also powers
+parasite powered sensors. The scratchpads are then read with Match ROM
+through a single master Transaction, which adapters such as the DS2490 run
+with a handful of USB transfers.
+
+  sensors = ds18x20.DS18x20(master)
+  sensors.Search()
+  for rom, temperature in sensors.Read().iteritems():
+    print '%016x %.2f' % (rom, temperature)
+"""
+
+import struct
+
+from pyonewire.core import crc
+from pyonewire.master import GenericOneWireMaster
+
+# family codes
+FAMILY_DS18S20 = 0x10
+FAMILY_DS1822 = 0x22
+FAMILY_DS18B20 = 0x28
+FAMILY_DS1825 = 0x3b
+FAMILY_DS28EA00 = 0x42
+FAMILIES = (FAMILY_DS18S20, FAMILY_DS1822, FAMILY_DS18B20, FAMILY_DS1825,
+            FAMILY_DS28EA00)
+
+# function commands
+CMD_CONVERT_T = 0x44
+CMD_READ_SCRATCHPAD = 0xbe
+CMD_WRITE_SCRATCHPAD = 0x4e
+CMD_READ_POWER_SUPPLY = 0xb4
+
+SCRATCHPAD_SIZE = 9
+
+# worst case conversion time, at 12 bit resolution, in ms
+CONVERSION_TIME = 750
+
+
+def RomBytes(rom):
+  """Returns the 8 bytes of a 64 bit id, in the order they go on the bus."""
+  return list(struct.unpack('8B', struct.pack('<Q', rom)))
+
+
+def DecodeTemperature(family, scratchpad):
+  """Compute the temperature held in a scratchpad.
+
+  Args
+    family - family code of the sensor the scratchpad was read from
+    scratchpad - the scratchpad bytes
+  Returns
+    temperature in degrees Celsius
+  """
+  raw = struct.unpack('<h', struct.pack('2B', *scratchpad[:2]))[0]
+  if family == FAMILY_DS18S20:
+    count_remain, count_per_c = scratchpad[6], scratchpad[7]
+    if not count_per_c:
+      return raw / 2.0
+    # the extended resolution reading from the datasheet
+    return ((raw >> 1) - 0.25 +
+            float(count_per_c - count_remain) / count_per_c)
+  # the low bits are undefined below 12 bit resolution
+  resolution = (scratchpad[4] >> 5) & 0x3
+  raw &= ~((1 << (3 - resolution)) - 1)
+  return raw / 16.0
+
+
+def CheckScratchpad(scratchpad):
+  """Check a scratchpad read from a sensor.
+
+  A sensor that did not answer reads as all ones, and a bus held low as all
+  zeros, which has a valid CRC8 and would decode as 0 degrees: both are
+  rejected along with scratchpads failing their CRC8.
+
+  Returns
+    True if the scratchpad can be decoded
+  """
+  scratchpad = list(scratchpad)
+  if scratchpad in ([0x00] * SCRATCHPAD_SIZE, [0xff] * SCRATCHPAD_SIZE):
+    return False
+  return crc.CheckCrc8(scratchpad)
+
+
+class DS18x20(object):
+  """A group of DS18x20 temperature sensors on one bus master."""
+  def __init__(self, master, roms=None):
+    self._master = master
+    self._roms = list(roms or [])
+
+  def GetRoms(self):
+    """Returns the ids of the sensors in the group."""
+    return list(self._roms)
+
+  def Search(self):
+    """Find every temperature sensor on the bus.
+
+    Returns
+      list of the 64 bit ids found, which become the group
+    """
+    roms = []
+    for family in FAMILIES:
+      roms.extend(self._master.Search(self._master.SEARCH_NORMAL,
+                                      family=family))
+    self._roms = roms
+    return roms
+
+  def Convert(self):
+    """Start a conversion on all sensors at once and wait for it to finish.
+
+    Returns
+      True if a sensor answered the reset
+    """
+    # devices left in overdrive by a Select ignore a broadcast at overdrive
+    self._master.SetSpeed(GenericOneWireMaster.SPEED_REGULAR)
+    if not self._master.ResetBus():
+      return False
+    self._master.WriteBlock([GenericOneWireMaster.ROM_SKIP, CMD_CONVERT_T],
+                            CONVERSION_TIME)
+    return True
+
+  def ReadScratchpads(self, roms=None):
+    """Read the scratchpads of several sensors in a single transaction.
+
+    Args
+      roms - ids of the sensors to read, all of the group if None
+    Returns
+      dict mapping ids to lists of scratchpad bytes
+    """
+    if roms is None:
+      roms = self._roms
+    txn = self._master.Transaction()
+    for rom in roms:
+      txn.Reset()
+      txn.WriteBlock([GenericOneWireMaster.ROM_MATCH] + RomBytes(rom) +
+                     [CMD_READ_SCRATCHPAD])
+      txn.ReadBlock(SCRATCHPAD_SIZE)
+    return dict(zip(roms, txn.Execute()))
+
+  def Read(self):
+    """Convert and read all sensors.
+
+    Scratchpads failing CheckScratchpad are read once more, together.
+
+    Returns
+      dict mapping ids to temperatures in degrees Celsius, or None for
+      sensors that did not answer or kept failing the check
+    """
+    if not self.Convert():
+      return dict.fromkeys(self._roms)
+    scratchpads = self.ReadScratchpads()
+    bad = [rom for rom, data in scratchpads.iteritems()
+           if not CheckScratchpad(data)]
+    if bad:
+      scratchpads.update(self.ReadScratchpads(bad))
+    ret = {}
+    for rom, scratchpad in scratchpads.iteritems():
+      if CheckScratchpad(scratchpad):
+        ret[rom] = DecodeTemperature(rom & 0xff, scratchpad)
+      else:
+        ret[rom] = None
+    return ret
+
+
+def ReadTemperatures(master, roms=None):
+  """Read all temperature sensors on |master|.
+
+  Args
+    master - a GenericOneWireMaster
+    roms - ids of the sensors to read; if None, the bus is searched
+  Returns
+    dict mapping ids to temperatures, see DS18x20.Read
+  """
+  sensors = DS18x20(master, roms)
+  if roms is None:
+    sensors.Search()
+  return sensors.Read()
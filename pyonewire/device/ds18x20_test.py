@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+Tests of the ds18x20 temperature sensor group
+
+  Copyright 2008 mike wakerly <opensource@hoho.com>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+"""
+
+import unittest
+
+from pyonewire.device import ds18x20
+from pyonewire.master import SimulatedOneWireMaster
+
+ZEROS = [0x00] * ds18x20.SCRATCHPAD_SIZE
+ONES = [0xff] * ds18x20.SCRATCHPAD_SIZE
+
+
+class GlitchyGroup(ds18x20.DS18x20):
+  """Replaces the scratchpads read from some sensors, pass by pass."""
+  def __init__(self, master, roms, glitches):
+    ds18x20.DS18x20.__init__(self, master, roms)
+    self.glitches = glitches
+    self.reads = []
+
+  def ReadScratchpads(self, roms=None):
+    ret = ds18x20.DS18x20.ReadScratchpads(self, roms)
+    self.reads.append(sorted(ret))
+    for rom in ret:
+      if self.glitches.get(rom):
+        ret[rom] = self.glitches[rom].pop(0)
+    return ret
+
+
+class ReadTest(unittest.TestCase):
+  def setUp(self):
+    self.sensors = [SimulatedOneWireMaster.VirtualDS18B20(1, 21.5),
+                    SimulatedOneWireMaster.VirtualDS18B20(2, 23.0)]
+    self.master = SimulatedOneWireMaster.SimulatedOneWireMaster(self.sensors)
+    self.roms = [sensor.rom for sensor in self.sensors]
+
+  def testCheckScratchpad(self):
+    self.assertFalse(ds18x20.CheckScratchpad(ZEROS))
+    self.assertFalse(ds18x20.CheckScratchpad(ONES))
+    self.assertTrue(ds18x20.CheckScratchpad(self.sensors[0].Scratchpad()))
+
+  def testBlankRetried(self):
+    for blank in (ZEROS, ONES):
+      group = GlitchyGroup(self.master, self.roms, {self.roms[0]: [blank]})
+      self.assertEqual(group.Read(), {self.roms[0]: 21.5,
+                                      self.roms[1]: 23.0})
+      self.assertEqual(group.reads, [sorted(self.roms), [self.roms[0]]])
+
+  def testBlankRejected(self):
+    group = GlitchyGroup(self.master, self.roms,
+                         {self.roms[1]: [ZEROS, ZEROS]})
+    self.assertEqual(group.Read(), {self.roms[0]: 21.5, self.roms[1]: None})
+
+
+if __name__ == '__main__':
+  unittest.main()
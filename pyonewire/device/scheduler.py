@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+"""
+Periodic temperature polling for the pyonewire package
+
+  Copyright 2008 mike wakerly <opensource@hoho.com>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+
+PollScheduler samples DS18x20 sensors, each at its own interval, on any
+number of buses. Whenever a sensor is due, every sensor due within the
+coalescing window is sampled along with it: each bus gets a single
+broadcast conversion, then the sensors are read, most urgent first, in one
+master Transaction. Buses are polled in parallel.
+
+  scheduler = PollScheduler({'bus0': master})
+  for rom in ds18x20.DS18x20(master).Search():
+    scheduler.Add('bus0', rom, 10.0)
+  scheduler.Run(3600)
+  print scheduler.FormatReport()
+
+A sample taken after the next one was due counts as a deadline miss; a
+sensor that falls a whole interval behind skips the samples it missed.
+The clock and sleep functions can be replaced, so that a schedule can be
+run against simulated buses in simulated time; see _Benchmark.
+"""
+
+import time
+
+from pyonewire.device import ds18x20
+from pyonewire.master import BusManager
+
+# sensors due this soon after the first one due are sampled with it, in s
+COALESCE_WINDOW = 1.0
+
+
+class _Sensor(object):
+  __slots__ = ('bus', 'rom', 'interval', 'due', 'samples', 'misses',
+               'errors', 'value')
+
+  def __init__(self, bus, rom, interval, due):
+    self.bus = bus
+    self.rom = rom
+    self.interval = interval
+    self.due = due
+    self.samples = 0
+    self.misses = 0
+    self.errors = 0
+    self.value = None
+
+
+class PollScheduler(object):
+  """Samples temperature sensors at per sensor intervals."""
+  def __init__(self, masters, window=COALESCE_WINDOW, clock=time.time,
+               sleep=time.sleep, callback=None):
+    """
+    Args
+      masters - dict mapping bus names to GenericOneWireMasters
+      window - coalescing window, in seconds
+      clock - returns the current time, in seconds
+      sleep - waits for a number of seconds
+      callback - called as callback(bus, rom, temperature, time) for every
+                 sample; temperature is None for a failed read
+    """
+    self._manager = BusManager.BusManager(masters)
+    self._window = window
+    self._clock = clock
+    self._sleep = sleep
+    self._callback = callback
+    self._sensors = {}
+    self._start = None
+    self._rounds = 0
+
+  def Add(self, bus, rom, interval):
+    """Sample a sensor every |interval| seconds, starting now."""
+    if bus not in self._manager.GetNames():
+      raise KeyError, "no bus %r" % bus
+    self._sensors[bus, rom] = _Sensor(bus, rom, float(interval),
+                                      self._clock())
+
+  def Remove(self, bus, rom):
+    del self._sensors[bus, rom]
+
+  def GetNextDue(self):
+    """Returns the time the next sample is due, or None with no sensors."""
+    if not self._sensors:
+      return None
+    return min(sensor.due for sensor in self._sensors.itervalues())
+
+  def GetLatest(self):
+    """Returns a dict mapping (bus, rom) to the last temperature read."""
+    return dict((key, sensor.value)
+                for key, sensor in self._sensors.iteritems())
+
+  def RunOnce(self):
+    """Wait for the next sensor to be due, then sample the due sensors.
+
+    Returns
+      the number of sensors sampled
+    """
+    due = self.GetNextDue()
+    if due is None:
+      return 0
+    now = self._clock()
+    if self._start is None:
+      self._start = now
+    if due > now:
+      self._sleep(due - now)
+      now = self._clock()
+    batch = [sensor for sensor in self._sensors.itervalues()
+             if sensor.due <= now + self._window]
+    # with Match ROM every read takes the same bus time whatever the order,
+    # so the reads go most urgent first: a sensor's deadline is when its
+    # next sample is due
+    batch.sort(key=lambda sensor: (sensor.due + sensor.interval, sensor.rom))
+    roms = {}
+    for sensor in batch:
+      roms.setdefault(sensor.bus, []).append(sensor.rom)
+
+    def Poll(master, name):
+      if name not in roms:
+        return {}
+      return ds18x20.DS18x20(master, roms[name]).Read()
+    readings = self._manager.RunNamed(Poll)
+    done = self._clock()
+    self._rounds += 1
+
+    for sensor in batch:
+      value = readings.get(sensor.bus, {}).get(sensor.rom)
+      sensor.value = value
+      if value is None:
+        sensor.errors += 1
+      else:
+        sensor.samples += 1
+      if done > sensor.due + sensor.interval:
+        sensor.misses += 1
+      sensor.due += sensor.interval
+      if sensor.due <= done:
+        # fell a whole interval behind: skip the samples missed
+        behind = int((done - sensor.due) / sensor.interval) + 1
+        sensor.due += behind * sensor.interval
+      if self._callback:
+        self._callback(sensor.bus, sensor.rom, value, done)
+    return len(batch)
+
+  def Run(self, duration):
+    """Keep sampling for |duration| seconds."""
+    end = self._clock() + duration
+    while True:
+      due = self.GetNextDue()
+      now = self._clock()
+      if due is None or due >= end:
+        if end > now:
+          self._sleep(end - now)
+        return
+      self.RunOnce()
+
+  def GetReport(self):
+    """Report how well the sensors kept to their intervals.
+
+    Returns
+      list of (bus, rom, target rate, achieved rate, samples, deadline
+      misses, read errors) tuples, rates in samples per second, sorted by
+      bus and rom
+    """
+    elapsed = 0.0
+    if self._start is not None:
+      elapsed = self._clock() - self._start
+    ret = []
+    for key in sorted(self._sensors):
+      sensor = self._sensors[key]
+      achieved = elapsed and sensor.samples / elapsed or 0.0
+      ret.append((sensor.bus, sensor.rom, 1.0 / sensor.interval, achieved,
+                  sensor.samples, sensor.misses, sensor.errors))
+    return ret
+
+  def FormatReport(self):
+    """Returns GetReport as text, with a summary line first."""
+    report = self.GetReport()
+    samples = sum(r[4] for r in report)
+    misses = sum(r[5] for r in report)
+    errors = sum(r[6] for r in report)
+    lines = ['%i sensors, %i rounds, %i samples, %i deadline misses, '
+             '%i errors' % (len(report), self._rounds, samples, misses,
+                            errors)]
+    for bus, rom, target, achieved, samples, misses, errors in report:
+      lines.append('  %-8s %016x  target %7.3f/s  achieved %7.3f/s  '
+                   'misses %i  errors %i' % (bus, rom, target, achieved,
+                                             misses, errors))
+    return '\n'.join(lines)
+
+
+class _SimulatedClock(object):
+  """Time on simulated buses polled in parallel.
+
+  Each call moves the clock on by the most bus time any bus used since the
+  previous call, as the buses run at the same time.
+  """
+  def __init__(self, buses):
+    self._buses = buses
+    self._marks = [bus.GetBusTime() for bus in buses]
+    self.now = 0.0
+
+  def __call__(self):
+    times = [bus.GetBusTime() for bus in self._buses]
+    elapsed = max([t - m for t, m in zip(times, self._marks)] + [0])
+    self._marks = times
+    self.now += elapsed / 1e6
+    return self.now
+
+  def Sleep(self, seconds):
+    self.__call__()
+    self.now += seconds
+
+
+def _Benchmark(buses=3, sensors=100, duration=600):
+  import random
+  from pyonewire.master import SimulatedOneWireMaster
+  rand = random.Random(0)
+  masters = {}
+  for i in xrange(buses):
+    masters['bus%i' % i] = SimulatedOneWireMaster.SimulatedOneWireMaster(
+        SimulatedOneWireMaster.MakeSensorBus(sensors, seed=i))
+  clock = _SimulatedClock([master.bus for master in masters.itervalues()])
+  scheduler = PollScheduler(masters, clock=clock, sleep=clock.Sleep)
+  for name, master in masters.iteritems():
+    for device in master.bus.devices:
+      scheduler.Add(name, device.rom, rand.choice((2, 5, 10, 30, 60)))
+  start = time.time()
+  scheduler.Run(duration)
+  print scheduler.FormatReport().split('\n')[0]
+  print '%is simulated in %.2fs' % (duration, time.time() - start)
+
+
+if __name__ == '__main__':
+  _Benchmark()
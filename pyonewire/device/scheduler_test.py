@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""
+Tests of PollScheduler on simulated buses, in simulated time
+
+  Copyright 2008 mike wakerly <opensource@hoho.com>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+"""
+
+import unittest
+
+from pyonewire.device import ds18x20
+from pyonewire.device import scheduler
+from pyonewire.master import SimulatedOneWireMaster
+
+
+class PollSchedulerTest(unittest.TestCase):
+  def _Scheduler(self, sensors, buses=1, **kwargs):
+    self.masters = {}
+    for i in xrange(buses):
+      self.masters['bus%i' % i] = (
+          SimulatedOneWireMaster.SimulatedOneWireMaster(
+              SimulatedOneWireMaster.MakeSensorBus(sensors, seed=i)))
+    self.clock = scheduler._SimulatedClock(
+        [master.bus for master in self.masters.itervalues()])
+    self.samples = []
+    def Callback(bus, rom, value, now):
+      self.samples.append((bus, rom, value, now))
+    return scheduler.PollScheduler(self.masters, clock=self.clock,
+                                   sleep=self.clock.Sleep, callback=Callback,
+                                   **kwargs)
+
+  def _Devices(self, name):
+    return self.masters[name].bus.devices
+
+  def _Conversions(self, name):
+    bus = self.masters[name].bus
+    return bus.pullup_time / ds18x20.CONVERSION_TIME
+
+  def testAchievedRate(self):
+    poll = self._Scheduler(4, buses=2)
+    for name in self.masters:
+      for device, interval in zip(self._Devices(name), (2, 2, 5, 10)):
+        poll.Add(name, device.rom, interval)
+    poll.Run(100)
+    report = poll.GetReport()
+    self.assertEqual(len(report), 8)
+    for bus, rom, target, achieved, samples, misses, errors in report:
+      self.assertEqual(samples, int(100 * target))
+      self.assertAlmostEqual(achieved, target, 2)
+      self.assertEqual((misses, errors), (0, 0))
+    # the buses run in parallel, so they do not slow each other down
+    self.assertTrue(99.0 <= self.clock.now <= 101.0)
+
+  def testCoalescing(self):
+    poll = self._Scheduler(10)
+    for device in self._Devices('bus0'):
+      poll.Add('bus0', device.rom, 10)
+      # added a little later each, but within the window
+      self.clock.Sleep(0.05)
+    poll.Run(95)
+    # one conversion and one round per interval for all 10 sensors
+    self.assertEqual(poll._rounds, 10)
+    self.assertEqual(self._Conversions('bus0'), 10)
+    self.assertEqual(len(self.samples), 100)
+    self.assertEqual(poll.RunOnce(), 10)
+
+  def testNoCoalescing(self):
+    poll = self._Scheduler(2, window=0.0)
+    first, second = self._Devices('bus0')
+    poll.Add('bus0', first.rom, 10)
+    poll.Run(5)
+    poll.Add('bus0', second.rom, 10)
+    poll.Run(50)
+    # every round samples a single sensor, with a conversion of its own
+    self.assertEqual(poll._rounds, 11)
+    self.assertEqual(len(self.samples), 11)
+    self.assertEqual(self._Conversions('bus0'), 11)
+
+  def testMisses(self):
+    # a conversion takes longer than the interval
+    poll = self._Scheduler(1)
+    rom = self._Devices('bus0')[0].rom
+    poll.Add('bus0', rom, 0.5)
+    poll.Run(60)
+    bus, rom, target, achieved, samples, misses, errors = poll.GetReport()[0]
+    self.assertEqual(target, 2.0)
+    self.assertTrue(0 < achieved < target)
+    self.assertEqual(misses, samples)
+    # samples fallen a whole interval behind are skipped, not made up
+    self.assertTrue(samples <= 60 / (ds18x20.CONVERSION_TIME / 1000.0))
+
+  def testErrors(self):
+    poll = self._Scheduler(2)
+    present, gone = self._Devices('bus0')
+    poll.Add('bus0', present.rom, 5)
+    poll.Add('bus0', gone.rom, 5)
+    poll.Run(20)
+    self.masters['bus0'].bus.RemoveDevice(gone)
+    poll.Run(20)
+    latest = poll.GetLatest()
+    self.assertEqual(latest['bus0', gone.rom], None)
+    self.assertNotEqual(latest['bus0', present.rom], None)
+    report = dict((r[1], r) for r in poll.GetReport())
+    self.assertEqual(report[gone.rom][6], 4)
+    self.assertEqual(report[present.rom][6], 0)
+    self.assertTrue(('bus0', gone.rom, None) in
+                    [sample[:3] for sample in self.samples])
+
+
+if __name__ == '__main__':
+  unittest.main()
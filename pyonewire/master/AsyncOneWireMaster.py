@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+"""
+asyncio facade for OneWire masters in the pyonewire package
+
+  Copyright 2008 mike wakerly <opensource@hoho.com>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+
+AsyncOneWireMaster runs the blocking calls of a master on a worker thread of
+its own and hands back futures of trollius, the port of asyncio to Python 2,
+so an event loop can drive several adapters and keep serving other work.
+Within a trollius coroutine:
+
+  master = AsyncOneWireMaster(ds2490.DS2490Master())
+  ids = yield From(master.Search())
+
+trollius is an optional dependency, installed with the 'async' extra.
+"""
+
+import Queue
+import threading
+import time
+
+import trollius as asyncio
+
+from pyonewire.master import GenericOneWireMaster
+
+
+# job flags
+_HOLD = 1     # keep later jobs back until the job's pullup is over
+
+
+class AsyncOneWireMaster(object):
+  """Runs the operations of one master on a dedicated thread.
+
+  Operations run one at a time, in the order they were called, and each
+  returns a future for its result. A write or pulse with a strong pullup
+  is called with wait=False, so it returns from the worker as soon as the
+  pullup has started: the pullup time is waited out with the event loop's
+  timer, later operations are held back until it is over, and the master's
+  WaitPullup then runs with the time already elapsed.
+
+  The methods must be called from the event loop's thread.
+  """
+  def __init__(self, master, loop=None):
+    self._master = master
+    self._loop = loop or asyncio.get_event_loop()
+    self._jobs = Queue.Queue()
+    self._held = None
+    # (timer handle, its callback) while a pullup is timed on the event loop
+    self._timer = None
+    self._closed = False
+    # (duration, start time) of the pullup left running by the worker
+    self._pullup = None
+    name = '%s worker' % master.__class__.__name__
+    self._thread = threading.Thread(target=self._Worker, name=name)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def GetMaster(self):
+    """Returns the wrapped master; only use it from the worker thread."""
+    return self._master
+
+  def Close(self, wait=True):
+    """Stop the worker thread once the operations queued so far are done.
+
+    A pullup still running, and those of the operations held back behind
+    it, are then waited out on the worker thread, as the event loop may be
+    blocked on the join.
+
+    Args
+      wait - if True, block until the worker thread has exited
+    """
+    self._closed = True
+    if self._held is not None:
+      if self._timer is not None:
+        handle, elapsed = self._timer
+        handle.cancel()
+        elapsed()
+      else:
+        self._jobs.put((self._FinishPullup, (), self._NewFuture(), 0))
+      held, self._held = self._held, None
+      for job in held:
+        self._jobs.put(job)
+        if job[3] & _HOLD:
+          self._jobs.put((self._FinishPullup, (), self._NewFuture(), 0))
+    self._jobs.put((None, None, None, 0))
+    if wait:
+      self._thread.join()
+
+  def _Worker(self):
+    while True:
+      fn, args, future, flags = self._jobs.get()
+      if fn is None:
+        break
+      try:
+        result = fn(*args)
+      except Exception, e:
+        self._loop.call_soon_threadsafe(_SetException, future, e)
+      else:
+        self._loop.call_soon_threadsafe(_SetResult, future, result)
+
+  def _NewFuture(self):
+    if hasattr(self._loop, 'create_future'):
+      return self._loop.create_future()
+    return asyncio.Future(loop=self._loop)
+
+  def _Queue(self, job):
+    if self._held is not None:
+      self._held.append(job)
+    else:
+      self._jobs.put(job)
+      if job[3] & _HOLD:
+        self._held = []
+
+  def _Release(self):
+    """Queue the jobs held back during a pullup, up to the next hold."""
+    held, self._held = self._held, None
+    while held:
+      self._Queue(held.pop(0))
+      if self._held is not None:
+        self._held.extend(held)
+        break
+
+  def _Submit(self, fn, *args):
+    future = self._NewFuture()
+    self._Queue((fn, args, future, 0))
+    return future
+
+  def _SubmitWithPullup(self, duration, fn, *args):
+    """Run |fn| on the worker, waiting out its pullup on the event loop.
+
+    Args
+      duration - length of the pullup |fn| ends with, in ms
+      fn - master method taking a wait argument, see StartPulse
+    """
+    result = self._NewFuture()
+    started = self._NewFuture()
+    self._Queue((self._StartPullup, (duration, fn, args), started, _HOLD))
+
+    def Started(f):
+      if f.exception() is not None:
+        self._Release()
+        _SetException(result, f.exception())
+      elif self._closed:
+        # Close left the pullup to the worker
+        _SetResult(result, f.result())
+      else:
+        callback = lambda: Elapsed(f.result())
+        self._timer = (self._loop.call_later(duration / 1000.0, callback),
+                       callback)
+
+    def Elapsed(ret):
+      self._timer = None
+      done = self._NewFuture()
+      # bypasses the hold, which is released once the pullup is over
+      self._jobs.put((self._FinishPullup, (), done, 0))
+      done.add_done_callback(lambda f: Finished(f, ret))
+
+    def Finished(f, ret):
+      self._Release()
+      if f.exception() is not None:
+        _SetException(result, f.exception())
+      else:
+        _SetResult(result, ret)
+
+    started.add_done_callback(Started)
+    return result
+
+  def _StartPullup(self, duration, fn, args):
+    """Call |fn| on the worker, leaving its pullup running."""
+    ret = fn(*args, wait=False)
+    self._pullup = (duration, time.time())
+    return ret
+
+  def _FinishPullup(self):
+    """Wait on the worker for the end of the pullup left by _StartPullup."""
+    if self._pullup is None:
+      return
+    (duration, start), self._pullup = self._pullup, None
+    self._master.WaitPullup(duration, (time.time() - start) * 1000)
+
+  # GenericOneWireMaster operations, returning futures
+
+  def Reset(self):
+    return self._Submit(self._master.Reset)
+
+  def ResetBus(self):
+    return self._Submit(self._master.ResetBus)
+
+  def StartPulse(self, delay):
+    return self._SubmitWithPullup(delay, self._master.StartPulse, delay)
+
+  def TouchBit(self, bit):
+    return self._Submit(self._master.TouchBit, bit)
+
+  def TouchBits(self, bits):
+    return self._Submit(self._master.TouchBits, bits)
+
+  def ReadBit(self):
+    return self._Submit(self._master.ReadBit)
+
+  def WriteBit(self, bit):
+    return self._Submit(self._master.WriteBit, bit)
+
+  def ReadByte(self):
+    return self._Submit(self._master.ReadByte)
+
+  def WriteByte(self, byte, pullup=0):
+    if pullup:
+      return self._SubmitWithPullup(pullup, self._master.WriteByte, byte,
+                                    pullup)
+    return self._Submit(self._master.WriteByte, byte)
+
+  def ReadBlock(self, numblocks):
+    return self._Submit(self._master.ReadBlock, numblocks)
+
+  def WriteBlock(self, data, pullup=0):
+    if pullup:
+      return self._SubmitWithPullup(pullup, self._master.WriteBlock, data,
+                                    pullup)
+    return self._Submit(self._master.WriteBlock, data)
+
+  def ReadInto(self, buf):
+    """Read into |buf| on the worker; leave |buf| alone until it is done."""
+    return self._Submit(self._master.ReadInto, buf)
+
+  def WriteStream(self, data, pullup=0):
+    if pullup:
+      return self._SubmitWithPullup(pullup, self._master.WriteStream, data,
+                                    pullup)
+    return self._Submit(self._master.WriteStream, data)
+
+  def Triplet(self, bdir):
+    return self._Submit(self._master.Triplet, bdir)
+
+  def SearchPass(self, search_type, target=0L,
+                 speed=GenericOneWireMaster.SPEED_REGULAR):
+    return self._Submit(self._master.SearchPass, search_type, target, speed)
+
+  def Search(self, search_type=None, **kwargs):
+    if search_type is None:
+      search_type = self._master.SEARCH_NORMAL
+    return self._Submit(lambda: self._master.Search(search_type, **kwargs))
+
+  def Transaction(self):
+    """Returns a new transaction of the wrapped master, see Execute."""
+    return self._master.Transaction()
+
+  def Execute(self, txn):
+    """Run a transaction from Transaction on the worker thread.
+
+    Pullups inside a transaction are waited for on the worker thread.
+    """
+    return self._Submit(txn.Execute)
+
+  def Call(self, fn, *args):
+    """Run fn(master, *args) on the worker thread, e.g. a device driver."""
+    return self._Submit(fn, self._master, *args)
+
+
+def _SetResult(future, result):
+  if not future.cancelled():
+    future.set_result(result)
+
+
+def _SetException(future, e):
+  if not future.cancelled():
+    future.set_exception(e)
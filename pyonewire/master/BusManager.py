@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+"""
+Multiple bus manager for the pyonewire package
+
+  Copyright 2008 mike wakerly <opensource@hoho.com>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+
+BusManager drives several bus masters from one process. Operations run on
+all buses at once, one thread per master, and the results are merged with
+each one tagged by the name of the bus it came from:
+
+  manager = BusManager.OpenDS2490Adapters()
+  for (bus, rom), temperature in manager.ReadTemperatures().iteritems():
+    print bus, '%016x' % rom, temperature
+"""
+
+import logging
+import threading
+
+
+class BusManager(object):
+  """Runs operations on several masters concurrently.
+
+  Each master is only ever used by one thread at a time. An operation that
+  fails on one bus does not stop the others: the exception is logged and
+  kept, see GetErrors.
+  """
+  def __init__(self, masters):
+    """
+    Args
+      masters - dict mapping bus names to masters
+    """
+    self._logger = logging.getLogger('busmanager')
+    self._masters = dict(masters)
+    self._errors = {}
+
+  def GetNames(self):
+    """Returns the sorted names of the buses."""
+    return sorted(self._masters)
+
+  def GetMaster(self, name):
+    return self._masters[name]
+
+  def GetErrors(self):
+    """Returns a dict of bus names to exceptions raised by the last Run."""
+    return dict(self._errors)
+
+  def Run(self, fn, *args):
+    """Call fn(master, *args) for every master, each in its own thread.
+
+    Returns
+      dict mapping bus names to the results, for the buses that succeeded
+    """
+    return self._RunAll(lambda name, master: fn(master, *args))
+
+  def RunNamed(self, fn, *args):
+    """Like Run, but calls fn(master, bus name, *args)."""
+    return self._RunAll(lambda name, master: fn(master, name, *args))
+
+  def _RunAll(self, call):
+    results = {}
+    errors = {}
+
+    def Call(name, master):
+      try:
+        results[name] = call(name, master)
+      except Exception, e:
+        self._logger.exception('bus %s failed' % name)
+        errors[name] = e
+
+    threads = []
+    for name, master in self._masters.iteritems():
+      thread = threading.Thread(target=Call, args=(name, master),
+                                name='bus %s' % name)
+      thread.start()
+      threads.append(thread)
+    for thread in threads:
+      thread.join()
+    self._errors = errors
+    return results
+
+  def Search(self, search_type=None, **kwargs):
+    """Search all buses; see GenericOneWireMaster.Search.
+
+    Returns
+      sorted list of (bus name, 64 bit id) tuples
+    """
+    def Search(master):
+      return master.Search(search_type or master.SEARCH_NORMAL, **kwargs)
+    ret = []
+    for name, ids in self.Run(Search).iteritems():
+      ret.extend([(name, rom) for rom in ids])
+    return sorted(ret)
+
+  def ReadTemperatures(self, roms=None):
+    """Convert and read the temperature sensors on all buses.
+
+    Args
+      roms - dict mapping bus names to the ids to read; buses missing from
+             it are searched
+    Returns
+      dict mapping (bus name, 64 bit id) to temperatures, see
+      ds18x20.DS18x20.Read
+    """
+    # imported here, device drivers build on the master package
+    from pyonewire.device import ds18x20
+    roms = roms or {}
+    def Read(master, name):
+      return ds18x20.ReadTemperatures(master, roms.get(name))
+    ret = {}
+    for name, temperatures in self.RunNamed(Read).iteritems():
+      for rom, temperature in temperatures.iteritems():
+        ret[name, rom] = temperature
+    return ret
+
+
+def OpenDS2490Adapters(**kwargs):
+  """Open every DS2490 adapter found, see ds2490.FindAdapters.
+
+  Buses are named 'bus:device' after their usb location.
+
+  Returns
+    a BusManager for the adapters
+  """
+  from pyonewire.master import ds2490
+  masters = {}
+  for bus, address, device in ds2490.FindAdapters(**kwargs):
+    masters['%s:%s' % (bus, address)] = ds2490.DS2490Master(device=device)
+  return BusManager(masters)
@@ -24,26 +24,342 @@ along with this program; if not, write to the Free Software
 Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
 """
 
+import struct
+import time
+
+from pyonewire.core import crc
+
+# ROM commands
+ROM_READ = 0x33
+ROM_MATCH = 0x55
+ROM_SKIP = 0xcc
+ROM_SEARCH = 0xf0
+ROM_ALARM_SEARCH = 0xec
+ROM_OVERDRIVE_SKIP = 0x3c
+ROM_OVERDRIVE_MATCH = 0x69
+
+# memory function commands of EEPROM devices such as the DS2433
+MEM_WRITE_SCRATCHPAD = 0x0f
+MEM_READ_SCRATCHPAD = 0xaa
+MEM_COPY_SCRATCHPAD = 0x55
+MEM_READ = 0xf0
+MEM_EXTENDED_READ = 0xa5
+
+# EEPROM page size, and time to program the scratchpad into memory, in ms
+EEPROM_PAGE_SIZE = 32
+EEPROM_PROGRAM_TIME = 10
+
+# bus speeds
+SPEED_REGULAR = 0
+SPEED_OVERDRIVE = 1
+
+# bytes per ReadBlock/WriteBlock call when streaming
+STREAM_CHUNK = 64
+
+# times a search pass is repeated if the id found fails its CRC
+SEARCH_RETRIES = 3
+
+def DecodeTriplet(id_bit, comp_bit, bdir):
+  """Pick the search direction from the id and complement bits of a triplet.
+
+  Args
+    id_bit - first bit read
+    comp_bit - second (complement) bit read
+    bdir - direction to choose if both are valid
+  Returns
+    0x03 if no device responded, otherwise the direction taken in bit 2, and
+    bit 1 set if only one direction was valid
+  """
+  if id_bit and comp_bit:
+    return 0x03 # error
+
+  if not id_bit and not comp_bit:
+    # both bits are valid, take the direction given
+    if bdir:
+      return 0x04
+    return 0
+
+  # only one bit is valid, take that direction
+  if id_bit:
+    return 0x05
+  return 0x02
+
+def BytesToBits(data):
+  """Returns the time slots writing |data|, least significant bit first."""
+  bits = []
+  for byte in data:
+    bits.extend([(byte >> i) & 1 for i in xrange(8)])
+  return bits
+
+def BitsToBytes(bits):
+  """Pack bits read, least significant first, into a list of bytes.
+
+  Trailing bits short of a whole byte are dropped.
+  """
+  ret = []
+  for i in xrange(0, len(bits) - 7, 8):
+    byte = 0
+    for j in xrange(8):
+      byte |= (bits[i+j] & 1) << j
+    ret.append(byte)
+  return ret
+
+def NextSearchStart(last_id, discrepancies):
+  """Compute the target of the search pass following |last_id|.
+
+  The next pass branches at the highest discrepancy where the last id took the
+  0 path: that bit is set, bits below it are kept and bits above it cleared.
+
+  Args
+    last_id - the 64 bit id found by the last pass
+    discrepancies - discrepancy bits of the last pass
+  Returns
+    64 bit id to direct the next pass with, or None if the search is complete
+  """
+  zeros = discrepancies & ~last_id & 0xffffffffffffffffL
+  if not zeros:
+    return None
+  bit = 1L << (zeros.bit_length() - 1)
+  return (last_id & (bit - 1)) | bit
+
+
 class GenericOneWireMaster(object):
   """Base class for onewire bus masters.
 
   This class is derived from the linux kernel struct w1_bus_master.
   """
+  SEARCH_NORMAL = ROM_SEARCH
+  SEARCH_ALARM = ROM_ALARM_SEARCH
+
+  def __init__(self):
+    self._speed = SPEED_REGULAR
+    self._use_overdrive = False
+    # ROM id -> True or False once known whether it supports overdrive
+    self._overdrive = {}
+
   def Reset(self):
     """Clear any device state"""
     raise NotImplementedError
 
-  def StartPulse(self, delay):
-    """Issue a onewire start pulse"""
+  def ResetBus(self):
+    """Issue a onewire reset pulse.
+
+    Masters whose Reset does not reset the bus itself override this; by
+    default it is the same as Reset.
+
+    Returns
+      True if a presence pulse was seen
+    """
+    self.Reset()
+    return True
+
+  def StartPulse(self, delay, wait=True):
+    """Issue a onewire start pulse.
+
+    Args
+      delay - length of the strong pullup, in ms
+      wait - if False, return as soon as the pullup has started; the caller
+             then has to call WaitPullup(delay, elapsed) before anything else
+    """
+    raise NotImplementedError
+
+  def SetSpeed(self, speed):
+    """Set the speed of the following resets and time slots.
+
+    Args
+      speed - SPEED_REGULAR or SPEED_OVERDRIVE
+    """
     raise NotImplementedError
 
+  def GetSpeed(self):
+    return self._speed
+
+  def EnableOverdrive(self, enable=True):
+    """Make Select use overdrive speed for devices that support it."""
+    self._use_overdrive = enable
+
+  def GetOverdriveCapability(self, rom):
+    """Returns True or False if it is known whether |rom| supports overdrive,
+    otherwise None."""
+    return self._overdrive.get(rom)
+
+  def SetOverdriveCapability(self, rom, capable):
+    """Record whether |rom| supports overdrive; None forgets it.
+
+    A driver that sees errors at overdrive speed can set False here to make
+    Select fall back to regular speed for the device.
+    """
+    if capable is None:
+      self._overdrive.pop(rom, None)
+    else:
+      self._overdrive[rom] = capable
+
+  def OverdriveSkip(self):
+    """Put every device supporting overdrive in overdrive and select them.
+
+    The bus is left at overdrive speed; devices without overdrive ignore the
+    bus until a regular speed reset. Searches, VerifyRom and transactions go
+    back to regular speed, except SearchPass given SPEED_OVERDRIVE.
+
+    Returns
+      True if a presence pulse was seen
+    """
+    self.SetSpeed(SPEED_REGULAR)
+    if not self.ResetBus():
+      return False
+    self.WriteByte(ROM_OVERDRIVE_SKIP)
+    self.SetSpeed(SPEED_OVERDRIVE)
+    return True
+
+  def Select(self, rom):
+    """Reset the bus and select a single device for a function command.
+
+    With overdrive enabled, devices are selected with Overdrive Match ROM,
+    unless known not to support it. The first time, a search pass for the
+    device at overdrive speed checks that it followed, since only devices in
+    overdrive take part; a device that did not is remembered and from then
+    on selected at regular speed with Match ROM. The bus is left at the
+    speed the device was selected at, for the function command; searches,
+    VerifyRom and transactions go back to regular speed.
+
+    Args
+      rom - 64 bit id of the device
+    Returns
+      True if a presence pulse was seen
+    """
+    rom_bytes = list(struct.unpack('8B', struct.pack('<Q', rom)))
+    capable = self._overdrive.get(rom)
+    if self._use_overdrive and capable is not False:
+      self.SetSpeed(SPEED_REGULAR)
+      if not self.ResetBus():
+        return False
+      self.WriteByte(ROM_OVERDRIVE_MATCH)
+      self.SetSpeed(SPEED_OVERDRIVE)
+      self.WriteBlock(rom_bytes)
+      if capable:
+        return True
+      # a search pass that finds the device leaves it selected
+      result = self.SearchPass(self.SEARCH_NORMAL, rom, SPEED_OVERDRIVE)
+      capable = result is not None and result[0] == rom
+      self._overdrive[rom] = capable
+      if capable:
+        return True
+    self.SetSpeed(SPEED_REGULAR)
+    if not self.ResetBus():
+      return False
+    self.WriteBlock([ROM_MATCH] + rom_bytes)
+    return True
+
+  def ReadMemory(self, rom, address, length):
+    """Read a memory device with Read Memory.
+
+    Args
+      rom - 64 bit id of the device
+      address - memory address to start at
+      length - number of bytes to read
+    Returns
+      list of the bytes read, or None if no device answered
+    """
+    if not self.Select(rom):
+      return None
+    self.WriteBlock([MEM_READ, address & 0xff, address >> 8])
+    return list(self.ReadBlock(length))
+
+  def ReadPages(self, rom, page, count, page_size=EEPROM_PAGE_SIZE):
+    """Read whole pages with Extended Read Memory, checking their CRC16.
+
+    The device follows every page with the inverted CRC16 of the page, the
+    first one also covering the command and address.
+
+    Args
+      rom - 64 bit id of the device
+      page - number of the first page
+      count - number of pages to read
+      page_size - page size of the device, in bytes
+    Returns
+      list of the page bytes, without CRCs, or None if no device answered
+    Raises
+      crc.CrcError if a page fails its CRC16
+    """
+    address = page * page_size
+    if not self.Select(rom):
+      return None
+    header = [MEM_EXTENDED_READ, address & 0xff, address >> 8]
+    self.WriteBlock(header)
+    seed = crc.Crc16(header)
+    ret = []
+    for i in xrange(count):
+      data = list(self.ReadBlock(page_size + 2))
+      if not crc.CheckCrc16(data, seed):
+        raise crc.CrcError, "page %i of %016x failed its CRC" % (page + i, rom)
+      ret.extend(data[:page_size])
+      seed = 0
+    return ret
+
+  def WriteScratchpad(self, rom, address, data):
+    """Select a memory device and write |data| to its scratchpad.
+
+    Returns
+      True if a presence pulse was seen
+    """
+    if not self.Select(rom):
+      return False
+    self.WriteBlock([MEM_WRITE_SCRATCHPAD, address & 0xff, address >> 8] +
+                    list(data))
+    return True
+
+  def WritePage(self, rom, address, data, page_size=EEPROM_PAGE_SIZE,
+                program_time=EEPROM_PROGRAM_TIME):
+    """Write to an EEPROM page through the scratchpad.
+
+    The scratchpad is written, read back and compared, then copied to memory
+    under a strong pullup.
+
+    Args
+      rom - 64 bit id of the device
+      address - memory address to start at
+      data - bytes to write, not crossing the end of a page
+      page_size - page size of the device, in bytes
+      program_time - time the copy takes, in ms
+    Returns
+      True if the data was written
+    """
+    if isinstance(data, str):
+      data = bytearray(data)
+    data = list(data)
+    if not data or address % page_size + len(data) > page_size:
+      raise ValueError, "data must be within one page"
+    if not self.WriteScratchpad(rom, address, data):
+      return False
+    if not self.Select(rom):
+      return False
+    self.WriteByte(MEM_READ_SCRATCHPAD)
+    echo = list(self.ReadBlock(3 + len(data)))
+    if echo[:2] != [address & 0xff, address >> 8] or echo[3:] != data:
+      return False
+    if not self.Select(rom):
+      return False
+    self.WriteBlock([MEM_COPY_SCRATCHPAD] + echo[:3], program_time)
+    # once the copy is done, the device answers with alternating 1s and 0s
+    return self.ReadByte() in (0xaa, 0x55)
+
+  def WaitPullup(self, duration, elapsed=0):
+    """Wait for a strong pullup started by a write or pulse to end.
+
+    Args
+      duration - length of the pullup, in ms
+      elapsed - ms of the pullup the caller has already waited for
+    """
+    if duration > elapsed:
+      time.sleep((duration - elapsed) / 1000.0)
+
   def ReadBit(self):
     """Sample the line level.
 
     Returns
       The level read (0 or 1)
     """
-    raise NotImplementedError
+    return self.TouchBits((1,))[0]
 
   def WriteBit(self, bit):
     """Set the bus line level.
@@ -53,7 +369,7 @@ class GenericOneWireMaster(object):
     Returns
       None
     """
-    raise NotImplementedError
+    self.TouchBits((bit,))
 
   def TouchBit(self, bit):
     """Low-level onewire function.
@@ -68,6 +384,20 @@ class GenericOneWireMaster(object):
     """
     raise NotImplementedError
 
+  def TouchBits(self, bits):
+    """Run a sequence of time slots, as TouchBit does for one.
+
+    The bit, byte and block methods are all built on this, so a master able
+    to run many slots in one go only needs to override it; by default each
+    slot is a TouchBit call.
+
+    Args
+      bits - sequence of bits to touch
+    Returns
+      list of the bits read
+    """
+    return [self.TouchBit(bit) for bit in bits]
+
   def ReadByte(self):
     """Read a byte from the bus.
 
@@ -76,19 +406,29 @@ class GenericOneWireMaster(object):
     Returns:
       the value read
     """
-    raise NotImplementedError
+    return BitsToBytes(self.TouchBits([1] * 8))[0]
 
-  def WriteByte(self, byte):
+  def WriteByte(self, byte, pullup=0, wait=True):
     """Write an entire byte to the bus.
 
     Equivalent to 8 TouchBit(x) calls.
 
     Args
       byte - value to write
+      pullup - if non-zero, apply a strong pullup for this many ms right
+               after the last bit, e.g. to power a Convert T or Copy
+               Scratchpad on parasite powered devices
+      wait - if False, return as soon as the pullup has started, see
+             StartPulse
     Returns
-      None
+      True if the byte read back differs from the one written
     """
-    raise NotImplementedError
+    ret = BitsToBytes(self.TouchBits(BytesToBits((byte,))))[0]
+    if pullup and wait:
+      self.StartPulse(pullup)
+    elif pullup:
+      self.StartPulse(pullup, wait=False)
+    return ret != byte
 
   def ReadBlock(self, numblocks):
     """Read a series of bytes form the bus.
@@ -100,19 +440,78 @@ class GenericOneWireMaster(object):
     Returns
       iterable of bytes returned
     """
-    raise NotImplementedError
+    return BitsToBytes(self.TouchBits([1] * (8 * numblocks)))
 
-  def WriteBlock(self, data):
+  def WriteBlock(self, data, pullup=0, wait=True):
     """Write several bytes to the bus.
 
     Equivalent to len(data) WriteByte calls.
 
     Args
       data - iterable of integers as bytes to write
+      pullup - if non-zero, apply a strong pullup for this many ms right
+               after the last byte
+      wait - if False, return as soon as the pullup has started, see
+             StartPulse
     Returns
-      None
+      True if the bytes read back differ from those written
     """
-    raise NotImplementedError
+    data = list(data)
+    ret = BitsToBytes(self.TouchBits(BytesToBits(data)))
+    if pullup and wait:
+      self.StartPulse(pullup)
+    elif pullup:
+      self.StartPulse(pullup, wait=False)
+    return ret != data
+
+  def IterReadBlock(self, numblocks, chunk=STREAM_CHUNK):
+    """Read a long series of bytes in chunks, as they arrive.
+
+    Args
+      numblocks - number of bytes to read
+      chunk - number of bytes per chunk
+    Yields
+      lists of the bytes read
+    """
+    while numblocks > 0:
+      size = min(numblocks, chunk)
+      yield list(self.ReadBlock(size))
+      numblocks -= size
+
+  def ReadInto(self, buf):
+    """Read len(buf) bytes into |buf|, a bytearray or writable memoryview.
+
+    Returns
+      number of bytes read
+    """
+    pos = 0
+    for data in self.IterReadBlock(len(buf)):
+      buf[pos:pos+len(data)] = bytearray(data)
+      pos += len(data)
+    return pos
+
+  def WriteStream(self, data, pullup=0, wait=True):
+    """Write a long series of bytes in chunks.
+
+    Args
+      data - iterable of integers as bytes to write, or a str; it is only
+             consumed as far as needed for the next chunk
+      pullup - if non-zero, apply a strong pullup for this many ms right
+               after the last byte
+      wait - if False, return as soon as the pullup has started, see
+             StartPulse
+    Returns
+      True if an error occurred
+    """
+    error = False
+    for chunk, last in _LastFlagged(_Chunks(data, STREAM_CHUNK)):
+      if last and not wait:
+        failed = self.WriteBlock(chunk, pullup, wait=False)
+      else:
+        failed = self.WriteBlock(chunk, last and pullup or 0)
+      if failed:
+        error = True
+    return error
 
   def Triplet(self, bdir):
     """Combination of two reads and smart write for ROM search.
@@ -122,91 +521,368 @@ class GenericOneWireMaster(object):
     Returns
       tuple of (id_bit, comp_bit, dir_taken)
     """
-    id_bit = self.TouchBit(1)
-    comp_bit = self.TouchBit(1)
+    id_bit, comp_bit = self.TouchBits((1, 1))
 
-    if id_bit and comp_bit:
-      return 0x03 # error
+    retval = DecodeTriplet(id_bit, comp_bit, bdir)
+    if retval != 0x03:
+      self.WriteBit(retval >> 2)
 
-    if not id_bit and not comp_bit:
-      # both bits are valid, take the direction given
-      if bdir:
-        retval = 0x04
-      else:
-        retval = 0
-    else:
-      # only one bit is valid, take that direction
-      bdir = id_bit
-      if id_bit:
-        retval = 0x05
-      else:
-        retval = 0x02
+    return retval
 
-    self.TouchBit(bdir)
+  def SearchPass(self, search_type, target=0L, speed=SPEED_REGULAR):
+    """Run a single pass of the ROM search.
 
-    return retval
+    Wherever both directions are valid, the pass takes the direction given by
+    the corresponding bit of |target|, so a known id can be verified by
+    searching for it, and the next id of a search is found by passing the
+    result of NextSearchStart.
+
+    Args
+      search_type - one of SEARCH_NORMAL, SEARCH_ALARM
+      target - 64 bit id giving the direction at each discrepancy
+      speed - speed of the pass; at SPEED_OVERDRIVE only devices already in
+              overdrive take part
+    Returns
+      tuple of (64 bit id found, bit mask of the discrepancies along its
+      path), or None if no device responded
+    """
+    self.SetSpeed(speed)
+    if not self.ResetBus():
+      return None
+
+    self.WriteByte(search_type)
+
+    rn = 0L
+    discrepancies = 0L
+    for i in xrange(64):
+      # read two bits and write one bit
+      triplet_ret = self.Triplet((target >> i) & 0x1)
+
+      if (triplet_ret & 0x03) == 0x03:
+        # quit if no devices responded
+        return None
+
+      # both directions were valid
+      if not triplet_ret & 0x03:
+        discrepancies |= 1L << i
 
-  def Search(self, search_type):
-    """Generator that performs search and yields address found.
+      # extract the direction taken & update the device number
+      rn |= long(triplet_ret >> 2) << i
+
+    return rn, discrepancies
+
+  def Search(self, search_type, family=None, prefix=None, prefix_bits=8,
+             skip_families=(), check_crc=False):
+    """Performs a search and returns the addresses found.
+
+    The search can be restricted to one family, or more generally to ids
+    starting with a given prefix: the passes are directed into that subtree
+    of the ROM tree and the search stops as soon as it would leave it.
+    Skipped families cost one pass each, however many devices they have.
 
     Args
       search_type - one of SEARCH_NORMAL, SEARCH_ALARM
+      family - only find devices with this family code
+      prefix - only find ids whose low |prefix_bits| bits equal this
+      prefix_bits - number of bits in |prefix|
+      skip_families - family codes to leave out
+      check_crc - if True, repeat passes that find an id with a bad CRC8
+    Returns
+      list of 64 bit integer ids found
+    Raises
+      crc.CrcError if a pass keeps finding an id with a bad CRC8
+    """
+    return list(self.IterSearch(search_type, family, prefix, prefix_bits,
+                                skip_families, check_crc))
+
+  def IterSearch(self, search_type, family=None, prefix=None, prefix_bits=8,
+                 skip_families=(), check_crc=False):
+    """Search pass by pass, yielding each id as its pass finds it.
+
+    The passes only run as the ids are asked for, so the master can be used
+    for other things in between. See Search for the arguments.
+
     Yields
-      64 bit integer ids found
+      64 bit integer ids
+    Raises
+      crc.CrcError if a pass keeps finding an id with a bad CRC8
     """
-    last_rn = 0L
-    rn = 0L
-    tmp64 = 0L
-    i = 0L
-    last_device = 0L
-    last_zero = -1L
+    if family is not None:
+      prefix, prefix_bits = family, 8
+    elif prefix is None:
+      prefix, prefix_bits = 0L, 0
+    mask = (1L << prefix_bits) - 1
+    target = prefix
+    retries = 0
+    while target is not None and (target & mask) == prefix:
+      result = self.SearchPass(search_type, target)
+      if result is None:
+        break
+      rn, discrepancies = result
+      if check_crc and not crc.CheckRom(rn):
+        retries += 1
+        if retries > SEARCH_RETRIES:
+          raise crc.CrcError, "search found bad id %016x" % rn
+        continue
+      retries = 0
+      if (rn & mask) != prefix:
+        # nothing left in the subtree
+        break
+      if (rn & 0xff) in skip_families:
+        # branch off at the family code, past the rest of the family
+        target = NextSearchStart(rn, discrepancies & 0xff)
+        continue
+      yield rn
+      target = NextSearchStart(rn, discrepancies)
+
+  def VerifyRom(self, rom):
+    """Check that a device is on the bus.
+
+    A presence pulse after Match ROM could come from any device, so a search
+    pass directed at the id is run instead: it only ends on |rom| if that
+    device took part. As the path is known beforehand, the direction bits
+    are written whatever the bits read, and the whole pass is a single
+    TouchBits call.
 
-    desc_bit = 64
+    Returns
+      True if the device answered
+    """
+    return self.VerifyPath(rom) is not None
 
-    ret = []
+  def VerifyPath(self, rom):
+    """Check that a device is on the bus, and where its path branches.
 
-    def pick_search_bit(i, desc_bit, last_rn):
-      if i == desc_bit:
-        # took 0 path last time, so take 1 path
-        return 1
-      elif i > desc_bit:
-        # take the 0 path on the next branch
-        return 0
-      else:
-        return ((last_rn >> i) & 0x1)
+    Runs the same pass as VerifyRom. Where both slots read for a bit are low,
+    devices on the bus went both ways: that is a discrepancy of the pass.
 
-    while not last_device:
-      last_rn = rn
-      rn = 0L
+    Returns
+      bit mask of the discrepancies along the path to |rom|, or None if the
+      device did not answer
+    """
+    self.SetSpeed(SPEED_REGULAR)
+    if not self.ResetBus():
+      return None
+    self.WriteByte(ROM_SEARCH)
+    path = [(rom >> i) & 1 for i in xrange(64)]
+    bits = []
+    for bit in path:
+      bits.extend((1, 1, bit))
+    read = self.TouchBits(bits)
+    # the devices left on the path pull the slot of the other direction low:
+    # the complement slot when going the 1 way, the id slot when going 0
+    discrepancies = 0L
+    for i, bit in enumerate(path):
+      if read[3*i + bit]:
+        return None
+      if not read[3*i + 1 - bit]:
+        discrepancies |= 1L << i
+    return discrepancies
+
+  def VerifyRoms(self, roms):
+    """Returns the ids in |roms| of the devices on the bus, see VerifyRom."""
+    roms = list(roms)
+    return [rom for rom, path in zip(roms, self.VerifyPaths(roms))
+            if path is not None]
+
+  def VerifyPaths(self, roms):
+    """Returns the VerifyPath result for each id in |roms|, in order."""
+    return [self.VerifyPath(rom) for rom in roms]
+
+  def Transaction(self):
+    """Returns a new, empty Transaction for this master."""
+    return Transaction(self)
+
+
+# Transaction operation types
+OP_RESET = 0
+OP_WRITE = 1
+OP_READ_BYTE = 2
+OP_READ_BLOCK = 3
+OP_PULSE = 4
+
+class Transaction(object):
+  """A sequence of bus operations executed together.
+
+  Operations are queued with the methods below and run by Execute, which
+  returns the data read by every ReadByte and ReadBlock, in order. Masters
+  that can batch commands in hardware override Execute; this implementation
+  runs the operations one by one. Transactions run at regular speed, and can
+  be executed repeatedly.
+
+  Example:
+
+    txn = master.Transaction()
+    txn.Reset()
+    txn.WriteBlock([0x55] + rom_bytes + [0xbe])
+    txn.ReadBlock(9)
+    scratchpad, = txn.Execute()
+  """
+  def __init__(self, master):
+    self._master = master
+    self._ops = []
+    self._transfers = None
 
-      # Reset bus
-      self.Reset()
+  def Reset(self):
+    """Queue a bus reset."""
+    self._ops.append((OP_RESET, None, 0))
 
-      self.WriteByte(search_type)
+  def WriteByte(self, byte, pullup=0):
+    """Queue a single byte write; see GenericOneWireMaster.WriteByte."""
+    self._ops.append((OP_WRITE, [byte], pullup))
 
-      for i in xrange(64):
-        # Determine the direction/search bit
-        search_bit = pick_search_bit(i, desc_bit, last_rn)
+  def WriteBlock(self, data, pullup=0):
+    """Queue a block write; see GenericOneWireMaster.WriteBlock."""
+    self._ops.append((OP_WRITE, list(data), pullup))
 
-        # read two bits and write one bit
-        triplet_ret = self.Triplet(search_bit)
+  def ReadByte(self):
+    """Queue a single byte read; its result is an integer."""
+    self._ops.append((OP_READ_BYTE, 1, 0))
 
-        if (triplet_ret & 0x03) == 0x03:
-          # quit if no devices responded
-          break
+  def ReadBlock(self, numblocks):
+    """Queue a block read; its result is a list of integers."""
+    self._ops.append((OP_READ_BLOCK, numblocks, 0))
 
-        # if both directions were valid & we took the 0 path
-        if triplet_ret == 0:
-          last_zero = i
+  def Pulse(self, delay):
+    """Queue a strong pullup pulse of |delay| ms."""
+    self._ops.append((OP_PULSE, None, delay))
 
-        # extract the direction taken & update the device number
-        tmp64 = triplet_ret >> 2
-        rn |= (tmp64 << i)
+  def GetTransferCount(self):
+    """Returns the number of adapter transfers used by the last Execute.
 
-      if triplet_ret & 0x03 != 0x03:
-        if desc_bit == last_zero or last_zero < 0:
-          last_device = True
-        desc_bit = last_zero
-        ret.append(rn)
+    None if the master does not count its transfers.
+    """
+    return self._transfers
 
-    return ret
+  def Execute(self):
+    """Run all queued operations.
+
+    Returns
+      list with the result of each read operation, in order
+    """
+    master = self._master
+    master.SetSpeed(SPEED_REGULAR)
+    results = []
+    for op, arg, pullup in self._ops:
+      if op == OP_RESET:
+        master.ResetBus()
+      elif op == OP_WRITE:
+        master.WriteBlock(arg, pullup)
+      elif op == OP_READ_BYTE:
+        results.append(master.ReadByte())
+      elif op == OP_READ_BLOCK:
+        results.append(list(master.ReadBlock(arg)))
+      elif op == OP_PULSE:
+        master.StartPulse(pullup)
+    return results
+
+
+def _Chunks(data, size):
+  """Yields lists of up to |size| byte values taken from |data|."""
+  if isinstance(data, str):
+    data = bytearray(data)
+  chunk = []
+  for byte in data:
+    chunk.append(byte)
+    if len(chunk) == size:
+      yield chunk
+      chunk = []
+  if chunk:
+    yield chunk
+
+
+def _LastFlagged(iterable):
+  """Yields (item, True if it is the last one) for each item of |iterable|."""
+  items = iter(iterable)
+  try:
+    previous = items.next()
+  except StopIteration:
+    return
+  for item in items:
+    yield previous, False
+    previous = item
+  yield previous, True
+
+
+# IncrementalSearch events
+DEVICE_ADDED = 'added'
+DEVICE_REMOVED = 'removed'
+
+class IncrementalSearch(object):
+  """ROM search that keeps track of the devices on a bus between runs.
+
+  The ids found last time make up a cached search tree. An Update verifies
+  each of them with VerifyPaths, which also reports the discrepancies along
+  its path, and compares those with the tree: a discrepancy whose other
+  branch holds no verified id leads to devices that are new, or that
+  replaced all the devices there, and only that subtree is searched.
+  Subtrees that lost their branch are dropped without running any pass. On
+  a bus that did not change, an Update costs one verify per device and no
+  search passes.
+
+  Example:
+
+    search = IncrementalSearch(master)
+    while True:
+      for event, rom in search.Update():
+        print event, '%016x' % rom
+  """
+  def __init__(self, master):
+    self._master = master
+    self._known = set()
+
+  def GetDevices(self):
+    """Returns the sorted list of ids found by the last Update."""
+    return sorted(self._known)
+
+  def Update(self):
+    """Check the bus against the devices found last time.
+
+    Ids that fail to verify are verified once more, and the subtree searches
+    repeat passes finding an id with a bad CRC8, so that a damaged pass does
+    not show up as a device removed and added.
+
+    Returns
+      list of (DEVICE_REMOVED or DEVICE_ADDED, 64 bit id) events
+    Raises
+      crc.CrcError if a pass keeps finding an id with a bad CRC8
+    """
+    master = self._master
+    known = sorted(self._known)
+    paths = dict(zip(known, master.VerifyPaths(known)))
+    missing = [rom for rom in known if paths[rom] is None]
+    if missing:
+      paths.update(zip(missing, master.VerifyPaths(missing)))
+    paths = dict((rom, path) for rom, path in paths.iteritems()
+                 if path is not None)
+
+    found = set(paths)
+    if not paths:
+      found.update(master.Search(ROM_SEARCH, check_crc=True))
+    for prefix, prefix_bits in self._Unexplored(paths):
+      found.update(master.Search(ROM_SEARCH, prefix=prefix,
+                                 prefix_bits=prefix_bits, check_crc=True))
+
+    removed = sorted(self._known - found)
+    added = sorted(found - self._known)
+    self._known = found
+    return ([(DEVICE_REMOVED, rom) for rom in removed] +
+            [(DEVICE_ADDED, rom) for rom in added])
+
+  def _Unexplored(self, paths):
+    """Find the branches of the bus that no verified id accounts for.
+
+    Args
+      paths - dict of verified id -> discrepancies along its path
+    Returns
+      sorted list of (prefix, prefix_bits) of the subtrees to search
+    """
+    branches = set()
+    for rom, discrepancies in paths.iteritems():
+      while discrepancies:
+        bit = discrepancies & -discrepancies
+        discrepancies ^= bit
+        branches.add(((rom & (bit - 1)) | (~rom & bit), bit.bit_length()))
+    lengths = set(prefix_bits for prefix, prefix_bits in branches)
+    covered = set((rom & ((1L << prefix_bits) - 1), prefix_bits)
+                  for rom in paths for prefix_bits in lengths)
+    return sorted(branches - covered)
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+"""
+Cached device inventory for the pyonewire package
+
+  Copyright 2008 mike wakerly <opensource@hoho.com>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+
+RomInventory saves a full search for process startup: the ids found last
+time are loaded from an inventory file (see core/inventory.py), checked with
+directed search passes, and can be used right away while a full search runs
+on a background thread and brings the file up to date:
+
+  inventory = RomInventory(master, '/var/cache/onewire.inv', 'bus0')
+  roms = inventory.Start()
+  readings = ds18x20.ReadTemperatures(master, roms)   # hold inventory.lock
+
+The background search takes the lock for one id at a time, so that the
+master can be used in between; other users of the master must hold the lock
+while they do.
+"""
+
+import logging
+import threading
+import time
+
+from pyonewire.core import inventory
+
+# serializes updates of inventory files shared by several adapters
+_file_lock = threading.Lock()
+
+
+class RomInventory(object):
+  """The devices on one master's bus, backed by an inventory file."""
+  def __init__(self, master, path, name='default', lock=None, clock=time.time):
+    """
+    Args
+      master - a GenericOneWireMaster
+      path - inventory file, shared by any number of adapters
+      name - name of the adapter in the file
+      lock - lock held around every use of the master, by default a new one
+      clock - returns the current time, in seconds since the epoch
+    """
+    self._logger = logging.getLogger('rominventory')
+    self._master = master
+    self._path = path
+    self._name = name
+    self._clock = clock
+    self.lock = lock or threading.RLock()
+    self._inventory = inventory.Inventory()
+    self._thread = None
+
+  def GetRoms(self):
+    """Returns the ids currently believed to be on the bus, sorted."""
+    return self._inventory.GetRoms()
+
+  def GetSearchTime(self):
+    """Returns when the bus was last searched in full, 0 if never."""
+    return self._inventory.searched
+
+  def Load(self):
+    """Read this adapter's ids from the inventory file.
+
+    Returns
+      the ids, sorted; empty if the file is missing or damaged
+    """
+    self._inventory = inventory.Load(self._path).get(self._name,
+                                                     inventory.Inventory())
+    return self.GetRoms()
+
+  def Save(self):
+    """Write this adapter's ids to the inventory file."""
+    _file_lock.acquire()
+    try:
+      inventories = inventory.Load(self._path)
+      inventories[self._name] = self._inventory
+      inventory.Save(self._path, inventories)
+    finally:
+      _file_lock.release()
+
+  def Verify(self):
+    """Check that the loaded devices are still on the bus.
+
+    The ids are checked together with the master's VerifyRoms, which the
+    DS2490 and DS2480B run as batches of directed search passes.
+
+    Returns
+      the ids that answered, which replace the ids held
+    """
+    now = self._clock()
+    self.lock.acquire()
+    try:
+      present = self._master.VerifyRoms(self.GetRoms())
+    finally:
+      self.lock.release()
+    searched = self._inventory.searched
+    self._inventory = inventory.Inventory(searched)
+    self._inventory.MarkSeen(present, now)
+    return present
+
+  def Refresh(self):
+    """Search the bus in full and save the result.
+
+    The search runs with the master's IterSearch, taking the lock for each
+    id. Passes finding an id with a bad CRC8 are repeated.
+
+    Returns
+      the ids found, sorted
+    Raises
+      crc.CrcError if a pass keeps finding an id with a bad CRC8
+    """
+    master = self._master
+    ids = master.IterSearch(master.SEARCH_NORMAL, check_crc=True)
+    roms = []
+    while True:
+      self.lock.acquire()
+      try:
+        rom = next(ids, None)
+      finally:
+        self.lock.release()
+      if rom is None:
+        break
+      roms.append(rom)
+    self._inventory.Replace(roms, self._clock())
+    self.Save()
+    return self.GetRoms()
+
+  def Start(self, verify=True, refresh=True):
+    """Load the cached ids and start refreshing them in the background.
+
+    Args
+      verify - if True, drop cached devices that no longer answer
+      refresh - if True, start a full search on a background thread
+    Returns
+      the ids usable right away
+    """
+    self.Load()
+    if verify:
+      self.Verify()
+    if refresh:
+      self._thread = threading.Thread(target=self._Refresh,
+                                      name='inventory %s' % self._name)
+      self._thread.daemon = True
+      self._thread.start()
+    return self.GetRoms()
+
+  def _Refresh(self):
+    try:
+      self.Refresh()
+    except Exception:
+      self._logger.exception('refreshing %s failed' % self._name)
+
+  def Wait(self, timeout=None):
+    """Wait for the background search started by Start.
+
+    Returns
+      True if no search is running any more
+    """
+    if self._thread is not None:
+      self._thread.join(timeout)
+      if self._thread.isAlive():
+        return False
+      self._thread = None
+    return True
@@ -0,0 +1,809 @@
+#!/usr/bin/env python
+"""
+Simulated OneWire bus and master for the pyonewire package
+
+  Copyright 2008 mike wakerly <opensource@hoho.com>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+
+The bus is modelled one time slot at a time: every device that is taking
+part in the current exchange may pull the line low, and the level seen by the
+master and all devices is the wired-AND of the master and device levels.
+This makes ROM search, alarm search and collisions behave as they do on real
+hardware, without any adapter attached.
+"""
+
+import collections
+import struct
+
+from pyonewire.core import crc
+from pyonewire.core import util
+from pyonewire.master import GenericOneWireMaster
+
+# Bus timings at standard speed, in microseconds
+RESET_TIME = 960
+SLOT_TIME = 65
+
+# and at overdrive speed
+OVERDRIVE_RESET_TIME = 120
+OVERDRIVE_SLOT_TIME = 10
+
+
+def MakeRom(family, serial):
+  """Build a 64 bit ROM id from a family code and 48 bit serial number.
+
+  Returns
+    ROM id with a valid CRC8 in the top byte
+  """
+  return util.MakeId(family, serial)
+
+
+class VirtualDevice(object):
+  """A slave device on a SimulatedBus.
+
+  Devices see the bus one time slot at a time: Drive returns the level the
+  device puts on the line for the next slot (1 if it leaves it alone) and
+  Sample is called with the level that resulted. Protocols are built from
+  _Send, which queues bits to drive, and _Receive, which collects bits and
+  passes them to a handler. A device with nothing to send and no handler
+  ignores the bus until the next reset.
+
+  Subclasses implement FunctionCommand to handle commands sent after the
+  device was selected by a ROM command.
+
+  Devices with the overdrive attribute set answer Overdrive Skip and Match
+  ROM; in_overdrive tells whether the device is running at overdrive speed.
+  """
+  FAMILY = 0x00
+  OVERDRIVE = False
+
+  def __init__(self, serial, family=None):
+    if family is None:
+      family = self.FAMILY
+    self.rom = MakeRom(family, serial)
+    self.alarm = False
+    self.overdrive = self.OVERDRIVE
+    self.in_overdrive = False
+    self._tx = collections.deque()
+    self._tx_done = None
+    self._Idle()
+
+  def __repr__(self):
+    return '<%s %016x>' % (self.__class__.__name__, self.rom)
+
+  def _Idle(self):
+    self._search_index = None
+    self._search_phase = 0
+    self._tx.clear()
+    self._tx_done = None
+    self._rx_handler = None
+    self._rx_bits = 0
+    self._rx_count = 0
+    self._rx_value = 0L
+
+  def _Send(self, value, nbits, then=None):
+    """Drive |nbits| of |value|, LSB first, then call |then|."""
+    for i in xrange(nbits):
+      self._tx.append((value >> i) & 1)
+    self._tx_done = then
+
+  def _SendBytes(self, data, then=None):
+    for byte in data:
+      self._Send(byte, 8)
+    self._tx_done = then
+
+  def _Receive(self, nbits, handler):
+    """Collect |nbits| from the bus, LSB first, and pass them to |handler|."""
+    self._rx_handler = handler
+    self._rx_bits = nbits
+    self._rx_count = 0
+    self._rx_value = 0L
+
+  def IsActive(self):
+    return (bool(self._tx) or self._rx_handler is not None or
+            self._search_index is not None)
+
+  def CanReceiveByte(self):
+    """True if the next 8 slots are all received, byte aligned."""
+    return (not self._tx and self._rx_handler is not None and
+            not self._rx_count & 7 and self._rx_bits - self._rx_count >= 8)
+
+  def GetSearchIndex(self):
+    """Returns the ROM bit a triplet would start on, or None.
+
+    Only set between triplets of a search, when the next slot is the id bit.
+    """
+    if self._search_phase:
+      return None
+    return self._search_index
+
+  def BusReset(self):
+    """Handle a reset pulse.
+
+    Returns
+      True to answer with a presence pulse
+    """
+    self._Idle()
+    self._Receive(8, self._RomCommand)
+    return True
+
+  def Drive(self):
+    if self._tx:
+      return self._tx[0]
+    if self._search_index is not None and self._search_phase < 2:
+      return ((self.rom >> self._search_index) & 1) ^ self._search_phase
+    return 1
+
+  def Sample(self, level):
+    if self._search_index is not None:
+      if self._search_phase < 2:
+        self._search_phase += 1
+      else:
+        self.SearchDirection(level)
+      return
+    if self._tx:
+      self._tx.popleft()
+      if not self._tx and self._tx_done:
+        done = self._tx_done
+        self._tx_done = None
+        done()
+      return
+    if self._rx_handler is None:
+      return
+    self._rx_value |= long(level) << self._rx_count
+    self._rx_count += 1
+    self._Received()
+
+  def ReceiveByte(self, byte):
+    """Fast path for 8 received slots; only valid if CanReceiveByte()."""
+    self._rx_value |= long(byte) << self._rx_count
+    self._rx_count += 8
+    self._Received()
+
+  def _Received(self):
+    if self._rx_count == self._rx_bits:
+      handler = self._rx_handler
+      value = self._rx_value
+      self._rx_handler = None
+      self._rx_count = 0
+      self._rx_value = 0L
+      handler(value)
+
+  def _RomCommand(self, cmd):
+    if cmd == GenericOneWireMaster.ROM_SEARCH:
+      self._SearchBit(0)
+    elif cmd == GenericOneWireMaster.ROM_ALARM_SEARCH and self.alarm:
+      self._SearchBit(0)
+    elif cmd == GenericOneWireMaster.ROM_MATCH:
+      self._Receive(8, self._MatchRom)
+    elif cmd == GenericOneWireMaster.ROM_SKIP:
+      self._Selected()
+    elif cmd == GenericOneWireMaster.ROM_READ:
+      self._Send(self.rom, 64, self._Selected)
+    elif cmd == GenericOneWireMaster.ROM_OVERDRIVE_SKIP and self.overdrive:
+      self.in_overdrive = True
+      self._Selected()
+    elif cmd == GenericOneWireMaster.ROM_OVERDRIVE_MATCH and self.overdrive:
+      self.in_overdrive = True
+      self._Receive(8, self._MatchRom)
+    else:
+      self._Idle()
+
+  def _SearchBit(self, i):
+    # each ROM bit is a triplet: the bit, its complement, then the direction
+    # chosen by the master
+    self._search_index = i
+    self._search_phase = 0
+
+  def SetSearchIndex(self, index):
+    """Continue a search at the start of the triplet for ROM bit |index|."""
+    self._Idle()
+    self._search_index = index
+    self._search_phase = 0
+
+  def SearchDirection(self, direction):
+    """Handle the direction slot of a search triplet."""
+    i = self._search_index
+    if direction != (self.rom >> i) & 1:
+      self._Idle()
+    elif i == 63:
+      self._search_index = None
+      self._Selected()
+    else:
+      self._search_index = i + 1
+      self._search_phase = 0
+
+  def _MatchRom(self, byte, index=0):
+    # compare byte by byte, so that the bus can drop mismatching devices
+    # early
+    if byte != (self.rom >> (index * 8)) & 0xff:
+      self._Idle()
+    elif index == 7:
+      self._Selected()
+    else:
+      self._Receive(8, lambda b: self._MatchRom(b, index + 1))
+
+  def Select(self):
+    """Enter the state of a device just selected by a ROM command."""
+    self._Idle()
+    self._Selected()
+
+  def _Selected(self):
+    self._Receive(8, self.FunctionCommand)
+
+  def FunctionCommand(self, cmd):
+    """Handle a command byte sent to this device after selection."""
+    self._Idle()
+
+
+class VirtualDS18B20(VirtualDevice):
+  """DS18B20 temperature sensor with a settable temperature.
+
+  Convert T latches the temperature attribute into the scratchpad.
+  """
+  FAMILY = 0x28
+
+  def __init__(self, serial, temperature=25.0, parasite=False, family=None):
+    VirtualDevice.__init__(self, serial, family)
+    self.temperature = temperature
+    self.parasite = parasite
+    self.conversions = 0
+    # alarm limits default to the full range, so nothing alarms until set
+    self._scratchpad = [0x50, 0x05, 0x7d, 0xc9, 0x7f, 0xff, 0x0c, 0x10]
+
+  def EncodeTemperature(self, temperature):
+    """Returns the scratchpad temperature register for |temperature|."""
+    return int(round(temperature * 16)) & 0xffff
+
+  def Scratchpad(self):
+    """Returns the 9 scratchpad bytes, including the CRC."""
+    return self._scratchpad + [crc.Crc8(self._scratchpad)]
+
+  def _UpdateAlarm(self):
+    raw = self._scratchpad[0] | (self._scratchpad[1] << 8)
+    if raw & 0x8000:
+      raw -= 0x10000
+    whole = raw >> 4
+    high = struct.unpack('b', chr(self._scratchpad[2]))[0]
+    low = struct.unpack('b', chr(self._scratchpad[3]))[0]
+    self.alarm = whole >= high or whole <= low
+
+  def FunctionCommand(self, cmd):
+    if cmd == 0x44: # convert T
+      raw = self.EncodeTemperature(self.temperature)
+      self._scratchpad[0] = raw & 0xff
+      self._scratchpad[1] = (raw >> 8) & 0xff
+      self.conversions += 1
+      self._UpdateAlarm()
+      self._Idle()
+    elif cmd == 0xbe: # read scratchpad
+      self._SendBytes(self.Scratchpad())
+    elif cmd == 0x4e: # write scratchpad
+      self._Receive(24, self._WriteScratchpad)
+    elif cmd == 0xb4: # read power supply
+      self._Send(int(not self.parasite), 1)
+    else:
+      self._Idle()
+
+  def _WriteScratchpad(self, value):
+    self._scratchpad[2] = value & 0xff
+    self._scratchpad[3] = (value >> 8) & 0xff
+    self._scratchpad[4] = ((value >> 16) & 0x60) | 0x1f
+    self._UpdateAlarm()
+
+
+class VirtualDS18S20(VirtualDS18B20):
+  """DS18S20 temperature sensor: 9 bit readings plus COUNT_REMAIN."""
+  FAMILY = 0x10
+
+  def EncodeTemperature(self, temperature):
+    return int(round(temperature * 2)) & 0xffff
+
+  def FunctionCommand(self, cmd):
+    if cmd == 0x44:
+      # COUNT_REMAIN gives back the fraction the whole degree reading drops:
+      # T = TEMP_READ - 0.25 + (COUNT_PER_C - COUNT_REMAIN) / COUNT_PER_C
+      whole = int(round(self.temperature * 2)) >> 1
+      remain = 16 - int(round((self.temperature - whole + 0.25) * 16))
+      self._scratchpad[6] = min(max(remain, 0), 16)
+      self._scratchpad[7] = 16
+    VirtualDS18B20.FunctionCommand(self, cmd)
+
+
+class VirtualDS2433(VirtualDevice):
+  """DS2433 4Kb EEPROM, written a page at a time through its scratchpad.
+
+  The memory is the memory attribute, a list of byte values; copies done
+  are counted in writes.
+  """
+  FAMILY = 0x23
+  OVERDRIVE = True
+  MEMORY_SIZE = 512
+  PAGE_SIZE = 32
+
+  # ending offset flags
+  ES_AA = 0x80  # copy done
+  ES_PF = 0x20  # partial byte written
+
+  def __init__(self, serial, family=None):
+    VirtualDevice.__init__(self, serial, family)
+    self.memory = [0xff] * self.MEMORY_SIZE
+    self.writes = 0
+    self._target = 0
+    self._es = 0
+    self._scratchpad = [0xff] * self.PAGE_SIZE
+
+  def FunctionCommand(self, cmd):
+    if cmd == GenericOneWireMaster.MEM_WRITE_SCRATCHPAD:
+      self._Receive(16, self._WriteScratchpad)
+    elif cmd == GenericOneWireMaster.MEM_READ_SCRATCHPAD:
+      start = self._target % self.PAGE_SIZE
+      end = (self._es & (self.PAGE_SIZE - 1)) + 1
+      self._SendBytes([self._target & 0xff, self._target >> 8, self._es] +
+                      self._scratchpad[start:end])
+    elif cmd == GenericOneWireMaster.MEM_COPY_SCRATCHPAD:
+      self._Receive(24, self._CopyScratchpad)
+    elif cmd == GenericOneWireMaster.MEM_READ:
+      self._Receive(16, self._ReadMemory)
+    else:
+      self._Idle()
+
+  def _WriteScratchpad(self, target):
+    self._target = target
+    self._es = (target % self.PAGE_SIZE) | self.ES_PF
+    offset = target % self.PAGE_SIZE
+    self._Receive(8, lambda b: self._ScratchpadByte(b, offset))
+
+  def _ScratchpadByte(self, byte, offset):
+    # bytes past the end of the page are dropped
+    if offset < self.PAGE_SIZE:
+      self._scratchpad[offset] = byte
+      self._es = offset
+    self._Receive(8, lambda b: self._ScratchpadByte(b, offset + 1))
+
+  def _CopyScratchpad(self, value):
+    if value != self._target | (self._es << 16) or self._es & self.ES_PF:
+      self._Idle()
+      return
+    base = self._target - self._target % self.PAGE_SIZE
+    for offset in xrange(self._target % self.PAGE_SIZE, self._es + 1):
+      if base + offset < self.MEMORY_SIZE:
+        self.memory[base + offset] = self._scratchpad[offset]
+    self._es |= self.ES_AA
+    self.writes += 1
+    self._SendDone()
+
+  def _SendDone(self):
+    self._SendBytes([0xaa], self._SendDone)
+
+  def _ReadMemory(self, address):
+    # the rest of the memory is sent a page at a time
+    if address >= self.MEMORY_SIZE:
+      self._Idle()
+      return
+    end = address - address % self.PAGE_SIZE + self.PAGE_SIZE
+    self._SendBytes(self.memory[address:end],
+                    lambda: self._ReadMemory(end))
+
+
+class VirtualDS28EC20(VirtualDS2433):
+  """DS28EC20 20Kb EEPROM, which adds CRC protected Extended Read Memory."""
+  FAMILY = 0x43
+  MEMORY_SIZE = 2560
+
+  def FunctionCommand(self, cmd):
+    if cmd == GenericOneWireMaster.MEM_EXTENDED_READ:
+      self._Receive(16, self._ExtendedRead)
+    else:
+      VirtualDS2433.FunctionCommand(self, cmd)
+
+  def _ExtendedRead(self, address, first=True):
+    if address >= self.MEMORY_SIZE:
+      self._Idle()
+      return
+    end = address - address % self.PAGE_SIZE + self.PAGE_SIZE
+    data = self.memory[address:end]
+    if first:
+      check = crc.Crc16([GenericOneWireMaster.MEM_EXTENDED_READ,
+                         address & 0xff, address >> 8] + data)
+    else:
+      check = crc.Crc16(data)
+    check ^= 0xffff
+    self._SendBytes(data + [check & 0xff, check >> 8],
+                    lambda: self._ExtendedRead(end, False))
+
+
+class SimulatedBus(object):
+  """A wired-AND 1-Wire bus connecting virtual devices.
+
+  Bus time is accounted in microseconds, so benchmarks can compare how long
+  an operation would take on a real bus independently of how fast the
+  simulation runs.
+
+  At overdrive speed only devices in overdrive take part; a reset at
+  regular speed takes every device back to regular speed.
+  """
+  def __init__(self, devices=()):
+    self.devices = list(devices)
+    self._by_rom = None
+    self._active = []
+    self._fresh = None
+    self._search = None
+    self.speed = GenericOneWireMaster.SPEED_REGULAR
+    self._overdrive_used = False
+    self._slots_mark = 0
+    self.resets = 0
+    self.slots = 0
+    self.overdrive_resets = 0
+    self.overdrive_slots = 0
+    self.pullup_time = 0
+
+  def AddDevice(self, device):
+    self.devices.append(device)
+    self._by_rom = None
+
+  def RemoveDevice(self, device):
+    self.devices.remove(device)
+    self._by_rom = None
+    if self._fresh is not None:
+      self._Materialize()
+    if self._search is not None:
+      self._EndFastSearch()
+    if device in self._active:
+      self._active.remove(device)
+
+  def SetSpeed(self, speed):
+    """Switch the speed of the following resets and slots."""
+    if speed == self.speed:
+      return
+    # slots are counted in self.slots while they run and moved to
+    # overdrive_slots when the bus leaves overdrive
+    if speed == GenericOneWireMaster.SPEED_OVERDRIVE:
+      self._overdrive_used = True
+      self._slots_mark = self.slots
+    else:
+      self.overdrive_slots += max(self.slots - self._slots_mark, 0)
+      self.slots = min(self._slots_mark, self.slots)
+    self.speed = speed
+
+  def GetBusTime(self):
+    """Returns the simulated bus time used so far, in microseconds."""
+    slots = self.slots
+    overdrive_slots = self.overdrive_slots
+    if self.speed == GenericOneWireMaster.SPEED_OVERDRIVE:
+      running = max(slots - self._slots_mark, 0)
+      slots -= running
+      overdrive_slots += running
+    return (self.resets * RESET_TIME + slots * SLOT_TIME +
+            self.overdrive_resets * OVERDRIVE_RESET_TIME +
+            overdrive_slots * OVERDRIVE_SLOT_TIME +
+            self.pullup_time * 1000)
+
+  def Reset(self):
+    """Issue a reset pulse.
+
+    Devices are only told about the reset once they need to see a time slot,
+    so that ROM commands, which would otherwise reach every device on the
+    bus, can be handled by the bus itself: a search is tracked as in
+    Triplet, and Match ROM goes straight to the matching device.
+
+    Returns
+      True if any device answered with a presence pulse
+    """
+    self._search = None
+    if self.speed == GenericOneWireMaster.SPEED_OVERDRIVE:
+      self.overdrive_resets += 1
+      self._active = [d for d in self.devices if d.in_overdrive]
+    else:
+      self.resets += 1
+      if self._overdrive_used:
+        for device in self.devices:
+          device.in_overdrive = False
+        self._overdrive_used = False
+      self._active = list(self.devices)
+    self._fresh = []
+    return bool(self._active)
+
+  def _Materialize(self):
+    # reset the devices for real and replay what was sent since
+    pending = self._fresh
+    self._fresh = None
+    for device in self._active:
+      device.BusReset()
+    self._active = [d for d in self._active if d.IsActive()]
+    slots = self.slots
+    for byte in pending:
+      self.TouchByte(byte)
+    self.slots = slots
+
+  def _TouchFreshByte(self, byte):
+    fresh = self._fresh
+    if not fresh:
+      if byte == GenericOneWireMaster.ROM_SEARCH:
+        devices = self._active
+      elif byte == GenericOneWireMaster.ROM_ALARM_SEARCH:
+        devices = [d for d in self._active if d.alarm]
+      elif byte == GenericOneWireMaster.ROM_MATCH:
+        fresh.append(byte)
+        self.slots += 8
+        return True
+      else:
+        if byte in (GenericOneWireMaster.ROM_OVERDRIVE_SKIP,
+                    GenericOneWireMaster.ROM_OVERDRIVE_MATCH):
+          self._overdrive_used = True
+        return False
+      self._fresh = None
+      self._active = devices
+      self._search = (0, devices)
+      self.slots += 8
+      return True
+
+    fresh.append(byte)
+    self.slots += 8
+    if len(fresh) == 9:
+      self._fresh = None
+      if self._by_rom is None:
+        self._by_rom = dict((d.rom, d) for d in self.devices)
+      rom = struct.unpack('<Q', struct.pack('8B', *fresh[1:]))[0]
+      device = self._by_rom.get(rom)
+      if (self.speed == GenericOneWireMaster.SPEED_OVERDRIVE and
+          device is not None and not device.in_overdrive):
+        device = None
+      self._active = []
+      if device is not None:
+        device.Select()
+        self._active = [device]
+    return True
+
+  def TouchBit(self, bit):
+    """Run one time slot with the master driving |bit|.
+
+    Returns
+      the level on the bus
+    """
+    if self._fresh is not None:
+      self._Materialize()
+    if self._search is not None:
+      self._EndFastSearch()
+    self.slots += 1
+    level = bit and 1 or 0
+    active = self._active
+    for device in active:
+      if not device.Drive():
+        level = 0
+    for device in active:
+      device.Sample(level)
+    self._active = [d for d in active if d.IsActive()]
+    return level
+
+  def TouchByte(self, byte):
+    """Run eight time slots, LSB first.
+
+    Returns
+      the byte seen on the bus
+    """
+    if self._fresh is not None:
+      if self._TouchFreshByte(byte):
+        return byte
+      self._Materialize()
+    if self._search is not None:
+      self._EndFastSearch()
+    active = self._active
+    for device in active:
+      if not device.CanReceiveByte():
+        break
+    else:
+      # nobody is driving the bus, so the devices just see |byte|
+      self.slots += 8
+      for device in active:
+        device.ReceiveByte(byte)
+      self._active = [d for d in active if d.IsActive()]
+      return byte
+
+    ret = 0
+    for i in xrange(8):
+      ret |= self.TouchBit((byte >> i) & 1) << i
+    return ret
+
+  def Triplet(self, bdir):
+    """Run the three slots of a search triplet.
+
+    Once every device taking part is at the same point of a search, the bus
+    tracks the search itself and computes each triplet directly from the ROM
+    ids of the remaining devices, instead of slot by slot.
+
+    Returns
+      same as GenericOneWireMaster.Triplet
+    """
+    if self._fresh is not None:
+      self._Materialize()
+    if self._search is None:
+      self._StartFastSearch()
+    if self._search is None:
+      id_bit = self.TouchBit(1)
+      comp_bit = self.TouchBit(1)
+      retval = GenericOneWireMaster.DecodeTriplet(id_bit, comp_bit, bdir)
+      if retval != 0x03:
+        self.TouchBit(retval >> 2)
+      return retval
+
+    index, devices = self._search
+    self.slots += 3
+    ones = [d for d in devices if (d.rom >> index) & 1]
+    retval = GenericOneWireMaster.DecodeTriplet(len(ones) == len(devices),
+                                                not ones, bdir)
+    if retval & 0x04:
+      devices = ones
+    else:
+      devices = [d for d in devices if not (d.rom >> index) & 1]
+    self._active = devices
+    if index == 63:
+      self._search = None
+      for device in devices:
+        device.SetSearchIndex(index)
+        device.SearchDirection(retval >> 2)
+      self._active = [d for d in devices if d.IsActive()]
+    else:
+      self._search = (index + 1, devices)
+    return retval
+
+  def _StartFastSearch(self):
+    active = self._active
+    if not active:
+      return
+    index = active[0].GetSearchIndex()
+    if index is None:
+      return
+    for device in active:
+      if device.GetSearchIndex() != index:
+        return
+    self._search = (index, active)
+
+  def _EndFastSearch(self):
+    # hand the search state back to the devices still taking part
+    index, devices = self._search
+    self._search = None
+    for device in devices:
+      device.SetSearchIndex(index)
+
+  def Pullup(self, duration):
+    """Apply a strong pullup for |duration| ms."""
+    self.pullup_time += duration
+
+
+class SimulatedOneWireMaster(GenericOneWireMaster.GenericOneWireMaster):
+  """Bus master driving a SimulatedBus directly.
+
+  Strong pullups are accounted as bus time instead of being waited out, so
+  simulations run as fast as the host allows.
+  """
+  def __init__(self, devices=(), bus=None):
+    GenericOneWireMaster.GenericOneWireMaster.__init__(self)
+    if bus is None:
+      bus = SimulatedBus(devices)
+    self.bus = bus
+
+  def Reset(self):
+    self.SetSpeed(GenericOneWireMaster.SPEED_REGULAR)
+    return self.bus.Reset()
+
+  def ResetBus(self):
+    return self.bus.Reset()
+
+  def SetSpeed(self, speed):
+    self.bus.SetSpeed(speed)
+    self._speed = speed
+
+  def StartPulse(self, delay, wait=True):
+    if wait:
+      self.WaitPullup(delay)
+
+  def WaitPullup(self, duration, elapsed=0):
+    self.bus.Pullup(duration)
+
+  def TouchBit(self, bit):
+    return self.bus.TouchBit(bit)
+
+  def ReadBit(self):
+    return self.bus.TouchBit(1)
+
+  def WriteBit(self, bit):
+    self.bus.TouchBit(bit)
+
+  def Triplet(self, bdir):
+    return self.bus.Triplet(bdir)
+
+  def ReadByte(self):
+    return self.bus.TouchByte(0xff)
+
+  def WriteByte(self, byte, pullup=0, wait=True):
+    ret = self.bus.TouchByte(byte)
+    if pullup and wait:
+      self.WaitPullup(pullup)
+    return ret != byte
+
+  def ReadBlock(self, numblocks):
+    touch = self.bus.TouchByte
+    return [touch(0xff) for i in xrange(numblocks)]
+
+  def WriteBlock(self, data, pullup=0, wait=True):
+    touch = self.bus.TouchByte
+    ret = [touch(byte) for byte in data]
+    if pullup and wait:
+      self.WaitPullup(pullup)
+    return ret != list(data)
+
+
+def MakeSensorBus(count, seed=0):
+  """Returns a list of |count| VirtualDS18B20 devices with random serials."""
+  import random
+  rand = random.Random(seed)
+  serials = set()
+  while len(serials) < count:
+    serials.add(rand.getrandbits(48))
+  return [VirtualDS18B20(serial, temperature=rand.uniform(-10, 40))
+          for serial in sorted(serials)]
+
+
+def TripletSearch(master, search_type=GenericOneWireMaster.ROM_SEARCH):
+  """Search with GenericOneWireMaster's passes, one Triplet per ROM bit.
+
+  Masters with a search of their own override SearchPass; this runs the
+  generic triplet level search through them anyway, for comparison.
+
+  Returns
+    list of 64 bit ids found
+  """
+  ret = []
+  target = 0L
+  while target is not None:
+    result = GenericOneWireMaster.GenericOneWireMaster.SearchPass(
+        master, search_type, target)
+    if result is None:
+      break
+    ret.append(result[0])
+    target = GenericOneWireMaster.NextSearchStart(*result)
+  return ret
+
+
+def _Benchmark(name, master, bus, fn):
+  import time
+  bus.resets = bus.slots = bus.pullup_time = 0
+  start = time.time()
+  ret = fn(master)
+  elapsed = time.time() - start
+  print '  %-18s wall %8.3fs  bus %9.3fs' % (name, elapsed,
+                                             bus.GetBusTime() / 1e6)
+  return ret
+
+
+def _ReadAll(master, ids):
+  for rom in ids:
+    master.ResetBus()
+    master.WriteBlock([GenericOneWireMaster.ROM_MATCH] +
+                      list(struct.unpack('8B', struct.pack('<Q', rom))) +
+                      [0xbe])
+    master.ReadBlock(9)
+
+
+if __name__ == '__main__':
+  for count in (10, 100, 1000):
+    print '%i devices' % count
+    master = SimulatedOneWireMaster(MakeSensorBus(count))
+    ids = _Benchmark('search', master, master.bus,
+                     lambda m: m.Search(m.SEARCH_NORMAL))
+    assert len(ids) == count
+    _Benchmark('read scratchpads', master, master.bus,
+               lambda m: _ReadAll(m, ids))
@@ -0,0 +1,382 @@
+#!/usr/bin/env python
+"""
+Linux kernel w1 subsystem backend for the pyonewire package
+
+  Copyright 2008 mike wakerly <opensource@hoho.com>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+
+When the kernel's w1 drivers own the adapter, SysfsOneWireMaster uses the
+bus through /sys/bus/w1/devices instead. The kernel runs the ROM search,
+triggered through w1_master_search and read back from w1_master_slaves, and
+each device's rw file resets the bus, selects the device and writes a
+block, or reads a block, in one system call:
+
+  master = SysfsOneWireMaster.SysfsOneWireMaster()
+  for rom in master.Search(master.SEARCH_NORMAL):
+    print '%016x' % rom
+
+sysfs offers no bit level access and no raw reset, so Match ROM and Skip
+ROM are taken from the bytes written after ResetBus: data written to a
+selected device is held until it is read from, or the bus is reset, and
+then goes out through the device's rw file. Skip ROM writes to every device
+the kernel knows of in turn. Reads need a single device.
+
+Devices bound to the w1_therm driver have no rw file; Convert T and Read
+Scratchpad are mapped onto its therm_bulk_read and w1_slave files, so that
+ds18x20 works unchanged. Strong pullups are up to the kernel driver; they
+are only waited out here.
+
+The sysfs root can be given, e.g. to run against a copy of the tree. The
+kernel also searches by itself, every few seconds by default; with
+rescan=False, Search takes the ids of its last search rather than asking
+for a new one, as a copy of the tree will never answer.
+"""
+
+import os
+import re
+import time
+
+from pyonewire.core import util
+from pyonewire.master import GenericOneWireMaster
+
+SYSFS_ROOT = '/sys/bus/w1/devices'
+
+# bus masters are w1_bus_master1, w1_bus_master2, ...
+_MASTER_NAME = re.compile(r'^w1_bus_master(\d+)$')
+
+# maximum time the kernel may take for a triggered search, in seconds
+SEARCH_TIMEOUT = 10.0
+
+# delay between polls of w1_master_search, in seconds
+SEARCH_POLL = 0.01
+
+# w1_therm function commands mapped onto its files
+THERM_CONVERT_T = 0x44
+THERM_READ_SCRATCHPAD = 0xbe
+
+
+class SysfsError(IOError):
+  """Raised for operations the kernel does not offer through sysfs"""
+
+
+def FindMasters(root=SYSFS_ROOT):
+  """Returns the names of the w1 bus masters under |root|, in order."""
+  try:
+    names = os.listdir(root)
+  except OSError:
+    return []
+  masters = []
+  for name in names:
+    match = _MASTER_NAME.match(name)
+    if match:
+      masters.append((int(match.group(1)), name))
+  return [name for unused, name in sorted(masters)]
+
+
+def _ReadFile(path, size=-1):
+  # unbuffered, so that each read is one system call on the attribute
+  fd = os.open(path, os.O_RDONLY)
+  try:
+    if size < 0:
+      chunks = []
+      while True:
+        data = os.read(fd, 4096)
+        if not data:
+          return ''.join(chunks)
+        chunks.append(data)
+    return os.read(fd, size)
+  finally:
+    os.close(fd)
+
+
+def _WriteFile(path, data):
+  # sysfs ignores O_TRUNC, as for echo; a copy of the tree needs it
+  fd = os.open(path, os.O_WRONLY | os.O_TRUNC)
+  try:
+    os.write(fd, data)
+  finally:
+    os.close(fd)
+
+
+class SysfsOneWireMaster(GenericOneWireMaster.GenericOneWireMaster):
+  """Bus master using a kernel w1 bus master through sysfs."""
+  def __init__(self, name=None, root=SYSFS_ROOT, rescan=True):
+    """
+    Args
+      name - name of the bus master, e.g. w1_bus_master1; by default the
+             first one found when the master is first used
+      root - directory holding the w1 masters and devices
+      rescan - default for the rescan argument of Search
+    """
+    GenericOneWireMaster.GenericOneWireMaster.__init__(self)
+    self._name = name
+    self._root = root
+    self._rescan = rescan
+    self._ResetState()
+
+  def _ResetState(self):
+    # ROM command bytes written since the reset, until complete
+    self._header = []
+    # ids selected by the ROM command, None before it is complete
+    self._targets = None
+    # bytes for the selected devices, not written yet
+    self._pending = []
+    # True once the selected device has been read from
+    self._reading = False
+    # data read from a w1_therm device, served by the reads that follow
+    self._stream = None
+
+  def GetName(self):
+    """Returns the name of the kernel bus master used."""
+    if self._name is None:
+      masters = FindMasters(self._root)
+      if not masters:
+        raise SysfsError, "no w1 bus master in %s" % self._root
+      self._name = masters[0]
+    return self._name
+
+  def _MasterPath(self, attribute):
+    return os.path.join(self._root, self.GetName(), attribute)
+
+  def _DevicePath(self, rom, attribute):
+    return os.path.join(self._root, util.FormatId(rom, util.FORMAT_W1),
+                        attribute)
+
+  def GetSlaves(self):
+    """Returns the ids the kernel found on the bus in its last search."""
+    ret = []
+    for line in _ReadFile(self._MasterPath('w1_master_slaves')).split('\n'):
+      # the list is 'not found.' when it is empty
+      try:
+        ret.append(util.ParseId(line))
+      except ValueError:
+        pass
+    return ret
+
+  def Rescan(self):
+    """Have the kernel search the bus now, and wait for it to finish.
+
+    The kernel searches while w1_master_search is non-zero, counting it down
+    after each search; -1 means searching periodically. One search is asked
+    for, then the previous setting is put back.
+
+    Raises
+      SysfsError if the search does not finish within SEARCH_TIMEOUT
+    """
+    path = self._MasterPath('w1_master_search')
+    previous = int(_ReadFile(path).strip() or 0)
+    _WriteFile(path, '1')
+    deadline = time.time() + SEARCH_TIMEOUT
+    try:
+      while int(_ReadFile(path).strip() or 0) > 0:
+        if time.time() > deadline:
+          raise SysfsError, "kernel search took too long"
+        time.sleep(SEARCH_POLL)
+    finally:
+      if previous:
+        _WriteFile(path, str(previous))
+
+  # GenericOneWireMaster interface
+
+  def Reset(self):
+    self._ResetState()
+    return True
+
+  def ResetBus(self):
+    """Write out held data and start a new ROM command.
+
+    Returns
+      True if the kernel knows of any device on the bus
+    """
+    self._Flush()
+    self._ResetState()
+    return bool(self.GetSlaves())
+
+  def SetSpeed(self, speed):
+    if speed != GenericOneWireMaster.SPEED_REGULAR:
+      raise SysfsError, "the kernel w1 bus runs at regular speed"
+    self._speed = speed
+
+  def StartPulse(self, delay, wait=True):
+    self._Flush()
+    if wait:
+      self.WaitPullup(delay)
+
+  def TouchBit(self, bit):
+    raise SysfsError, "sysfs has no bit level access"
+
+  def Triplet(self, bdir):
+    raise SysfsError, "sysfs has no bit level access"
+
+  def SearchPass(self, search_type, target=0L,
+                 speed=GenericOneWireMaster.SPEED_REGULAR):
+    raise SysfsError, "the kernel only runs whole searches"
+
+  def Search(self, search_type=GenericOneWireMaster.ROM_SEARCH, family=None,
+             prefix=None, prefix_bits=8, skip_families=(), check_crc=False,
+             rescan=None):
+    """Find devices with a search run by the kernel.
+
+    The family, prefix and skip_families filters of
+    GenericOneWireMaster.Search are applied to its result; the kernel only
+    keeps ids that passed their CRC8, so check_crc has nothing to do.
+
+    Args
+      rescan - if False, the result of the kernel's last search is used;
+               by default, as given to the constructor
+    Raises
+      SysfsError for an alarm search
+    """
+    if search_type != GenericOneWireMaster.ROM_SEARCH:
+      raise SysfsError, "sysfs only offers the normal search"
+    if rescan is None:
+      rescan = self._rescan
+    if rescan:
+      self.Rescan()
+    if family is not None:
+      prefix, prefix_bits = family, 8
+    elif prefix is None:
+      prefix, prefix_bits = 0L, 0
+    mask = (1L << prefix_bits) - 1
+    return [rom for rom in sorted(self.GetSlaves())
+            if (rom & mask) == prefix and (rom & 0xff) not in skip_families]
+
+  def IterSearch(self, *args, **kwargs):
+    """Yields the ids of Search; the kernel runs the whole search at once."""
+    return iter(self.Search(*args, **kwargs))
+
+  def VerifyRoms(self, roms):
+    """Returns the ids in |roms| found by the kernel's last search.
+
+    The kernel drops a device from w1_master_slaves once it has missed a few
+    of its own searches; no search is asked for here.
+    """
+    found = set(self.GetSlaves())
+    return [rom for rom in roms if rom in found]
+
+  def VerifyRom(self, rom):
+    return bool(self.VerifyRoms([rom]))
+
+  def Select(self, rom):
+    """Select a device; True if the kernel has a directory for it."""
+    self.ResetBus()
+    self._targets = [rom]
+    return os.path.isdir(self._DevicePath(rom, ''))
+
+  def WriteByte(self, byte, pullup=0, wait=True):
+    return self.WriteBlock((byte,), pullup, wait)
+
+  def WriteBlock(self, data, pullup=0, wait=True):
+    """Hold |data| for the selected devices, or take the ROM command from it.
+
+    Returns
+      False, as nothing is read back
+    Raises
+      SysfsError for ROM commands other than Match and Skip ROM, or for
+      writing to a device that has been read from since it was selected
+    """
+    data = list(data)
+    if self._targets is None:
+      self._header.extend(data)
+      data = self._ParseRomCommand()
+      if data is None:
+        return False
+    if data and self._reading:
+      raise SysfsError, "sysfs cannot write to a device after reading it"
+    self._pending.extend(data)
+    if pullup:
+      self.StartPulse(pullup, wait)
+    return False
+
+  def _ParseRomCommand(self):
+    """Take the ROM command from the bytes written since the reset.
+
+    Returns
+      the bytes following it, or None if it is not complete yet
+    """
+    header = self._header
+    if header[0] == GenericOneWireMaster.ROM_MATCH:
+      if len(header) < 9:
+        return None
+      self._targets = util.IdsFromBuffer(header[1:9])
+      rest = header[9:]
+    elif header[0] == GenericOneWireMaster.ROM_SKIP:
+      self._targets = self.GetSlaves()
+      rest = header[1:]
+    else:
+      raise SysfsError, "ROM command 0x%02x is not offered by sysfs" % (
+          header[0])
+    self._header = []
+    return rest
+
+  def _Flush(self):
+    """Write the held data to each selected device."""
+    data, self._pending = self._pending, []
+    if not data or not self._targets:
+      return
+    triggered = False
+    for rom in self._targets:
+      rw = self._DevicePath(rom, 'rw')
+      if os.path.exists(rw):
+        _WriteFile(rw, str(bytearray(data)))
+      elif data == [THERM_CONVERT_T]:
+        # w1_slave converts by itself unless a bulk conversion is pending
+        bulk = self._MasterPath('therm_bulk_read')
+        if not triggered and os.path.exists(bulk):
+          _WriteFile(bulk, 'trigger\n')
+          triggered = True
+      elif data == [THERM_READ_SCRATCHPAD]:
+        self._stream = self._ReadThermScratchpad(rom)
+      else:
+        raise SysfsError, "%s has no rw file" % util.FormatId(
+            rom, util.FORMAT_W1)
+
+  def _ReadThermScratchpad(self, rom):
+    """Returns the scratchpad bytes w1_therm shows first in w1_slave.
+
+    The first line holds them in hex, followed by ': crc=xx YES' or NO.
+    """
+    try:
+      text = _ReadFile(self._DevicePath(rom, 'w1_slave'))
+    except (IOError, OSError):
+      return []
+    try:
+      return [int(part, 16) for part in text.split(':')[0].split()]
+    except ValueError:
+      return []
+
+  def ReadByte(self):
+    return self.ReadBlock(1)[0]
+
+  def ReadBlock(self, numblocks):
+    """Read from the single selected device.
+
+    Bytes the device does not provide read as 0xff, like an idle bus.
+    """
+    self._Flush()
+    if not self._targets or len(self._targets) != 1:
+      raise SysfsError, "sysfs can only read from a single selected device"
+    self._reading = True
+    if self._stream is not None:
+      data = self._stream[:numblocks]
+      self._stream = self._stream[numblocks:]
+    else:
+      try:
+        data = list(bytearray(_ReadFile(
+            self._DevicePath(self._targets[0], 'rw'), numblocks)))
+      except (IOError, OSError):
+        data = []
+    return data + [0xff] * (numblocks - len(data))
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""
+Tests of AsyncOneWireMaster against the ds2490sim emulator
+
+  Copyright 2008 mike wakerly <opensource@hoho.com>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+
+The tests are skipped when trollius, the optional 'async' dependency, is not
+installed.
+"""
+
+import logging
+import time
+import unittest
+
+try:
+  import trollius as asyncio
+  from pyonewire.master import AsyncOneWireMaster
+except ImportError:
+  asyncio = None
+
+from pyonewire.master import ds2490
+from pyonewire.master import ds2490sim
+from pyonewire.master import GenericOneWireMaster
+from pyonewire.master import SimulatedOneWireMaster
+
+# pullup time of the tests, in ms
+PULLUP = 200
+
+
+@unittest.skipUnless(asyncio, 'trollius is not installed')
+class PullupTest(unittest.TestCase):
+  def setUp(self):
+    bus = SimulatedOneWireMaster.SimulatedBus(
+        SimulatedOneWireMaster.MakeSensorBus(3, seed=1))
+    self.master = ds2490.DS2490Master(handle=ds2490sim.FakeDS2490Handle(bus))
+    self.loop = asyncio.new_event_loop()
+    self.async_master = AsyncOneWireMaster.AsyncOneWireMaster(self.master,
+                                                              self.loop)
+
+  def tearDown(self):
+    self.async_master.Close()
+    self.loop.close()
+
+  def _Convert(self):
+    return self.async_master.WriteBlock([GenericOneWireMaster.ROM_SKIP, 0x44],
+                                 PULLUP)
+
+  def _Run(self, future):
+    return self.loop.run_until_complete(future)
+
+  def testHold(self):
+    start = time.time()
+    done = []
+    write = self._Convert()
+    reset = self.async_master.ResetBus()
+    write.add_done_callback(lambda f: done.append('write'))
+    reset.add_done_callback(lambda f: done.append('reset'))
+    self.assertFalse(self._Run(write))
+    self.assertTrue(self._Run(reset))
+    self.assertEqual(done, ['write', 'reset'])
+    self.assertTrue(time.time() - start >= PULLUP / 1000.0)
+    # the master itself is left alone
+    self.assertFalse('WaitPullup' in self.master.__dict__)
+
+  def testLoopRunsDuringPullup(self):
+    ticks = []
+    @asyncio.coroutine
+    def Ticker():
+      while len(ticks) < 5:
+        ticks.append(time.time())
+        yield asyncio.From(asyncio.sleep(0.01, loop=self.loop))
+    write = self._Convert()
+    self._Run(asyncio.wait([write, Ticker()], loop=self.loop))
+    self.assertEqual(len(ticks), 5)
+
+  def testCloseBeforeStart(self):
+    start = time.time()
+    write = self._Convert()
+    reset = self.async_master.ResetBus()
+    self.async_master.Close()
+    self.assertTrue(time.time() - start >= PULLUP / 1000.0)
+    self.assertFalse(self._Run(write))
+    self.assertTrue(self._Run(reset))
+
+  def testCloseDuringPullup(self):
+    start = time.time()
+    write = self._Convert()
+    reset = self.async_master.ResetBus()
+    # let the pullup start, and its timer be set on the loop
+    self._Run(asyncio.sleep(0.05, loop=self.loop))
+    self.assertFalse(write.done())
+    self.async_master.Close()
+    self.assertTrue(time.time() - start >= PULLUP / 1000.0)
+    self.assertFalse(self._Run(write))
+    self.assertTrue(self._Run(reset))
+
+  def testCloseTwoPullups(self):
+    start = time.time()
+    first = self._Convert()
+    second = self._Convert()
+    self._Run(asyncio.sleep(0.05, loop=self.loop))
+    self.async_master.Close()
+    self.assertTrue(time.time() - start >= 2 * PULLUP / 1000.0)
+    self.assertFalse(self._Run(first))
+    self.assertFalse(self._Run(second))
+
+
+if __name__ == '__main__':
+  logging.getLogger('ds2490').setLevel(logging.WARNING)
+  unittest.main()
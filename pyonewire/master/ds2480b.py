@@ -0,0 +1,554 @@
+#!/usr/bin/env python
+"""
+DS2480B serial OneWire master for the pyonewire package
+
+  Copyright 2008 mike wakerly <opensource@hoho.com>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+
+The DS2480B is the serial line driver inside DS9097U style adapters. It has
+two modes: in data mode every byte written to it is a byte on the 1-Wire bus
+and is answered with the byte read back; in command mode each byte is a
+reset, a single time slot, a pullup or a configuration command. Switching
+modes takes a single byte, so DS2480BMaster queues a whole operation, mode
+switches included, and sends it in one write followed by one read:
+
+  master = ds2480b.DS2480BMaster('/dev/ttyUSB0')
+  print master.Search(master.SEARCH_NORMAL)
+
+With the search accelerator on, the adapter runs all 64 triplets of a search
+pass on 16 bytes of data, so a reset, the search command and the pass make
+one 18 byte exchange. See ds2480bsim for an emulated adapter.
+
+The port is driven through termios, so no serial library is needed.
+"""
+
+import logging
+import os
+import select
+import termios
+import time
+
+from pyonewire.master import GenericOneWireMaster
+
+DEFAULT_DEVICE = '/dev/ttyS0'
+
+# mode switching, and ending a strong pullup
+MODE_DATA = 0xe1
+MODE_COMMAND = 0xe3
+MODE_STOP_PULSE = 0xf1
+
+# communication commands: 1 FF P SS A 1, function, polarity, speed, arm
+CMD_COMM = 0x81
+FUNCTSEL_BIT = 0x00
+FUNCTSEL_SEARCHOFF = 0x20
+FUNCTSEL_SEARCHON = 0x30
+FUNCTSEL_RESET = 0x40
+FUNCTSEL_CHMOD = 0x60
+BITPOL_ONE = 0x10
+BITPOL_5V = 0x00
+SPEEDSEL_STD = 0x00
+SPEEDSEL_FLEX = 0x04
+SPEEDSEL_OD = 0x08
+SPEEDSEL_PULSE = 0x0c
+PRIME5V = 0x02
+
+# configuration commands: 0 PPP VVV 1, parameter and value; the adapter
+# answers with the command byte, bit 0 cleared
+CMD_CONFIG = 0x01
+PARMSEL_SLEW = 0x10
+PARMSEL_12VPULSE = 0x20
+PARMSEL_5VPULSE = 0x30
+PARMSEL_WRITE1LOW = 0x40
+PARMSEL_SAMPLEOFFSET = 0x50
+PARMSEL_BAUDRATE = 0x70
+
+PARMSET_SLEW_1P37VUS = 0x06
+PARMSET_WRITE1LOW_10US = 0x04
+PARMSET_SAMPLEOFFSET_8US = 0x0a
+PARMSET_PULSE_INFINITE = 0x0e
+
+# baud rate -> PARMSEL_BAUDRATE value
+BAUD_RATES = {
+  9600: 0x00,
+  19200: 0x02,
+  57600: 0x04,
+  115200: 0x06,
+}
+
+# flexible speed timing for long lines, as recommended by Maxim (AN192)
+FLEX_CONFIG = (
+  PARMSEL_SLEW | PARMSET_SLEW_1P37VUS,
+  PARMSEL_WRITE1LOW | PARMSET_WRITE1LOW_10US,
+  PARMSEL_SAMPLEOFFSET | PARMSET_SAMPLEOFFSET_8US,
+  PARMSEL_5VPULSE | PARMSET_PULSE_INFINITE,
+)
+
+# reset responses: 110 VVV RR, chip version and result
+RESET_RESPONSE_MASK = 0xdc
+RESET_RESPONSE = 0xcc
+RESET_SHORT = 0x00
+RESET_PRESENCE = 0x01
+RESET_ALARMING_PRESENCE = 0x02
+RESET_NO_PRESENCE = 0x03
+
+# answer to MODE_STOP_PULSE is 111x xxxx
+PULSE_RESPONSE_MASK = 0xe0
+
+# bytes of data of an accelerated search pass, two bits per id bit
+SEARCH_BYTES = 16
+
+# search passes sent in one exchange by VerifyRoms
+VERIFY_BATCH = 16
+
+# time the adapter takes to calibrate on the first reset after a break, in s
+CALIBRATION_DELAY = 0.005
+
+# maximum time to wait for the adapter to answer, in seconds
+READ_TIMEOUT = 1.0
+
+
+class SerialError(Exception):
+  """Raised when the serial port fails or the adapter answers unexpectedly"""
+
+
+class SerialPort(object):
+  """A serial port in raw 8N1 mode."""
+  def __init__(self, path, baud=9600, timeout=READ_TIMEOUT):
+    """
+    Args
+      path - device of the port, e.g. /dev/ttyS0
+      baud - initial baud rate
+      timeout - seconds Read waits for more data before giving up
+    """
+    self._fd = os.open(path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+    self._timeout = timeout
+    self.SetBaud(baud)
+
+  def SetBaud(self, baud):
+    """Set the baud rate, once everything written has been sent."""
+    speed = getattr(termios, 'B%i' % baud)
+    attrs = termios.tcgetattr(self._fd)
+    attrs[0] = 0  # iflag
+    attrs[1] = 0  # oflag
+    attrs[2] = termios.CS8 | termios.CREAD | termios.CLOCAL
+    attrs[3] = 0  # lflag
+    attrs[4] = attrs[5] = speed
+    attrs[6][termios.VMIN] = 0
+    attrs[6][termios.VTIME] = 0
+    termios.tcsetattr(self._fd, termios.TCSADRAIN, attrs)
+
+  def Write(self, data):
+    while data:
+      select.select([], [self._fd], [], self._timeout)
+      data = data[os.write(self._fd, data):]
+
+  def Read(self, size):
+    """Read |size| bytes, or fewer if the port stays quiet too long."""
+    ret = []
+    got = 0
+    while got < size:
+      if not select.select([self._fd], [], [], self._timeout)[0]:
+        break
+      data = os.read(self._fd, size - got)
+      ret.append(data)
+      got += len(data)
+    return ''.join(ret)
+
+  def Flush(self):
+    """Discard anything received and not read yet."""
+    termios.tcflush(self._fd, termios.TCIFLUSH)
+
+  def SendBreak(self):
+    termios.tcdrain(self._fd)
+    termios.tcsendbreak(self._fd, 0)
+
+  def Close(self):
+    os.close(self._fd)
+
+
+class DS2480BMaster(GenericOneWireMaster.GenericOneWireMaster):
+  def __init__(self, device=DEFAULT_DEVICE, port=None, baud=9600):
+    """Create a master; the port is opened and the adapter reset on first use.
+
+    Args
+      device - serial port the adapter is on
+      port - an already opened SerialPort, or an object emulating one such
+             as ds2480bsim.FakeSerialPort
+      baud - baud rate to switch to once the adapter is reset, one of
+             BAUD_RATES
+    """
+    GenericOneWireMaster.GenericOneWireMaster.__init__(self)
+    if baud not in BAUD_RATES:
+      raise ValueError, "unsupported baud rate %i" % baud
+    self._logger = logging.getLogger('ds2480b')
+    self._device = device
+    self._port = port
+    self._owns_port = port is None
+    self._baud = baud
+    self._opened = False
+    self._mode = MODE_COMMAND
+    self._out = []
+    self._expect = 0
+    self._transactions = 0
+
+  def Open(self):
+    """Open the port and reset the adapter, unless already done.
+
+    This happens by itself on the first operation.
+    """
+    if self._opened:
+      return
+    if self._port is None:
+      self._port = SerialPort(self._device)
+    self._opened = True
+    self.Reset()
+    self._logger.debug('completed init')
+
+  def Close(self):
+    """Release a port opened by Open; it is reopened on next use."""
+    if self._opened and self._owns_port:
+      self._port.Close()
+      self._port = None
+    self._opened = False
+
+  def _Port(self):
+    if not self._opened:
+      self.Open()
+    return self._port
+
+  def GetTransactionCount(self):
+    """Returns the number of exchanges with the adapter since the last reset.
+
+    An exchange is one write, followed by one read if anything is answered.
+    """
+    return self._transactions
+
+  def ResetTransactionCount(self):
+    self._transactions = 0
+
+  # building exchanges
+
+  def _Command(self, command, answered=True):
+    """Queue a command mode byte.
+
+    Args
+      command - the command
+      answered - whether the adapter answers it with a byte
+    """
+    self._Port()
+    if self._mode != MODE_COMMAND:
+      self._out.append(MODE_COMMAND)
+      self._mode = MODE_COMMAND
+    self._out.append(command)
+    if answered:
+      self._expect += 1
+
+  def _Data(self, data):
+    """Queue bytes for the 1-Wire bus; each is answered with the byte read."""
+    self._Port()
+    if self._mode != MODE_DATA:
+      self._out.append(MODE_DATA)
+      self._mode = MODE_DATA
+    out = self._out
+    for byte in data:
+      out.append(byte)
+      # MODE_COMMAND is sent twice to stand for itself
+      if byte == MODE_COMMAND:
+        out.append(byte)
+      self._expect += 1
+
+  def _Bits(self, bits, prime=False):
+    """Queue a time slot command per bit.
+
+    Args
+      bits - sequence of bits to touch
+      prime - if True, a strong pullup follows the last slot; it lasts until
+              WaitPullup
+    """
+    speed = self._SpeedBits()
+    last = len(bits) - 1
+    for i, bit in enumerate(bits):
+      command = CMD_COMM | FUNCTSEL_BIT | speed
+      if bit:
+        command |= BITPOL_ONE
+      if prime and i == last:
+        command |= PRIME5V
+      self._Command(command)
+
+  def _Exchange(self):
+    """Send the queued bytes in one write and read all the answers.
+
+    Returns
+      list of the bytes answered
+    Raises
+      SerialError if the adapter does not answer in full
+    """
+    out, expect = self._out, self._expect
+    self._out = []
+    self._expect = 0
+    if not out:
+      return []
+    port = self._Port()
+    self._transactions += 1
+    port.Write(str(bytearray(out)))
+    if not expect:
+      return []
+    data = port.Read(expect)
+    if len(data) != expect:
+      raise SerialError, "adapter answered %i of %i bytes" % (len(data),
+                                                             expect)
+    return list(bytearray(data))
+
+  def _SpeedBits(self):
+    if self._speed == GenericOneWireMaster.SPEED_OVERDRIVE:
+      return SPEEDSEL_OD
+    return SPEEDSEL_FLEX
+
+  def _CheckReset(self, response):
+    """Returns True if a reset response reports a presence pulse."""
+    if response & RESET_RESPONSE_MASK != RESET_RESPONSE:
+      raise SerialError, "bad reset response 0x%02x" % response
+    result = response & 0x03
+    if result == RESET_SHORT:
+      self._logger.warning('1-Wire bus is shorted')
+    return result in (RESET_PRESENCE, RESET_ALARMING_PRESENCE)
+
+  # GenericOneWireMaster interface
+
+  def Reset(self):
+    """Reset the adapter and configure it.
+
+    A break resets the adapter to 9600 baud, and the reset command following
+    it only calibrates the adapter's timing, without an answer. Flexible
+    speed is then set up for long lines, the strong pullup made to last
+    until stopped, and the baud rate changed if asked for.
+    """
+    port = self._Port()
+    self._out = []
+    self._expect = 0
+    if self._baud != 9600:
+      port.SetBaud(9600)
+    port.SendBreak()
+    port.Flush()
+    port.Write(chr(CMD_COMM | FUNCTSEL_RESET | SPEEDSEL_FLEX))
+    time.sleep(CALIBRATION_DELAY)
+    self._mode = MODE_COMMAND
+    self._speed = GenericOneWireMaster.SPEED_REGULAR
+
+    for param in FLEX_CONFIG:
+      self._Command(CMD_CONFIG | param)
+    if self._Exchange() != list(FLEX_CONFIG):
+      raise SerialError, "adapter did not take its configuration"
+    if self._baud != 9600:
+      self._SetBaud(self._baud)
+    return True
+
+  def _SetBaud(self, baud):
+    # the answer comes at the new rate
+    command = CMD_CONFIG | PARMSEL_BAUDRATE | BAUD_RATES[baud]
+    port = self._Port()
+    port.Write(chr(command))
+    self._transactions += 1
+    port.SetBaud(baud)
+    answer = port.Read(1)
+    if answer != chr(command & ~CMD_CONFIG):
+      raise SerialError, "adapter did not switch to %i baud" % baud
+
+  def ResetBus(self):
+    self._Command(CMD_COMM | FUNCTSEL_RESET | self._SpeedBits())
+    return self._CheckReset(self._Exchange()[0])
+
+  def SetSpeed(self, speed):
+    """Set the speed of the following commands.
+
+    Data mode bytes run at the speed of the last command, so a command which
+    only carries the new speed is queued; it goes out with the next exchange.
+    """
+    if speed == self._speed:
+      return
+    self._speed = speed
+    self._Command(CMD_COMM | FUNCTSEL_SEARCHOFF | self._SpeedBits(),
+                  answered=False)
+
+  def StartPulse(self, delay, wait=True):
+    self._Command(CMD_COMM | FUNCTSEL_CHMOD | SPEEDSEL_PULSE | BITPOL_5V,
+                  answered=False)
+    self._Exchange()
+    if wait:
+      return self.WaitPullup(delay)
+
+  def WaitPullup(self, duration, elapsed=0):
+    """Wait for the strong pullup to be due to end, then stop it."""
+    GenericOneWireMaster.GenericOneWireMaster.WaitPullup(self, duration,
+                                                         elapsed)
+    self._Command(MODE_STOP_PULSE)
+    response = self._Exchange()[0]
+    if response & PULSE_RESPONSE_MASK != PULSE_RESPONSE_MASK:
+      raise SerialError, "bad pullup response 0x%02x" % response
+
+  def TouchBit(self, bit):
+    self._Bits((bit,))
+    return self._Exchange()[0] & 1
+
+  def TouchBits(self, bits):
+    """Run a sequence of time slots in one exchange.
+
+    The whole bytes of the sequence are sent in data mode, a byte being
+    eight slots, least significant bit first; the bits left over follow as
+    time slot commands.
+    """
+    bits = list(bits)
+    if not bits:
+      return []
+    nbytes = len(bits) / 8
+    self._Data(GenericOneWireMaster.BitsToBytes(bits))
+    self._Bits(bits[nbytes*8:])
+    read = self._Exchange()
+    ret = GenericOneWireMaster.BytesToBits(read[:nbytes])
+    ret.extend([response & 1 for response in read[nbytes:]])
+    return ret
+
+  def ReadByte(self):
+    self._Data((0xff,))
+    return self._Exchange()[0]
+
+  def WriteByte(self, byte, pullup=0, wait=True):
+    return self.WriteBlock((byte,), pullup, wait)
+
+  def ReadBlock(self, numblocks):
+    self._Data([0xff] * numblocks)
+    return self._Exchange()
+
+  def WriteBlock(self, data, pullup=0, wait=True):
+    """Write bytes in one exchange.
+
+    With a pullup, the last byte is sent as eight time slot commands, the
+    last of which arms the pullup, so that it starts right after the byte.
+    """
+    data = list(data)
+    if not pullup:
+      self._Data(data)
+      return self._Exchange() != data
+    self._Data(data[:-1])
+    self._Bits(GenericOneWireMaster.BytesToBits(data[-1:]), prime=True)
+    read = self._Exchange()
+    if wait:
+      self.WaitPullup(pullup)
+    last = GenericOneWireMaster.BitsToBytes([r & 1 for r in read[-8:]])
+    return read[:-8] + last != data
+
+  def Select(self, rom):
+    """Reset the bus and select a device in one exchange.
+
+    Selecting at overdrive speed is left to GenericOneWireMaster.Select.
+    """
+    if self._use_overdrive:
+      return GenericOneWireMaster.GenericOneWireMaster.Select(self, rom)
+    self.SetSpeed(GenericOneWireMaster.SPEED_REGULAR)
+    self._Command(CMD_COMM | FUNCTSEL_RESET | self._SpeedBits())
+    self._Data([GenericOneWireMaster.ROM_MATCH] +
+               [(rom >> (8 * i)) & 0xff for i in xrange(8)])
+    return self._CheckReset(self._Exchange()[0])
+
+  def SearchPass(self, search_type, target=0L,
+                 speed=GenericOneWireMaster.SPEED_REGULAR):
+    """Single search pass in one exchange, using the search accelerator.
+
+    See GenericOneWireMaster.SearchPass.
+    """
+    self.SetSpeed(speed)
+    self._QueueSearchPass(search_type, target)
+    return self._DecodeSearchPass(self._Exchange(), target)
+
+  def VerifyRoms(self, roms):
+    """Verify devices with directed search passes, VERIFY_BATCH per exchange.
+
+    See GenericOneWireMaster.VerifyRom.
+    """
+    roms = list(roms)
+    return [rom for rom, path in zip(roms, self.VerifyPaths(roms))
+            if path is not None]
+
+  def VerifyPaths(self, roms):
+    """Verify devices with directed search passes, VERIFY_BATCH per exchange.
+
+    Returns
+      see GenericOneWireMaster.VerifyPaths
+    """
+    self.SetSpeed(GenericOneWireMaster.SPEED_REGULAR)
+    roms = list(roms)
+    ret = []
+    per_pass = SEARCH_BYTES + 2
+    for i in xrange(0, len(roms), VERIFY_BATCH):
+      batch = roms[i:i+VERIFY_BATCH]
+      for rom in batch:
+        self._QueueSearchPass(self.SEARCH_NORMAL, rom)
+      read = self._Exchange()
+      for j, rom in enumerate(batch):
+        result = self._DecodeSearchPass(read[j*per_pass:(j+1)*per_pass], rom)
+        if result is not None and result[0] == rom:
+          ret.append(result[1])
+        else:
+          ret.append(None)
+    return ret
+
+  def _QueueSearchPass(self, search_type, target):
+    """Queue a reset, the search command and an accelerated search pass.
+
+    Each id bit takes two bits of the data sent, the second giving the
+    direction to take at a discrepancy; the answer holds the discrepancy
+    flag and the direction taken. The pass is answered with SEARCH_BYTES + 2
+    bytes.
+    """
+    speed = self._SpeedBits()
+    self._Command(CMD_COMM | FUNCTSEL_RESET | speed)
+    self._Data((search_type,))
+    self._Command(CMD_COMM | FUNCTSEL_SEARCHON | speed, answered=False)
+    data = []
+    for i in xrange(0, 64, 4):
+      byte = 0
+      for j in xrange(4):
+        byte |= ((target >> (i + j)) & 1) << (2*j + 1)
+      data.append(byte)
+    self._Data(data)
+    self._Command(CMD_COMM | FUNCTSEL_SEARCHOFF | speed, answered=False)
+
+  def _DecodeSearchPass(self, read, target):
+    """Decode the answer to _QueueSearchPass.
+
+    Where no device answered at all, the adapter flags a discrepancy and
+    takes the 1 direction; taken against |target|, or all the way to an all
+    ones id, that ends the pass as in GenericOneWireMaster.SearchPass.
+
+    Returns
+      tuple of (id found, discrepancies), or None
+    """
+    if not self._CheckReset(read[0]):
+      return None
+    rn = 0L
+    discrepancies = 0L
+    for i, byte in enumerate(read[2:]):
+      for j in xrange(4):
+        bit = 4*i + j
+        if (byte >> (2*j + 1)) & 1:
+          rn |= 1L << bit
+          if (byte >> (2*j)) & 1 and not (target >> bit) & 1:
+            return None
+        if (byte >> (2*j)) & 1:
+          discrepancies |= 1L << bit
+    if rn == 0xffffffffffffffffL:
+      return None
+    return rn, discrepancies
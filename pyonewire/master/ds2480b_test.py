@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+"""
+Tests of DS2480BMaster against the ds2480bsim emulator
+
+  Copyright 2008 mike wakerly <opensource@hoho.com>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+
+PtyTest drives the master through its termios serial port, with the
+emulated adapter at the other end of a pseudo terminal.
+"""
+
+import unittest
+
+from pyonewire.device import ds18x20
+from pyonewire.master import ds2480b
+from pyonewire.master import ds2480bsim
+from pyonewire.master import GenericOneWireMaster
+from pyonewire.master import SimulatedOneWireMaster
+
+ROM_SEARCH = GenericOneWireMaster.ROM_SEARCH
+
+
+def _Bus():
+  sensors = SimulatedOneWireMaster.MakeSensorBus(12, seed=9)
+  sensors[0].parasite = True
+  eeprom = SimulatedOneWireMaster.VirtualDS2433(0x5a)
+  return SimulatedOneWireMaster.SimulatedBus(sensors + [eeprom])
+
+
+class PtyTest(unittest.TestCase):
+  def setUp(self):
+    self.bus = _Bus()
+    self.roms = sorted(device.rom for device in self.bus.devices)
+    self.pty = ds2480bsim.PtyDS2480B(self.bus)
+    self.master = ds2480b.DS2480BMaster(self.pty.GetPath())
+    # the same bus, through the generic triplet level code
+    self.reference = SimulatedOneWireMaster.SimulatedOneWireMaster(
+        bus=self.bus)
+
+  def tearDown(self):
+    self.master.Close()
+    self.pty.Close()
+
+  def testSearch(self):
+    self.assertEqual(sorted(self.master.Search(ROM_SEARCH)), self.roms)
+    sensors = [rom for rom in self.roms if rom & 0xff == 0x28]
+    self.assertEqual(sorted(self.master.Search(ROM_SEARCH, family=0x28)),
+                     sensors)
+
+  def testSearchPass(self):
+    # the accelerated passes agree with triplets, discrepancies included
+    for target in [0L] + self.roms + [rom ^ (1L << 20) for rom in self.roms]:
+      self.assertEqual(self.master.SearchPass(ROM_SEARCH, target),
+                       self.reference.SearchPass(ROM_SEARCH, target))
+
+  def testVerifyRoms(self):
+    missing = self.roms[3] ^ (1L << 30)
+    candidates = self.roms + [missing]
+    self.assertEqual(self.master.VerifyRoms(candidates), self.roms)
+    self.assertEqual(self.master.VerifyPaths(candidates),
+                     self.reference.VerifyPaths(candidates))
+    self.assertEqual(self.master.VerifyRoms([]), [])
+
+  def testConversion(self):
+    roms = [rom for rom in self.roms if rom & 0xff == 0x28]
+    for device in self.bus.devices:
+      device.temperature = 20.0 + (device.rom & 0x7) / 2.0
+    readings = ds18x20.DS18x20(self.master, roms).Read()
+    for device in self.bus.devices:
+      if device.rom in readings:
+        self.assertEqual(readings[device.rom], device.temperature)
+    # the pullup lasted for the conversion, then was stopped
+    self.assertTrue(self.bus.pullup_time >= ds18x20.CONVERSION_TIME)
+    self.assertTrue(self.master.ResetBus())
+
+  def testModeEscape(self):
+    # MODE_COMMAND in data mode is doubled, or the adapter would switch
+    eeprom = [rom for rom in self.roms if rom & 0xff == 0x23][0]
+    data = [ds2480b.MODE_COMMAND, 0x00, ds2480b.MODE_DATA,
+            ds2480b.MODE_COMMAND, ds2480b.MODE_STOP_PULSE]
+    self.assertTrue(self.master.WritePage(eeprom, 0, data))
+    self.assertEqual(self.master.ReadMemory(eeprom, 0, len(data)), data)
+
+
+class RecordingPort(ds2480bsim.FakeSerialPort):
+  """A FakeSerialPort keeping the bytes of each write."""
+  def __init__(self, bus):
+    ds2480bsim.FakeSerialPort.__init__(self, bus)
+    self.sent = []
+
+  def Write(self, data):
+    self.sent.append(list(bytearray(data)))
+    ds2480bsim.FakeSerialPort.Write(self, data)
+
+
+class ExchangeTest(unittest.TestCase):
+  def setUp(self):
+    self.bus = _Bus()
+    self.port = RecordingPort(self.bus)
+    self.master = ds2480b.DS2480BMaster(port=self.port)
+    self.master.Open()
+    self.master.ResetTransactionCount()
+    self.port.sent = []
+
+  def testModeSwitching(self):
+    reset = (ds2480b.CMD_COMM | ds2480b.FUNCTSEL_RESET |
+             ds2480b.SPEEDSEL_FLEX)
+    self.assertTrue(self.master.ResetBus())
+    self.master.WriteBlock([GenericOneWireMaster.ROM_SKIP,
+                            ds2480b.MODE_COMMAND])
+    self.assertTrue(self.master.ResetBus())
+    self.assertEqual(self.port.sent, [
+        [reset],
+        [ds2480b.MODE_DATA, GenericOneWireMaster.ROM_SKIP,
+         ds2480b.MODE_COMMAND, ds2480b.MODE_COMMAND],
+        [ds2480b.MODE_COMMAND, reset],
+    ])
+
+  def testOneExchangePerPass(self):
+    self.master.SearchPass(ROM_SEARCH, 0L)
+    self.assertEqual(len(self.port.sent), 1)
+    self.assertEqual(self.master.GetTransactionCount(), 1)
+
+  def _Answer(self, taken, flags):
+    # the answer to _QueueSearchPass: reset, search command, then four id
+    # bits per byte, each a discrepancy flag then the direction taken
+    answer = [ds2480b.RESET_RESPONSE | ds2480b.RESET_PRESENCE, ROM_SEARCH]
+    for i in xrange(0, 64, 4):
+      byte = 0
+      for j in xrange(4):
+        byte |= ((flags >> (i + j)) & 1) << (2*j)
+        byte |= ((taken >> (i + j)) & 1) << (2*j + 1)
+      answer.append(byte)
+    return answer
+
+  def testDecodeDiscrepancies(self):
+    taken = 0x0123456789abcdefL
+    flags = (1L << 3) | (1L << 10) | (1L << 63)
+    # directions taken at a discrepancy follow the target
+    target = taken & flags
+    self.assertEqual(
+        self.master._DecodeSearchPass(self._Answer(taken, flags), target),
+        (taken, flags))
+
+  def testDecodeNoDevice(self):
+    # with nobody left on the path the adapter flags a discrepancy and
+    # takes the 1 direction, against a target with a 0 there
+    target = 0xefL
+    flags = 1L << 4
+    self.assertEqual(
+        self.master._DecodeSearchPass(self._Answer(target | flags, flags),
+                                      target), None)
+    ones = 0xffffffffffffffffL
+    self.assertEqual(
+        self.master._DecodeSearchPass(self._Answer(ones, ones), ones), None)
+
+  def testDecodeNoPresence(self):
+    answer = self._Answer(0L, 0L)
+    answer[0] = ds2480b.RESET_RESPONSE | ds2480b.RESET_NO_PRESENCE
+    self.assertEqual(self.master._DecodeSearchPass(answer, 0L), None)
+
+
+if __name__ == '__main__':
+  unittest.main()
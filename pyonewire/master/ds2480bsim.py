@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+"""
+DS2480B emulation for the pyonewire package
+
+  Copyright 2008 mike wakerly <opensource@hoho.com>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+
+FakeDS2480B runs the DS2480B serial protocol against a SimulatedBus. It can
+be handed to DS2480BMaster directly, through FakeSerialPort:
+
+  bus = SimulatedOneWireMaster.SimulatedBus(devices)
+  master = ds2480b.DS2480BMaster(port=ds2480bsim.FakeSerialPort(bus))
+
+or served on a pseudo terminal by PtyDS2480B, so that the master opens it
+like any serial port:
+
+  adapter = ds2480bsim.PtyDS2480B(bus)
+  master = ds2480b.DS2480BMaster(adapter.GetPath())
+"""
+
+import fcntl
+import os
+import select
+import struct
+import termios
+import threading
+import time
+import tty
+
+from pyonewire.master import ds2480b
+from pyonewire.master import GenericOneWireMaster
+from pyonewire.master import SimulatedOneWireMaster
+
+# pseudo terminal packet mode flag for an input flush; see tty_ioctl(4)
+TIOCPKT_FLUSHREAD = 0x01
+
+
+class FakeSerialError(IOError):
+  """Raised where a serial port would read garbage or time out"""
+
+
+class FakeDS2480B(object):
+  """Emulates a DS2480B: bytes are fed in, and its answers come out.
+
+  Configuration is stored and answered, but does not change the timing of
+  the bus. Strong pullups are accounted on the bus for as long as they
+  really last.
+  """
+  def __init__(self, bus):
+    self.bus = bus
+    self.PowerOnReset()
+
+  def PowerOnReset(self):
+    """Reset the adapter, as a break on the line does."""
+    self.bus.SetSpeed(GenericOneWireMaster.SPEED_REGULAR)
+    self._calibrated = False
+    self._mode = ds2480b.MODE_COMMAND
+    self._escape = False
+    self._search = False
+    self._pulse = None
+    self._config = [0] * 8
+    self.baud = 9600
+
+  def Feed(self, data):
+    """Process bytes sent to the adapter.
+
+    Returns
+      str of the bytes answered
+    """
+    out = []
+    for byte in bytearray(data):
+      self._Byte(byte, out)
+    return str(bytearray(out))
+
+  def _Byte(self, byte, out):
+    if not self._calibrated:
+      # the first reset after power on only measures the timing
+      if byte & 0xe3 == ds2480b.CMD_COMM | ds2480b.FUNCTSEL_RESET:
+        self._calibrated = True
+      return
+    if self._mode == ds2480b.MODE_DATA:
+      if self._escape:
+        self._escape = False
+        if byte == ds2480b.MODE_COMMAND:
+          out.append(self._DataByte(byte))
+          return
+        self._mode = ds2480b.MODE_COMMAND
+      elif byte == ds2480b.MODE_COMMAND:
+        self._escape = True
+        return
+      else:
+        out.append(self._DataByte(byte))
+        return
+
+    if self._pulse is not None:
+      # any byte ends a pullup, answered with the pulse command
+      self.bus.Pullup((time.time() - self._pulse) * 1000)
+      self._pulse = None
+      out.append(ds2480b.CMD_COMM | ds2480b.FUNCTSEL_CHMOD |
+                 ds2480b.SPEEDSEL_PULSE)
+      if byte == ds2480b.MODE_STOP_PULSE:
+        return
+    if byte == ds2480b.MODE_DATA:
+      self._mode = ds2480b.MODE_DATA
+    elif byte in (ds2480b.MODE_COMMAND, ds2480b.MODE_STOP_PULSE):
+      pass
+    elif byte & ds2480b.CMD_COMM == ds2480b.CMD_COMM:
+      self._CommCommand(byte, out)
+    elif byte & ds2480b.CMD_COMM == ds2480b.CMD_CONFIG:
+      self._ConfigCommand(byte, out)
+
+  def _CommCommand(self, byte, out):
+    function = byte & 0x60
+    speed = byte & ds2480b.SPEEDSEL_PULSE
+    if function == ds2480b.FUNCTSEL_CHMOD:
+      if speed == ds2480b.SPEEDSEL_PULSE and not byte & ds2480b.PRIME5V:
+        self._pulse = time.time()
+      return
+    if speed == ds2480b.SPEEDSEL_OD:
+      self.bus.SetSpeed(GenericOneWireMaster.SPEED_OVERDRIVE)
+    else:
+      self.bus.SetSpeed(GenericOneWireMaster.SPEED_REGULAR)
+    if function == ds2480b.FUNCTSEL_BIT:
+      level = self.bus.TouchBit(byte & ds2480b.BITPOL_ONE and 1 or 0)
+      out.append(byte & 0xfc | (level and 0x03 or 0))
+      if byte & ds2480b.PRIME5V:
+        self._pulse = time.time()
+    elif function == ds2480b.FUNCTSEL_RESET:
+      if self.bus.Reset():
+        out.append(ds2480b.RESET_RESPONSE | ds2480b.RESET_PRESENCE)
+      else:
+        out.append(ds2480b.RESET_RESPONSE | ds2480b.RESET_NO_PRESENCE)
+    else:
+      # the polarity bit tells search accelerator on from off
+      self._search = bool(byte & ds2480b.BITPOL_ONE)
+
+  def _ConfigCommand(self, byte, out):
+    param = (byte >> 4) & 0x07
+    if not param:
+      # read back the parameter given in the value bits
+      out.append(self._config[(byte >> 1) & 0x07] << 1)
+      return
+    self._config[param] = (byte >> 1) & 0x07
+    if byte & 0x70 == ds2480b.PARMSEL_BAUDRATE:
+      for baud, value in ds2480b.BAUD_RATES.iteritems():
+        if value == byte & 0x0e:
+          self.baud = baud
+    out.append(byte & ~ds2480b.CMD_CONFIG)
+
+  def _DataByte(self, byte):
+    if not self._search:
+      return self.bus.TouchByte(byte)
+    # four id bits per byte: the direction to take at a discrepancy in, the
+    # discrepancy flag and the direction taken out
+    ret = 0
+    for j in xrange(4):
+      triplet = self.bus.Triplet((byte >> (2*j + 1)) & 1)
+      if triplet == 0x03:
+        ret |= 0x03 << (2*j)
+        continue
+      if not triplet & 0x03:
+        ret |= 1 << (2*j)
+      ret |= (triplet >> 2) << (2*j + 1)
+    return ret
+
+
+class FakeSerialPort(object):
+  """A SerialPort with a FakeDS2480B at the other end.
+
+  Each Write is counted in |writes|.
+  """
+  def __init__(self, bus):
+    self.adapter = FakeDS2480B(bus)
+    self.baud = 9600
+    self.writes = 0
+    self._received = ''
+
+  def SetBaud(self, baud):
+    self.baud = baud
+
+  def Write(self, data):
+    self.writes += 1
+    self._received += self.adapter.Feed(data)
+
+  def Read(self, size):
+    if self.baud != self.adapter.baud:
+      raise FakeSerialError, "reading at %i baud from an adapter at %i" % (
+          self.baud, self.adapter.baud)
+    ret = self._received[:size]
+    self._received = self._received[size:]
+    return ret
+
+  def Flush(self):
+    self._received = ''
+
+  def SendBreak(self):
+    self.adapter.PowerOnReset()
+
+  def Close(self):
+    pass
+
+
+class PtyDS2480B(object):
+  """Serves a FakeDS2480B on a pseudo terminal, from a thread.
+
+  A pseudo terminal carries no break, so the input flush DS2480BMaster.Reset
+  makes right after its break stands in for it: the pty runs in packet mode,
+  where the flush is reported, and resets the adapter.
+  """
+  def __init__(self, bus):
+    self.adapter = FakeDS2480B(bus)
+    self._fd, self._slave = os.openpty()
+    tty.setraw(self._slave)
+    fcntl.ioctl(self._fd, termios.TIOCPKT, struct.pack('i', 1))
+    self._stop = False
+    self._thread = threading.Thread(target=self._Serve, name='ds2480b pty')
+    self._thread.daemon = True
+    self._thread.start()
+
+  def GetPath(self):
+    """Returns the path of the pseudo terminal to open as the serial port."""
+    return os.ttyname(self._slave)
+
+  def _Serve(self):
+    while not self._stop:
+      if not select.select([self._fd], [], [], 0.05)[0]:
+        continue
+      try:
+        packet = os.read(self._fd, 4096)
+      except OSError:
+        return
+      if packet[0] != '\0':
+        if ord(packet[0]) & TIOCPKT_FLUSHREAD:
+          self.adapter.PowerOnReset()
+        continue
+      data = self.adapter.Feed(packet[1:])
+      while data:
+        data = data[os.write(self._fd, data):]
+
+  def Close(self):
+    self._stop = True
+    self._thread.join()
+    os.close(self._fd)
+    os.close(self._slave)
+
+
+def _Benchmark(count):
+  bus = SimulatedOneWireMaster.SimulatedBus(
+      SimulatedOneWireMaster.MakeSensorBus(count))
+  port = FakeSerialPort(bus)
+  master = ds2480b.DS2480BMaster(port=port)
+  master.Open()
+  tests = [
+    ('accelerated search', lambda: master.Search(master.SEARCH_NORMAL)),
+    ('triplet search', lambda: SimulatedOneWireMaster.TripletSearch(master)),
+  ]
+  for name, fn in tests:
+    port.writes = 0
+    start = time.time()
+    ids = fn()
+    assert len(ids) == count
+    print '  %-18s wall %8.3fs  exchanges %7i' % (
+        name, time.time() - start, port.writes)
+
+
+if __name__ == '__main__':
+  for count in (10, 100):
+    print '%i devices' % count
+    _Benchmark(count)
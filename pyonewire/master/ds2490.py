@@ -25,12 +25,15 @@ Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
 """
 
 import logging
+import struct
 import time
-import usb
 
+from pyonewire.core import crc
 from pyonewire.core import cstruct
+from pyonewire.core import stats
 from pyonewire.core import util
 from pyonewire.master import GenericOneWireMaster
+from pyonewire.master import usbtrace
 
 # Request codes
 CONTROL_CMD = 0x00
@@ -58,6 +61,9 @@ RR_CRC = 0x20  # crc error detected
 RR_RDP = 0x40  # redirected page
 RR_EOS = 0x80  # end of search error
 
+# Result register flags that abort a hardware search
+RR_SEARCH_ERRORS = RR_SH | RR_CMP | RR_CRC | RR_EOS
+
 # Value field, Control commands
 # Control Command Code Constants
 CTL_RESET_DEVICE = 0x0000
@@ -97,6 +103,7 @@ COMM_RTS = 0x4000
 COMM_DT = 0x2000
 COMM_SPU = 0x1000
 COMM_F = 0x0800
+COMM_NTF = 0x0400
 COMM_ICP = 0x0200
 COMM_RST = 0x0100
 
@@ -138,61 +145,189 @@ MOD_PROG_PULSE_DURATION = 0x0005
 MOD_WRITE1_LOWTIME = 0x0006
 MOD_DSOW0_TREC = 0x0007
 
-# duration of strong pullup, in ms
+# duration of strong pullup, in ms; enough for a 12 bit temperature
+# conversion or an EEPROM copy
 PULLUP_PULSE_DURATION = 750
 
 TIMEOUT_LIBUSB = 1000
 
-TRACE = False
-TRACE_LEVEL = 0
-
-def trace(fn):
-  def wrapped(*args, **kwargs):
-    global TRACE_LEVEL
-    if not TRACE:
-      return fn(*args, **kwargs)
-    pad = '  ' * TRACE_LEVEL
-    TRACE_LEVEL += 1
-    print '%s> %s' % (pad, fn.__name__)
-    ret = fn(*args, **kwargs)
-    print '%s< %s' % (pad, fn.__name__)
-    TRACE_LEVEL -= 1
-    return ret
-  return wrapped
+# size of the adapter's data FIFOs, in bytes
+FIFO_SIZE = 128
 
+# bytes per block command when streaming; two chunks fit a FIFO, so the next
+# one can be sent while the adapter works on the current one
+STREAM_CHUNK = FIFO_SIZE / 2
 
-class UsbError(Exception):
-  """Raised when a libusb operation returns an error"""
+# maximum time a hardware search command may go without returning an id,
+# in seconds
+SEARCH_TIMEOUT = 10.0
 
-def StatusPacket():
-  return cstruct.cStruct(( ('B', 'EnableFlags'),
-                           ('B', 'OneWireSpeed'),
-                           ('B', 'StrongPullUpDirection'),
-                           ('B', 'ProgPulseDuration'),
-                           ('B', 'PullDownSlewRate'),
-                           ('B', 'Write1LowTime'),
-                           ('B', 'DSOW0RecoveryTime'),
-                           ('B', 'Reserved1'),
-                           ('B', 'StatusFlags'),
-                           ('B', 'CurrentCommCmd1'),
-                           ('B', 'CurrentCommCmd2'),
-                           ('B', 'CommBufferStatus'),
-                           ('B', 'WriteBufferStatus'),
-                           ('B', 'ReadBufferStatus'),
-                           ('B', 'Reserved2'),
-                           ('B', 'Reserved3'),
-                        ))
+# Delays between status polls while waiting for the adapter to go idle, in
+# seconds. The first poll is made immediately and the last delay repeats.
+# Each poll already blocks until the next 1 ms interrupt interval of the
+# status endpoint, so the leading zeros spin on the endpoint rather than the
+# CPU.
+WAIT_SCHEDULE = (0, 0, 0, 0.0005, 0.001, 0.002, 0.005, 0.01)
 
+# maximum time to wait for the adapter to go idle, in seconds
+WAIT_TIMEOUT = 1.0
 
-def GetDevice(vendor_id, product_id):
-  buses = usb.busses()
-  for bus in buses:
+# bucket bounds of the WaitStatus latency histogram, in seconds
+WAIT_HISTOGRAM_BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                         0.025, 0.1, 1.0)
+
+# family code of the ID chip on the 1-Wire bus of every DS2490
+ADAPTER_ID_FAMILY = 0x81
+
+# alternate interface setting with 64 byte bulk packets and 1 ms status
+# endpoint polling
+ALT_INTERFACE = 3
+
+class UsbError(Exception):
+  """Raised when a libusb operation returns an error"""
+
+class SearchError(Exception):
+  """Raised when the adapter reports an error during a hardware search"""
+
+# compiled once; each master fills in a single record, see GetStatus
+StatusPacket = cstruct.CompileStruct('StatusPacket', (
+    ('B', 'EnableFlags'),
+    ('B', 'OneWireSpeed'),
+    ('B', 'StrongPullUpDirection'),
+    ('B', 'ProgPulseDuration'),
+    ('B', 'PullDownSlewRate'),
+    ('B', 'Write1LowTime'),
+    ('B', 'DSOW0RecoveryTime'),
+    ('B', 'Reserved1'),
+    ('B', 'StatusFlags'),
+    ('B', 'CurrentCommCmd1'),
+    ('B', 'CurrentCommCmd2'),
+    ('B', 'CommBufferStatus'),
+    ('B', 'WriteBufferStatus'),
+    ('B', 'ReadBufferStatus'),
+    ('B', 'Reserved2'),
+    ('B', 'Reserved3'),
+))
+
+
+def _MeasureStatus(master, args, ret):
+  return {'endpoint': EP_STATUS, 'nbytes': StatusPacket.size + len(ret[1])}
+
+def _MeasureDataIn(master, args, ret):
+  return {'endpoint': EP_DATA_IN, 'nbytes': len(ret)}
+
+def _MeasureDataOut(master, args, ret):
+  return {'endpoint': EP_DATA_OUT, 'nbytes': len(args[0])}
+
+def _MeasureWait(master, args, ret):
+  return {'polls': master._wait_polls}
+
+# methods reported by DS2490Master.EnableInstrumentation, with the function
+# measuring what each transferred; see stats.Instrument
+INSTRUMENTED_METHODS = {
+  'SendControlCommand': None,
+  'SendControlMode': None,
+  'SendControl': None,
+  'GetStatus': _MeasureStatus,
+  'RecvData': _MeasureDataIn,
+  'SendData': _MeasureDataOut,
+  'WaitStatus': _MeasureWait,
+  'WaitPullup': None,
+  'Reset': None,
+  'SetSpeed': None,
+  'ResetBus': None,
+  'StartPulse': None,
+  'TouchBit': None,
+  'WriteBit': None,
+  'TouchBits': None,
+  'Triplet': None,
+  'ReadByte': None,
+  'WriteByte': None,
+  'ReadBlock': None,
+  'WriteBlock': None,
+  'Search': None,
+  'SearchPass': None,
+}
+
+
+# the usb module, imported on first use; see _Usb
+usb = None
+
+def _Usb():
+  """Returns the pyusb module.
+
+  It is only imported once a device is looked for, so that importing this
+  module is cheap, and works on hosts without pyusb for emulated adapters.
+  """
+  global usb
+  if usb is None:
+    import usb as module
+    usb = module
+  return usb
+
+def GetDevices(vendor_id, product_id):
+  """Returns every usb device with the given ids, as (bus, device) tuples."""
+  ret = []
+  for bus in _Usb().busses():
     for device in bus.devices:
       if (device.idVendor, device.idProduct) == (vendor_id, product_id):
-        return device
+        ret.append((bus, device))
+  return ret
+
+def GetDevice(vendor_id, product_id):
+  """Returns the first usb device with the given ids, or None."""
+  devices = GetDevices(vendor_id, product_id)
+  if devices:
+    return devices[0][1]
   return None
 
-logging.basicConfig(level=logging.DEBUG)
+def GetUsbSerial(device):
+  """Returns the usb serial number string of |device|, or None."""
+  if not device.iSerialNumber:
+    return None
+  try:
+    handle = device.open()
+  except _Usb().USBError:
+    return None
+  try:
+    return handle.getString(device.iSerialNumber, 64)
+  except _Usb().USBError:
+    return None
+  finally:
+    _CloseHandle(handle)
+
+def _CloseHandle(handle):
+  """Close a handle from device.open() now, not when it is collected.
+
+  pyusb 1.x keeps the device open in its legacy handle until its resources
+  are disposed of; pyusb 0.x handles close as they are freed.
+  """
+  usb_util = getattr(_Usb(), 'util', None)
+  device = getattr(handle, 'dev', None)
+  if usb_util is not None and device is not None:
+    usb_util.dispose_resources(device)
+
+def FindAdapters(bus=None, address=None, serial=None):
+  """List the DS2490 adapters attached, optionally picking some out.
+
+  Args
+    bus - usb bus name (e.g. '001') the adapter must be on
+    address - usb device name (e.g. '004') of the adapter on its bus
+    serial - usb serial number string of the adapter
+  Returns
+    list of (bus name, device name, usb device) tuples
+  """
+  ret = []
+  for usb_bus, device in GetDevices(DS2490Master.VENDORID,
+                                    DS2490Master.PRODUCTID):
+    if bus is not None and usb_bus.dirname != bus:
+      continue
+    if address is not None and device.filename != address:
+      continue
+    if serial is not None and GetUsbSerial(device) != serial:
+      continue
+    ret.append((usb_bus.dirname, device.filename, device))
+  return ret
 
 class DS2490Master(GenericOneWireMaster.GenericOneWireMaster):
   VENDORID    = 0x04fa
@@ -200,13 +335,74 @@ class DS2490Master(GenericOneWireMaster.GenericOneWireMaster):
   INTERFACEID = 0
   SEARCH_NORMAL = 0xf0
   SEARCH_ALARM = 0xec
-  def __init__(self):
+  def __init__(self, wait_schedule=WAIT_SCHEDULE, handle=None, device=None,
+               record=None):
+    """Create a master; the adapter is opened and reset on first use.
+
+    Args
+      wait_schedule - delays between status polls, see WAIT_SCHEDULE
+      handle - an already opened usb handle, or an object emulating one such
+               as ds2490sim.FakeDS2490Handle
+      device - the usb device of the adapter to open, see FindAdapters; by
+               default the first DS2490 found is opened
+      record - path of a file to record every usb transfer to, see usbtrace
+    """
     GenericOneWireMaster.GenericOneWireMaster.__init__(self)
     self._logger = logging.getLogger("ds2490")
-    self._device = None
-    self._handle = None
+    self._device = device
+    self._handle = handle
+    self._transactions = 0
+    self._pullup_duration = None
+    self._wait_schedule = tuple(wait_schedule) or (0,)
+    self._wait_histogram = stats.Histogram(WAIT_HISTOGRAM_BOUNDS)
+    self._wait_polls = 0
+    self._opened = False
+    self._owns_handle = handle is None
+    self._record = record
+    # direction write of the last Triplet, not sent yet; see Triplet
+    self._direction = None
+    self._status = StatusPacket()
+
+  def Open(self):
+    """Open and reset the adapter, unless already done.
+
+    This happens by itself on the first operation; calling it up front moves
+    the time taken, and any error, to a known place.
+    """
+    if self._opened:
+      return
+    if self._handle is None:
+      self._OpenDevice()
+    if self._record is not None:
+      self._handle = usbtrace.RecordingHandle(self._handle, self._record)
+      self._record = None
+    self._opened = True
+    self.Reset()
+    self._logger.debug('completed init')
 
-    self._device = GetDevice(self.VENDORID, self.PRODUCTID)
+  def Close(self):
+    """Release an adapter opened by Open; it is reopened on next use.
+
+    A recording is finished here.
+    """
+    if self._opened:
+      handle = self._handle
+      if isinstance(handle, usbtrace.RecordingHandle):
+        handle.Close()
+        self._handle = handle.GetHandle()
+      if self._owns_handle:
+        self._handle.releaseInterface()
+        self._handle = None
+    self._opened = False
+
+  def _Handle(self):
+    if not self._opened:
+      self.Open()
+    return self._handle
+
+  def _OpenDevice(self):
+    if self._device is None:
+      self._device = GetDevice(self.VENDORID, self.PRODUCTID)
 
     if not self._device:
       self._logger.fatal('Could not acquire device')
@@ -219,36 +415,87 @@ class DS2490Master(GenericOneWireMaster.GenericOneWireMaster):
     self._intf = self._conf.interfaces[0][0]
     self._handle.setConfiguration(self._conf)
     self._handle.claimInterface(self._intf)
-    self._handle.setAltInterface(1)
-
-    self.Reset()
-
-    self._logger.debug('completed init')
+    self._handle.setAltInterface(ALT_INTERFACE)
+
+  def GetAdapterId(self):
+    """Returns the 64 bit id of the adapter's own ID chip, or None.
+
+    Every DS2490 has a DS2401 style ID chip (family ADAPTER_ID_FAMILY) on
+    its 1-Wire bus, which tells adapters apart when they have no usb serial
+    number.
+    """
+    ids = self.Search(self.SEARCH_NORMAL, family=ADAPTER_ID_FAMILY)
+    if ids:
+      return ids[0]
+    return None
+
+  def GetTransactionCount(self):
+    """Returns the number of USB transfers made since the last reset."""
+    return self._transactions
+
+  def ResetTransactionCount(self):
+    """Reset the USB transfer counter to zero."""
+    self._transactions = 0
+
+  def GetWaitHistogram(self):
+    """Returns the stats.Histogram of WaitStatus latencies, in seconds."""
+    return self._wait_histogram
+
+  def EnableInstrumentation(self, hook=None):
+    """Report every adapter operation to a hook.
+
+    Each call of the methods in INSTRUMENTED_METHODS is timed and reported,
+    with the bytes moved per endpoint and the number of status polls of
+    each WaitStatus. The time spent in WaitPullup is the pullup time.
+
+    Args
+      hook - callable as hook(name, seconds, **extra); a new
+             stats.OperationStats by default
+    Returns
+      the hook
+    """
+    if hook is None:
+      hook = stats.OperationStats()
+    stats.Instrument(self, INSTRUMENTED_METHODS, hook)
+    return hook
+
+  def DisableInstrumentation(self):
+    """Stop reporting; the methods run unwrapped again."""
+    stats.Uninstrument(self, INSTRUMENTED_METHODS)
 
   def _SendMessage(self, command, value, index, timeout=TIMEOUT_LIBUSB):
-    ret = self._handle.controlMsg(requestType=0x40, request=command, buffer='',
-                                  value=value, index=index, timeout=timeout)
+    if self._direction is not None:
+      self._SendDirection()
+    self._transactions += 1
+    ret = self._Handle().controlMsg(requestType=0x40, request=command,
+                                    buffer='', value=value, index=index,
+                                    timeout=timeout)
     if ret:
       raise UsbError, "Error while sending control message: %s" % (ret,)
 
-  @trace
   def SendControlCommand(self, value, index, timeout=TIMEOUT_LIBUSB):
     self._SendMessage(CONTROL_CMD, value, index, timeout)
 
-  @trace
   def SendControlMode(self, value, index, timeout=TIMEOUT_LIBUSB):
     self._SendMessage(MODE_CMD, value, index, timeout)
 
-  @trace
   def SendControl(self, value, index, timeout=TIMEOUT_LIBUSB):
     self._SendMessage(COMM_CMD, value, index, timeout)
 
-  @trace
   def GetStatus(self):
-    raw = self._handle.bulkRead(EP_STATUS, 32, TIMEOUT_LIBUSB)
-    status = StatusPacket()
-    status.UnpackFromTuple(raw[:16])
-    result_regs = raw[16:]
+    """Poll the status endpoint.
+
+    The same StatusPacket is filled in by every poll, so it only holds until
+    the next one.
+
+    Returns
+      tuple of (StatusPacket, result registers)
+    """
+    self._transactions += 1
+    raw = self._Handle().interruptRead(EP_STATUS, 32, TIMEOUT_LIBUSB)
+    status = self._status
+    status.unpack_from(bytearray(raw))
+    result_regs = raw[StatusPacket.size:]
     if result_regs:
       self._logger.info('result regs: %s' % repr(result_regs))
     if status.StatusFlags & ST_EPOF:
@@ -256,34 +503,54 @@ class DS2490Master(GenericOneWireMaster.GenericOneWireMaster):
       self.SendControlCommand(CTL_RESET_DEVICE, 0)
     return status, result_regs
 
-  @trace
   def RecvData(self, size):
+    self._transactions += 1
     try:
-      raw = self._handle.bulkRead(EP_DATA_IN, size, TIMEOUT_LIBUSB)
-    except usb.USBError:
-      print self.WaitStatus()
+      raw = self._Handle().bulkRead(EP_DATA_IN, size, TIMEOUT_LIBUSB)
+    except Exception:
+      self._logger.error('bulk read failed, adapter status: %s' %
+                         (self.GetStatus(),))
       raise
     return raw
 
-  @trace
   def SendData(self, buf):
-    return self._handle.bulkWrite(EP_DATA_OUT, buf, TIMEOUT_LIBUSB)
-
-  @trace
-  def WaitStatus(self):
-    count = 0
-    status = None
+    if self._direction is not None:
+      self._SendDirection()
+    self._transactions += 1
+    return self._Handle().bulkWrite(EP_DATA_OUT, buf, TIMEOUT_LIBUSB)
+
+  def WaitStatus(self, regs=None):
+    """Poll the status endpoint until the adapter is idle.
+
+    Polls follow the wait schedule given to the constructor, and the time
+    taken is recorded in the wait histogram.
+
+    Args
+      regs - optional list to append the result registers seen to
+    Returns
+      the last status packet read
+    """
+    start = time.time()
+    deadline = start + WAIT_TIMEOUT
+    schedule = self._wait_schedule
+    last = len(schedule) - 1
+    polls = 0
     while True:
-      status, regs = self.GetStatus()
-      count += 1
-      time.sleep(0.01)
+      status, result_regs = self.GetStatus()
+      if regs is not None:
+        regs.extend(result_regs)
       if status.StatusFlags & ST_IDLE:
         break
-      if count >= 100:
+      if time.time() > deadline:
         raise RuntimeError, "took too long to get status"
+      delay = schedule[min(polls, last)]
+      if delay:
+        time.sleep(delay)
+      polls += 1
+    self._wait_polls = polls + 1
+    self._wait_histogram.Add(time.time() - start)
     return status
 
-  @trace
   def Reset(self):
     # por reset
     self.SendControlCommand(value=CTL_RESET_DEVICE, index=0)
@@ -300,19 +567,54 @@ class DS2490Master(GenericOneWireMaster.GenericOneWireMaster):
 
     # disable strong pullup, but leave progrm pulse enabled (faster)
     self.SendControlMode(value=MOD_PULSE_EN, index=ENABLEPULSE_PRGE)
+    self._pullup_duration = None
+    self._speed = GenericOneWireMaster.SPEED_REGULAR
 
     return self.WaitStatus()
 
-  @trace
-  def StartPulse(self, delay):
-    outdelay = 1 + (delay >> 4)
-    self.SendControlMode(MOD_PULSE_EN, ENABLEPULSE_SPUE)
-    self.SendControl(COMM_SET_DURATION | COMM_IM, outdelay)
+  def ResetBus(self):
+    self.SendControl(COMM_1_WIRE_RESET | COMM_IM | COMM_NTF, 0)
+    regs = []
+    self.WaitStatus(regs)
+    return PresenceDetected(regs)
+
+  def SetSpeed(self, speed):
+    """Switch the adapter between flexible regular speed and overdrive."""
+    if speed == self._speed:
+      return
+    if speed == GenericOneWireMaster.SPEED_OVERDRIVE:
+      self.SendControlMode(MOD_1WIRE_SPEED, ONEWIREBUSSPEED_OVERDRIVE)
+    else:
+      self.SendControlMode(MOD_1WIRE_SPEED, ONEWIREBUSSPEED_FLEXIBLE)
+    self._speed = speed
+
+  def _ArmPullup(self, duration):
+    """Enable the strong pullup for the next command sent with COMM_SPU.
+
+    The mode and duration are only sent when they differ from what the
+    adapter was last set to.
+
+    Args
+      duration - length of the pullup, in ms
+    """
+    if duration == self._pullup_duration:
+      return
+    if self._pullup_duration is None:
+      self.SendControlMode(MOD_PULSE_EN, ENABLEPULSE_SPUE)
+    self.SendControl(COMM_SET_DURATION | COMM_IM, PullupDurationIndex(duration))
+    self._pullup_duration = duration
+
+  def StartPulse(self, delay, wait=True):
+    self._ArmPullup(delay)
     self.SendControl(COMM_PULSE | COMM_IM | COMM_F, 0)
-    time.sleep(delay/1000.0) # mdelay
+    if wait:
+      return self.WaitPullup(delay)
+
+  def WaitPullup(self, duration, elapsed=0):
+    GenericOneWireMaster.GenericOneWireMaster.WaitPullup(self, duration,
+                                                         elapsed)
     return self.WaitStatus()
 
-  @trace
   def TouchBit(self, bit):
     val = COMM_BIT_IO | COMM_IM
     if bit:
@@ -332,110 +634,720 @@ class DS2490Master(GenericOneWireMaster.GenericOneWireMaster):
     ret = self.RecvData(1)
     return ret[0] 
 
-  @trace
   def WriteBit(self, bit):
     val = COMM_BIT_IO | COMM_IM | COMM_ICP
     if bit:
       val |= COMM_D
-    self.SendControl(val)
+    self.SendControl(val, 0)
 
     return self.WaitStatus()
 
-  @trace
-  def WriteByte(self, byte):
-    self.SendControl(COMM_BYTE_IO | COMM_IM | COMM_SPU, byte)
-    st = self.WaitStatus()
-    rbyte = self.RecvData(1)
-    self.StartPulse(PULLUP_PULSE_DURATION)
+  def TouchBits(self, bits):
+    """Run a sequence of time slots in one batch.
+
+    A byte of BLOCK_IO is eight time slots, least significant bit first, so
+    the whole bytes of the sequence go out as one block; the bits left over
+    follow as BIT_IO commands queued behind it, each read back as a byte.
+    Everything is started with a single CTL_START_EXE and read back in one
+    bulk read. Where that is more than the FIFO holds, the whole bytes are
+    streamed through _StreamBlocks first.
+
+    Args
+      bits - sequence of bits to touch
+    Returns
+      list of the bits read
+    """
+    bits = list(bits)
+    if not bits:
+      return []
+    nbytes = len(bits) / 8
+    data = GenericOneWireMaster.BitsToBytes(bits)
+    tail = bits[nbytes*8:]
+    ret = []
+    if nbytes + len(tail) > FIFO_SIZE:
+      chunks = GenericOneWireMaster._Chunks(data, STREAM_CHUNK)
+      for unused, read in self._StreamBlocks(chunks):
+        ret.extend(GenericOneWireMaster.BytesToBits(read))
+      nbytes = 0
+      if not tail:
+        return ret
+    if nbytes:
+      self.SendData(data)
+      self.SendControl(COMM_BLOCK_IO, nbytes)
+    for bit in tail:
+      val = COMM_BIT_IO
+      if bit:
+        val |= COMM_D
+      self.SendControl(val, 0)
+    self.SendControlCommand(CTL_START_EXE, 0)
+    self.WaitStatus()
+    read = self.RecvData(nbytes + len(tail))
+    ret.extend(GenericOneWireMaster.BytesToBits(read[:nbytes]))
+    ret.extend(read[nbytes:])
+    return ret
+
+  def Transaction(self):
+    """Returns a new DS2490Transaction for this master."""
+    return DS2490Transaction(self)
+
+  def Triplet(self, bdir):
+    """Combination of two reads and smart write for ROM search.
+
+    The adapter cannot choose the direction from the bits it reads, so the
+    direction write of a triplet is held back and queued ahead of the id and
+    complement reads of the next one: the three BIT_IO commands run with a
+    single CTL_START_EXE, and the two bits read come back in one bulk read,
+    which waits for them without a status poll. Any other command sends a
+    held write first.
+
+    Args
+      bdir - direction to choose if both are valid
+    Returns
+      same as GenericOneWireMaster.Triplet
+    """
+    direction, self._direction = self._direction, None
+    if direction is not None:
+      self.SendControl(direction, 0)
+    self.SendControl(COMM_BIT_IO | COMM_D, 0)
+    self.SendControl(COMM_BIT_IO | COMM_D, 0)
+    self.SendControlCommand(CTL_START_EXE, 0)
+    read = []
+    while len(read) < 2:
+      read.extend(self.RecvData(2 - len(read)))
+
+    retval = GenericOneWireMaster.DecodeTriplet(read[0], read[1], bdir)
+    if retval == 0x03:
+      return retval
+
+    self._direction = COMM_BIT_IO | COMM_ICP
+    if retval & 0x04:
+      self._direction |= COMM_D
+    return retval
+
+  def _SendDirection(self):
+    """Send the direction write held back by Triplet, to run right away."""
+    direction, self._direction = self._direction, None
+    self.SendControl(direction | COMM_IM, 0)
+
+  def WriteByte(self, byte, pullup=0, wait=True):
+    val = COMM_BYTE_IO | COMM_IM
+    if pullup:
+      self._ArmPullup(pullup)
+      val |= COMM_SPU
+    self.SendControl(val, byte)
+    if pullup:
+      # the adapter stays busy until the pullup ends, but the byte read back
+      # is available as soon as the write completes
+      rbyte = self.RecvData(1)
+      if wait:
+        self.WaitPullup(pullup)
+    else:
+      self.WaitStatus()
+      rbyte = self.RecvData(1)
     if len(rbyte) == 1:
       return byte != rbyte[0]
     else:
       return False
 
-  @trace
   def ReadByte(self):
     self.SendControl(COMM_BYTE_IO | COMM_IM, 0xff)
     self.WaitStatus()
     ret = self.RecvData(1)
     return ret[0]
 
-  @trace
   def ReadBlock(self, blocklen):
-    if blocklen > (64*1024):
-      raise ValueError, "Len too long"
+    if blocklen > FIFO_SIZE:
+      ret = []
+      for data in self.IterReadBlock(blocklen):
+        ret.extend(data)
+      return ret
 
     buf = [0xff]*blocklen
     self.SendData(buf)
-    self.SendControl(COMM_BLOCK_IO | COMM_IM | COMM_SPU, blocklen)
+    self.SendControl(COMM_BLOCK_IO | COMM_IM, blocklen)
     self.WaitStatus()
 
     return self.RecvData(blocklen)
 
-  @trace
-  def WriteBlock(self, buf):
+  def WriteBlock(self, buf, pullup=0, wait=True):
+    if len(buf) > FIFO_SIZE:
+      return self.WriteStream(buf, pullup, wait)
+
+    val = COMM_BLOCK_IO | COMM_IM
+    if pullup:
+      # COMM_SPU on a block applies the pullup after its last byte
+      self._ArmPullup(pullup)
+      val |= COMM_SPU
     self.SendData(buf)
-    self.SendControl(COMM_BLOCK_IO | COMM_IM | COMM_SPU, len(buf))
-    self.WaitStatus()
-    b2 = self.RecvData(len(buf))
-    self.StartPulse(PULLUP_PULSE_DURATION)
+    self.SendControl(val, len(buf))
+    if pullup:
+      b2 = self.RecvData(len(buf))
+      if wait:
+        self.WaitPullup(pullup)
+    else:
+      self.WaitStatus()
+      b2 = self.RecvData(len(buf))
 
     return len(b2) != len(buf)
 
-  @trace
-  def Search(self, search_type=SEARCH_NORMAL, max=0):
-    self.Reset()
-
-    # Hardware search command is not working properly when more than one device
-    # is attached.
-    if True:
-      return GenericOneWireMaster.GenericOneWireMaster.Search(self, search_type)
-
-    self.SendData('\x00'*8)
-    self.WaitStatus()
-
-    val = COMM_SEARCH_ACCESS | COMM_IM | COMM_SM | COMM_F
-    index = (max << 8) | search_type
-    self.SendControl(val, index)
-
+  def IterReadBlock(self, numblocks, chunk=STREAM_CHUNK):
+    chunk = min(chunk, STREAM_CHUNK)
+    sizes = [chunk] * (numblocks / chunk)
+    if numblocks % chunk:
+      sizes.append(numblocks % chunk)
+    for unused, data in self._StreamBlocks([0xff] * size for size in sizes):
+      yield list(data)
+
+  def WriteStream(self, data, pullup=0, wait=True):
+    error = False
+    chunks = GenericOneWireMaster._Chunks(data, STREAM_CHUNK)
+    for chunk, data in self._StreamBlocks(chunks, pullup, wait):
+      if len(data) != len(chunk):
+        error = True
+    return error
+
+  def _StreamBlocks(self, chunks, pullup=0, wait=True):
+    """Run one BLOCK_IO command per chunk, keeping the adapter busy.
+
+    While the adapter clocks out one chunk, the next is already sent to
+    EP_DATA_OUT; once a chunk completes, the command for the next is started
+    before the bytes read back are collected. Chunks must be at most
+    STREAM_CHUNK long, so two of them fit in each FIFO.
+
+    Args
+      chunks - iterable of lists of bytes to write
+      pullup - if non-zero, apply a strong pullup for this many ms right
+               after the last chunk
+      wait - if False, do not wait for the pullup to end, see StartPulse
+    Yields
+      (chunk, bytes read back) for each chunk
+    """
+    chunks = iter(chunks)
+    current = next(chunks, None)
+    if current is None:
+      return
+    if pullup:
+      self._ArmPullup(pullup)
+    following = next(chunks, None)
+    self.SendData(current)
+    self.SendControl(self._BlockCommand(following is None and pullup),
+                     len(current))
+    while current is not None:
+      after = None
+      if following is not None:
+        self.SendData(following)
+        self.WaitStatus()
+        after = next(chunks, None)
+        self.SendControl(self._BlockCommand(after is None and pullup),
+                         len(following))
+        data = self.RecvData(len(current))
+      elif pullup:
+        data = self.RecvData(len(current))
+        if wait:
+          self.WaitPullup(pullup)
+      else:
+        self.WaitStatus()
+        data = self.RecvData(len(current))
+      yield current, data
+      current, following = following, after
+
+  def _BlockCommand(self, pullup):
+    if pullup:
+      return COMM_BLOCK_IO | COMM_IM | COMM_SPU
+    return COMM_BLOCK_IO | COMM_IM
+
+  def Select(self, rom):
+    """Reset the bus and select a device with one COMM_MATCH_ACCESS command.
+
+    Selecting at overdrive speed is left to GenericOneWireMaster.Select.
+    """
+    if self._use_overdrive:
+      return GenericOneWireMaster.GenericOneWireMaster.Select(self, rom)
+    self.SetSpeed(GenericOneWireMaster.SPEED_REGULAR)
+    self.SendData(struct.pack('<Q', rom))
+    self.SendControl(COMM_MATCH_ACCESS | COMM_IM | COMM_RST | COMM_F,
+                     GenericOneWireMaster.ROM_MATCH)
+    regs = []
+    self.WaitStatus(regs)
+    return PresenceDetected(regs)
+
+  def ReadPages(self, rom, page, count,
+                page_size=GenericOneWireMaster.EEPROM_PAGE_SIZE):
+    """Read whole pages with COMM_READ_CRC_PROT_PAGE.
+
+    The adapter resets the bus, selects the device, sends Extended Read
+    Memory and checks the CRC16 of each page itself, so that only the page
+    data comes back; a 512 byte device takes a dozen USB transfers instead
+    of one per byte. The pages are drained from EP_DATA_IN while the command
+    runs.
+
+    At overdrive speed, or for pages larger than the FIFO, the generic
+    version is used.
+    """
+    if self._use_overdrive or page_size > FIFO_SIZE:
+      return GenericOneWireMaster.GenericOneWireMaster.ReadPages(
+          self, rom, page, count, page_size)
+    self.SetSpeed(GenericOneWireMaster.SPEED_REGULAR)
     ret = []
-    count = 0
-    last = False
+    while count > 0:
+      pages = min(count, 0xff)
+      data = self._ReadCrcProtPages(rom, page, pages, page_size)
+      if data is None:
+        return None
+      ret.extend(data)
+      page += pages
+      count -= pages
+    return ret
 
-    # The read data endpoint has a maximum size of 16 bytes. To support reads
-    # of 2 or more ibuttons, we need to pull from it while the search command
-    # is underway.
+  def _ReadCrcProtPages(self, rom, page, count, page_size):
+    """Run one COMM_READ_CRC_PROT_PAGE command.
+
+    The ROM id and start address are sent through EP_DATA_OUT, the page
+    count and size go in the index.
+
+    Returns
+      list of the page bytes, or None if no device answered
+    Raises
+      crc.CrcError if the adapter reports a CRC error
+    """
+    self.SendData(struct.pack('<QH', rom, page * page_size))
+    self.SendControl(COMM_READ_CRC_PROT_PAGE | COMM_IM | COMM_RST | COMM_F,
+                     (page_size << 8) | count)
+    data = []
+    regs = []
+    deadline = time.time() + WAIT_TIMEOUT
+    while True:
+      status, result_regs = self.GetStatus()
+      regs.extend(result_regs)
+      if status.ReadBufferStatus:
+        data.extend(self.RecvData(status.ReadBufferStatus))
+        deadline = time.time() + WAIT_TIMEOUT
+      if status.StatusFlags & ST_IDLE:
+        break
+      if time.time() > deadline:
+        raise RuntimeError, "took too long to read pages"
+      if not status.ReadBufferStatus:
+        time.sleep(0.001)
+    if not PresenceDetected(regs):
+      return None
+    for reg in regs:
+      if reg != RR_DETECT and reg & RR_CRC:
+        raise crc.CrcError, "page of %016x failed its CRC" % rom
+    return data
+
+  def WriteScratchpad(self, rom, address, data):
+    """Write a memory device's scratchpad with COMM_WRITE_SRAM_PAGE.
+
+    Nothing is read back, so the write takes no bulk read.
+    """
+    data = ([GenericOneWireMaster.MEM_WRITE_SCRATCHPAD, address & 0xff,
+             address >> 8] + list(data))
+    if self._use_overdrive or len(data) > FIFO_SIZE:
+      return GenericOneWireMaster.GenericOneWireMaster.WriteScratchpad(
+          self, rom, address, data[3:])
+    if not self.Select(rom):
+      return False
+    self.SendData(data)
+    self.SendControl(COMM_WRITE_SRAM_PAGE | COMM_IM, len(data))
+    self.WaitStatus()
+    return True
+
+  def Search(self, search_type=SEARCH_NORMAL, max=0, family=None,
+             prefix=None, prefix_bits=8, skip_families=(), check_crc=False):
+    """Find devices using the adapter's built-in ROM search.
+
+    The DS2490 walks the ROM tree itself and streams the ids it finds into
+    EP_DATA_IN, which is drained while the search runs. The software search in
+    GenericOneWireMaster is only used if the result registers report an error,
+    or the search stalls.
+
+    A search restricted to a family or prefix, or skipping families, has to
+    stop or branch off part way through the tree, so it is run as a series of
+    single hardware passes instead; see GenericOneWireMaster.Search.
+
+    Args
+      search_type - one of SEARCH_NORMAL, SEARCH_ALARM
+      max - number of ids the adapter returns per search command, after which
+            the search is resumed from the returned discrepancy; 0 for no limit
+      family, prefix, prefix_bits, skip_families, check_crc - see
+            GenericOneWireMaster.Search; with check_crc, a hardware search
+            returning a bad id is repeated pass by pass
+    Returns
+      list of 64 bit integer ids found
+    """
+    if family is not None or prefix is not None or skip_families:
+      return GenericOneWireMaster.GenericOneWireMaster.Search(
+          self, search_type, family, prefix, prefix_bits, skip_families,
+          check_crc)
+    self.SetSpeed(GenericOneWireMaster.SPEED_REGULAR)
     ids = []
-    status = None
+    start = 0L
     while True:
-      while len(ret) >= 8:
-        ids.append(util.IdTupleToLong(ret[:8]))
-        ret = ret[8:]
-      if last:
+      try:
+        found, discrepancy = self._SearchAccess(search_type, max, start)
+      except SearchError, e:
+        self._logger.warning('hardware search failed (%s), falling back to '
+                             'software search' % e)
+        return GenericOneWireMaster.GenericOneWireMaster.Search(
+            self, search_type, check_crc=check_crc)
+      if found and ids and found[0] == ids[-1]:
+        # a resumed search may report the id it was resumed from again
+        found = found[1:]
+      ids.extend(found)
+      if not found or not discrepancy:
         break
-      ret += list(self.RecvData(8))
+      start = GenericOneWireMaster.NextSearchStart(ids[-1], discrepancy)
+      if start is None:
+        break
+    if check_crc and crc.BadRoms(ids):
+      self._logger.warning('hardware search returned bad ids, repeating it '
+                           'pass by pass')
+      return GenericOneWireMaster.GenericOneWireMaster.Search(
+          self, search_type, check_crc=True)
+    return ids
+
+  def SearchPass(self, search_type, target=0L,
+                 speed=GenericOneWireMaster.SPEED_REGULAR):
+    """Single search pass as one COMM_SEARCH_ACCESS command.
+
+    Without COMM_SM the adapter stops after the first id, directed by |target|
+    at every discrepancy, and follows it with the discrepancy bits of the pass.
+
+    See GenericOneWireMaster.SearchPass.
+    """
+    self.SetSpeed(speed)
+    try:
+      ids, discrepancies = self._SearchAccess(search_type, 1, target,
+                                              search_mode=False)
+    except SearchError, e:
+      self._logger.warning('hardware search failed (%s), falling back to '
+                           'software search' % e)
+      return GenericOneWireMaster.GenericOneWireMaster.SearchPass(
+          self, search_type, target, speed)
+    if not ids:
+      return None
+    return ids[0], discrepancies
+
+  def VerifyRoms(self, roms):
+    """Verify devices with single pass searches queued in the adapter.
+
+    See VerifyPaths.
+    """
+    roms = list(roms)
+    return [rom for rom, path in zip(roms, self.VerifyPaths(roms))
+            if path is not None]
+
+  def VerifyPaths(self, roms):
+    """Verify devices with single pass searches queued in the adapter.
+
+    Each pass directed at an id returns the id it ended on and its
+    discrepancy bits, 16 bytes, so a batch of FIFO_SIZE / 16 passes runs
+    with one bulk write, one start and one bulk read.
+
+    Returns
+      see GenericOneWireMaster.VerifyPaths
+    """
+    self.SetSpeed(GenericOneWireMaster.SPEED_REGULAR)
+    roms = list(roms)
+    per_batch = FIFO_SIZE / 16
+    ret = []
+    for i in xrange(0, len(roms), per_batch):
+      batch = roms[i:i+per_batch]
+      self.SendData(struct.pack('<%iQ' % len(batch), *batch))
+      for rom in batch:
+        self.SendControl(COMM_SEARCH_ACCESS | COMM_RST | COMM_RTS,
+                         (1 << 8) | self.SEARCH_NORMAL)
+      self.SendControlCommand(CTL_START_EXE, 0)
+      status = self.WaitStatus()
+      data = ()
+      if status.ReadBufferStatus:
+        data = self.RecvData(status.ReadBufferStatus)
+      if len(data) != 16 * len(batch):
+        # a pass found nothing at all, so the ids are not in step
+        ret.extend(GenericOneWireMaster.GenericOneWireMaster.VerifyPaths(
+            self, batch))
+        continue
+      # each id found is followed by its discrepancy bits
+      found = util.IdsFromBuffer(data)
+      for rom, other, discrepancies in zip(batch, found[::2], found[1::2]):
+        if rom == other:
+          ret.append(discrepancies)
+        else:
+          ret.append(None)
+    return ret
+
+  def _SearchAccess(self, search_type, limit, start, search_mode=True):
+    """Run a single COMM_SEARCH_ACCESS command and collect the ids it returns.
+
+    The data endpoint FIFO is much smaller than the output of a search on a
+    busy bus, so it is drained whenever the status packet reports data
+    waiting, until the adapter goes idle.
+
+    Args
+      search_type - one of SEARCH_NORMAL, SEARCH_ALARM
+      limit - maximum number of ids to return, 0 for no limit
+      start - 64 bit id to start searching from
+      search_mode - if False, run a single pass (no COMM_SM) and always read
+                    its discrepancy bits
+    Returns
+      tuple of (list of ids found, discrepancy value or 0)
+    Raises
+      SearchError if the result registers report a failed search, or if no
+      id arrives for SEARCH_TIMEOUT
+    """
+    self.SendData(struct.pack('<Q', start))
+    val = COMM_SEARCH_ACCESS | COMM_IM | COMM_RST | COMM_F | COMM_RTS
+    if search_mode:
+      val |= COMM_SM
+    self.SendControl(val, (limit << 8) | search_type)
+
+    data = bytearray()
+    deadline = time.time() + SEARCH_TIMEOUT
+    while True:
       status, regs = self.GetStatus()
-      if status.StatusFlags & ST_IDLE:
-        last = True
-      for val in regs:
-        if val == RR_DETECT:
-          self._logger.info('new device detected')
+      for reg in regs:
+        if reg == RR_DETECT:
           continue
-        elif (val & RR_NRS) or (val & RR_EOS):
-          self._logger.warning('NRS error')
-          last = True
-      time.sleep(0.01)
-      count += 1
-      if count >= 100:
-        raise RuntimeError, "took too long to get status"
+        if reg & RR_SEARCH_ERRORS:
+          raise SearchError, "result register 0x%02x" % reg
+      if status.ReadBufferStatus:
+        data.extend(self.RecvData(status.ReadBufferStatus))
+        deadline = time.time() + SEARCH_TIMEOUT
+      if status.StatusFlags & ST_IDLE:
+        break
+      if time.time() > deadline:
+        # the adapter is still busy with the search; reset it so that it
+        # takes commands again
+        self.Reset()
+        raise SearchError, "no id for %.1f s" % SEARCH_TIMEOUT
+      if not status.ReadBufferStatus:
+        time.sleep(0.01)
+
+    ids = util.IdsFromBuffer(data[:len(data) - len(data) % 8])
+    discrepancy = 0L
+    if limit and len(ids) > limit:
+      # with COMM_RTS, the adapter follows the last id with the discrepancy
+      # bits of the search when there were more devices than the limit
+      discrepancy = ids.pop(limit)
+      del ids[limit:]
+    return ids, discrepancy
+
+
+class DS2490Transaction(GenericOneWireMaster.Transaction):
+  """Transaction that runs through the adapter's command buffer.
+
+  Consecutive byte and block operations are merged into a single
+  COMM_BLOCK_IO command, with a preceding reset folded in as COMM_RST. The
+  data for a run of commands is sent in one bulk write, the commands are
+  queued and started with a single CTL_START_EXE, and everything read back is
+  collected with one bulk read. Runs are split to fit the adapter FIFOs and
+  end after any strong pullup.
+
+  A reset, Match ROM and scratchpad read thus takes one bulk write, one
+  control transfer, a status poll and one bulk read.
+  """
+  def _Commands(self):
+    """Turn the queued operations into adapter commands.
+
+    Returns
+      tuple of (list of [value, data, pullup] commands, list of
+      (offset, length, is_byte) for each read into the returned data)
+    """
+    commands = []
+    reads = []
+    offset = 0
+    reset = False
+    block = None
+    for op, arg, pullup in self._ops:
+      if op == GenericOneWireMaster.OP_RESET:
+        if block is not None:
+          commands.append(block)
+          block = None
+        if reset:
+          commands.append([COMM_1_WIRE_RESET, [], 0])
+        reset = True
+        continue
+
+      if op == GenericOneWireMaster.OP_PULSE:
+        if block is not None:
+          commands.append(block)
+          block = None
+        if reset:
+          commands.append([COMM_1_WIRE_RESET, [], 0])
+          reset = False
+        commands.append([COMM_PULSE | COMM_F, [], pullup])
+        continue
+
+      if op == GenericOneWireMaster.OP_WRITE:
+        data = arg
+      else:
+        data = [0xff] * arg
+        reads.append((offset, arg, op == GenericOneWireMaster.OP_READ_BYTE))
+      offset += len(data)
+
+      if block is None:
+        block = [COMM_BLOCK_IO, [], 0]
+        if reset:
+          block[0] |= COMM_RST
+          reset = False
+      block[1].extend(data)
+      if pullup:
+        block[0] |= COMM_SPU
+        block[2] = pullup
+        commands.append(block)
+        block = None
+
+    if block is not None:
+      commands.append(block)
+    if reset:
+      commands.append([COMM_1_WIRE_RESET, [], 0])
+    return commands, reads
+
+  def _Batches(self, commands):
+    """Group commands into runs that fit the FIFOs, splitting large blocks.
+
+    Yields
+      lists of [value, data, pullup] commands
+    """
+    batch = []
+    size = 0
+    for value, data, pullup in commands:
+      while len(data) > FIFO_SIZE - size:
+        # split the block: the reset stays with the first piece and the
+        # pullup with the last
+        room = FIFO_SIZE - size
+        if room:
+          batch.append([value & ~COMM_SPU, data[:room], 0])
+          value &= ~COMM_RST
+          data = data[room:]
+        yield batch
+        batch = []
+        size = 0
+      batch.append([value, data, pullup])
+      size += len(data)
+      if pullup:
+        yield batch
+        batch = []
+        size = 0
+    if batch:
+      yield batch
+
+  def _RunBatch(self, batch):
+    master = self._master
+    pullup = batch[-1][2]
+    if pullup:
+      master._ArmPullup(pullup)
+
+    out = []
+    for value, data, unused in batch:
+      out.extend(data)
+    if out:
+      master.SendData(out)
+
+    if len(batch) == 1:
+      value, data, unused = batch[0]
+      master.SendControl(value | COMM_IM, len(data))
+    else:
+      for value, data, unused in batch:
+        master.SendControl(value, len(data))
+      master.SendControlCommand(CTL_START_EXE, 0)
+
+    regs = []
+    if pullup:
+      time.sleep(pullup / 1000.0)
+    master.WaitStatus(regs)
+    for reg in regs:
+      if reg != RR_DETECT and reg & RR_SH:
+        master._logger.warning('short detected during transaction')
+
+    ret = []
+    while len(ret) < len(out):
+      ret.extend(master.RecvData(len(out) - len(ret)))
+    return ret
+
+  def Execute(self):
+    master = self._master
+    master.SetSpeed(GenericOneWireMaster.SPEED_REGULAR)
+    start = master.GetTransactionCount()
+    commands, reads = self._Commands()
+    data = []
+    for batch in self._Batches(commands):
+      data.extend(self._RunBatch(batch))
+    self._transfers = master.GetTransactionCount() - start
+
+    results = []
+    for offset, length, is_byte in reads:
+      if is_byte:
+        results.append(data[offset])
+      else:
+        results.append(data[offset:offset+length])
+    return results
+
+
+def PresenceDetected(regs):
+  """Check the result registers of a reset for a presence pulse.
+
+  Args
+    regs - result registers returned after a reset sent with COMM_NTF
+  Returns
+    False if the adapter reported no presence pulse or a short
+  """
+  for reg in regs:
+    if reg == RR_DETECT:
+      continue
+    if reg & (RR_NRS | RR_SH):
+      return False
+  return True
+
+
+def PullupDurationIndex(duration):
+  """Convert a strong pullup duration to a COMM_SET_DURATION index.
+
+  The adapter counts the duration in units of 16 ms; 0 would mean infinite.
 
-    return ibs
+  Args
+    duration - length of the pullup, in ms
+  Returns
+    index value for COMM_SET_DURATION
+  """
+  return min(1 + (int(duration) >> 4), 0xff)
 
 
 def mkserial(num):
-  return ' '.join(['%02x' % ((num >> (8*i)) & 0xff) for i in range(8)])
+  return util.FormatId(num, util.FORMAT_BYTES)
+
+
+def _BenchmarkStartup(runs=10):
+  """Time importing this module and creating a master, in fresh processes."""
+  import subprocess
+  import sys
+  code = ('import logging, sys, time\n'
+          'start = time.time()\n'
+          'from pyonewire.master import ds2490\n'
+          'imported = time.time()\n'
+          'ds2490.DS2490Master()\n'
+          'created = time.time()\n'
+          'print imported - start, created - imported, "usb" in sys.modules, '
+          'len(logging.getLogger().handlers)\n')
+  results = []
+  for i in xrange(runs):
+    out = subprocess.Popen([sys.executable, '-c', code],
+                           stdout=subprocess.PIPE).communicate()[0].split()
+    results.append((float(out[0]), float(out[1]), out[2], int(out[3])))
+  imports = sorted(r[0] for r in results)
+  creates = sorted(r[1] for r in results)
+  print 'import: median %.2f ms  min %.2f ms' % (imports[runs / 2] * 1000,
+                                                  imports[0] * 1000)
+  print 'DS2490Master(): median %.3f ms' % (creates[runs / 2] * 1000)
+  print 'usb imported: %s  root logging handlers: %i' % results[0][2:]
 
 
 if __name__ == '__main__':
+  import sys
+  if sys.argv[1:] == ['--benchmark-startup']:
+    _BenchmarkStartup()
+    sys.exit(0)
+  logging.basicConfig(level=logging.DEBUG)
   dev = DS2490Master()
   while True:
     printed = False
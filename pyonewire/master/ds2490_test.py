@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+Tests of DS2490Master against the ds2490sim emulator
+
+  Copyright 2008 mike wakerly <opensource@hoho.com>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+"""
+
+import logging
+import unittest
+
+from pyonewire.master import ds2490
+from pyonewire.master import ds2490sim
+from pyonewire.master import SimulatedOneWireMaster
+
+
+class TouchBitsTest(unittest.TestCase):
+  def _TouchBits(self, count):
+    # an empty bus reads back every bit written
+    bus = SimulatedOneWireMaster.SimulatedBus()
+    master = ds2490.DS2490Master(handle=ds2490sim.FakeDS2490Handle(bus))
+    bits = [(i * 7 >> 2) & 1 for i in xrange(count)]
+    self.assertEqual(master.TouchBits(bits), bits)
+
+  def testFifoBoundary(self):
+    # whole bytes and tail bits each take a byte of the FIFO to read back
+    fifo_bits = 8 * ds2490.FIFO_SIZE
+    for count in (fifo_bits - 9, fifo_bits - 1, fifo_bits, fifo_bits + 1,
+                  fifo_bits + 7, fifo_bits + 8):
+      self._TouchBits(count)
+
+  def testLong(self):
+    self._TouchBits(8 * 300 + 5)
+
+  def testEmpty(self):
+    self._TouchBits(0)
+
+
+class TripletTest(unittest.TestCase):
+  def testTripletSearch(self):
+    bus = SimulatedOneWireMaster.SimulatedBus(
+        SimulatedOneWireMaster.MakeSensorBus(20, seed=3))
+    handle = ds2490sim.FakeDS2490Handle(bus)
+    master = ds2490.DS2490Master(handle=handle)
+    found = SimulatedOneWireMaster.TripletSearch(master)
+    self.assertEqual(sorted(found), sorted(d.rom for d in bus.devices))
+    # a held direction write goes out ahead of the next command
+    self.assertTrue(master.VerifyRom(bus.devices[0].rom))
+
+
+if __name__ == '__main__':
+  logging.getLogger('ds2490').setLevel(logging.WARNING)
+  unittest.main()
@@ -0,0 +1,398 @@
+#!/usr/bin/env python
+"""
+DS2490 emulation for the pyonewire package
+
+  Copyright 2008 mike wakerly <opensource@hoho.com>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+
+FakeDS2490Handle stands in for an opened libusb handle of a DS2490, with a
+SimulatedBus behind it, so DS2490Master runs unchanged without an adapter:
+
+  bus = SimulatedOneWireMaster.SimulatedBus(devices)
+  master = ds2490.DS2490Master(handle=ds2490sim.FakeDS2490Handle(bus))
+"""
+
+import collections
+import struct
+
+from pyonewire.core import crc
+from pyonewire.master import ds2490
+from pyonewire.master import GenericOneWireMaster
+from pyonewire.master import SimulatedOneWireMaster
+
+# COMM command codes, without the flag bits
+CMD_SET_DURATION = 0x10
+CMD_BIT_IO = 0x20
+CMD_PULSE = 0x30
+CMD_1_WIRE_RESET = 0x40
+CMD_BYTE_IO = 0x50
+CMD_MATCH_ACCESS = 0x60
+CMD_BLOCK_IO = 0x70
+CMD_WRITE_SRAM_PAGE = 0xb0
+CMD_READ_CRC_PROT_PAGE = 0xd0
+CMD_SEARCH_ACCESS = 0xf0
+
+
+class FakeUsbError(IOError):
+  """Raised where libusb would report a timeout"""
+
+
+class FakeDS2490Handle(object):
+  """Emulates the control, status and data endpoints of a DS2490.
+
+  COMM commands are executed against the bus when they are started, either
+  immediately (COMM_IM) or by CTL_START_EXE. A ROM search produces one id
+  per status poll. Commands stall while the data in FIFO is full, like the
+  real adapter, so callers have to drain EP_DATA_IN as they run. Every
+  transfer is counted in |transfers|.
+  """
+  def __init__(self, bus):
+    self.bus = bus
+    self.transfers = 0
+    self._PowerOnReset()
+
+  def _PowerOnReset(self):
+    self.bus.SetSpeed(GenericOneWireMaster.SPEED_REGULAR)
+    self._commands = collections.deque()
+    self._running = None
+    self._started = False
+    self._data_in = collections.deque()
+    self._data_out = collections.deque()
+    self._regs = []
+    self._last_command = 0
+    self._pulse_enable = 0
+    self._speed = ds2490.ONEWIREBUSSPEED_REGULAR
+    self._spu_duration = 0
+
+  # libusb handle interface
+
+  def reset(self):
+    pass
+
+  def setConfiguration(self, conf):
+    pass
+
+  def claimInterface(self, intf):
+    pass
+
+  def releaseInterface(self):
+    pass
+
+  def setAltInterface(self, alt):
+    pass
+
+  def controlMsg(self, requestType, request, buffer, value=0, index=0,
+                 timeout=100):
+    self.transfers += 1
+    if request == ds2490.CONTROL_CMD:
+      self._ControlCommand(value)
+    elif request == ds2490.COMM_CMD:
+      self._commands.append((value, index))
+      if value & ds2490.COMM_IM:
+        self._Run()
+    elif request == ds2490.MODE_CMD:
+      if value == ds2490.MOD_PULSE_EN:
+        self._pulse_enable = index
+      elif value == ds2490.MOD_1WIRE_SPEED:
+        self._SetSpeed(index)
+    return 0
+
+  def interruptRead(self, endpoint, size, timeout=100):
+    self.transfers += 1
+    if endpoint != ds2490.EP_STATUS:
+      raise FakeUsbError, "no interrupt endpoint %i" % endpoint
+    # let a long running command make progress between polls
+    self._Run()
+    status = [self._pulse_enable, self._speed, self._spu_duration,
+              0, 0, 0, 0, 0,
+              self._StatusFlags(),
+              self._last_command & 0xff, self._last_command >> 8,
+              len(self._commands), len(self._data_out),
+              min(len(self._data_in), ds2490.FIFO_SIZE), 0, 0]
+    regs = self._regs
+    self._regs = []
+    return tuple(status + regs)[:size]
+
+  def bulkRead(self, endpoint, size, timeout=100):
+    if endpoint == ds2490.EP_STATUS:
+      return self.interruptRead(endpoint, size, timeout)
+    self.transfers += 1
+    if endpoint != ds2490.EP_DATA_IN:
+      raise FakeUsbError, "no bulk in endpoint %i" % endpoint
+    self._Run()
+    if not self._data_in:
+      raise FakeUsbError, "timeout"
+    size = min(size, len(self._data_in))
+    return tuple([self._data_in.popleft() for i in xrange(size)])
+
+  def bulkWrite(self, endpoint, buf, timeout=100):
+    self.transfers += 1
+    if endpoint != ds2490.EP_DATA_OUT:
+      raise FakeUsbError, "no bulk out endpoint %i" % endpoint
+    if isinstance(buf, str):
+      buf = [ord(c) for c in buf]
+    if len(self._data_out) + len(buf) > ds2490.FIFO_SIZE:
+      # the real adapter would NAK until the bulk write times out
+      raise FakeUsbError, "data out FIFO overflow"
+    self._data_out.extend(buf)
+    return len(buf)
+
+  # adapter emulation
+
+  def _StatusFlags(self):
+    if self._running is None and not self._commands:
+      return ds2490.ST_IDLE
+    return 0
+
+  def _ControlCommand(self, value):
+    if value == ds2490.CTL_RESET_DEVICE:
+      self._PowerOnReset()
+    elif value in (ds2490.CTL_START_EXE, ds2490.CTL_RESUME_EXE):
+      self._Run(start=True)
+    elif value == ds2490.CTL_FLUSH_COMM_CMDS:
+      self._commands.clear()
+    elif value == ds2490.CTL_FLUSH_RCV_BUFFER:
+      self._data_in.clear()
+    elif value == ds2490.CTL_FLUSH_XMT_BUFFER:
+      self._data_out.clear()
+
+  def _Run(self, start=False):
+    """Execute commands until one needs to wait for the host."""
+    if start:
+      self._started = True
+    while True:
+      if self._running is not None:
+        try:
+          self._running.next()
+          return
+        except StopIteration:
+          self._running = None
+      if not self._commands:
+        self._started = False
+        return
+      value, index = self._commands[0]
+      if not (self._started or value & ds2490.COMM_IM):
+        # queued commands wait for CTL_START_EXE
+        return
+      self._commands.popleft()
+      self._last_command = value
+      self._running = self._Execute(value, index)
+
+  def _Execute(self, value, index):
+    """Generator running one COMM command; it yields to wait for the host."""
+    code = value & 0xf0
+    bus = self.bus
+    if code == CMD_SET_DURATION:
+      if not value & ds2490.COMM_TYPE:
+        self._spu_duration = index
+    elif code == CMD_1_WIRE_RESET:
+      if value & ds2490.COMM_SE:
+        self._SetSpeed(index)
+      if not bus.Reset():
+        self._regs.append(ds2490.RR_NRS)
+      elif value & ds2490.COMM_NTF:
+        self._regs.append(0)
+    elif code == CMD_BIT_IO:
+      for unused in self._WaitForRoom(value):
+        yield
+      bit = bus.TouchBit(value & ds2490.COMM_D and 1 or 0)
+      self._Output(value, [bit])
+    elif code == CMD_BYTE_IO:
+      for unused in self._WaitForRoom(value):
+        yield
+      self._Output(value, [bus.TouchByte(index & 0xff)])
+      self._Pullup(value)
+    elif code == CMD_BLOCK_IO:
+      if value & ds2490.COMM_RST and not self._Reset(value):
+        return
+      data = [self._data_out.popleft() for i in xrange(index)]
+      for byte in data:
+        for unused in self._WaitForRoom(value):
+          yield
+        self._Output(value, [bus.TouchByte(byte)])
+      self._Pullup(value)
+    elif code == CMD_PULSE:
+      self._Pullup(value | ds2490.COMM_SPU)
+    elif code == CMD_MATCH_ACCESS:
+      if value & ds2490.COMM_RST and not self._Reset(value):
+        return
+      bus.TouchByte(index & 0xff)
+      for i in xrange(8):
+        bus.TouchByte(self._data_out.popleft())
+    elif code == CMD_WRITE_SRAM_PAGE:
+      for i in xrange(index & 0xff):
+        bus.TouchByte(self._data_out.popleft())
+    elif code == CMD_READ_CRC_PROT_PAGE:
+      for unused in self._ReadCrcProtPages(value, index):
+        yield
+    elif code == CMD_SEARCH_ACCESS:
+      for unused in self._Search(value, index):
+        yield
+
+  def _SetSpeed(self, speed):
+    self._speed = speed
+    if speed == ds2490.ONEWIREBUSSPEED_OVERDRIVE:
+      self.bus.SetSpeed(GenericOneWireMaster.SPEED_OVERDRIVE)
+    else:
+      self.bus.SetSpeed(GenericOneWireMaster.SPEED_REGULAR)
+
+  def _Reset(self, value):
+    if self.bus.Reset():
+      return True
+    self._regs.append(ds2490.RR_NRS)
+    if value & ds2490.COMM_F:
+      self._commands.clear()
+      self._data_out.clear()
+    return False
+
+  def _WaitForRoom(self, value):
+    """Yields while the data in FIFO has no room for a byte read back."""
+    while (not value & ds2490.COMM_ICP and
+           len(self._data_in) >= ds2490.FIFO_SIZE):
+      yield
+
+  def _Output(self, value, data):
+    if not value & ds2490.COMM_ICP:
+      self._data_in.extend(data)
+
+  def _Pullup(self, value):
+    if value & ds2490.COMM_SPU and self._pulse_enable & ds2490.ENABLEPULSE_SPUE:
+      # pullups take no time here, only simulated bus time
+      self.bus.Pullup(self._spu_duration * 16)
+
+  def _ReadCrcProtPages(self, value, index):
+    """Page read following the COMM_READ_CRC_PROT_PAGE conventions.
+
+    The 8 byte ROM id and 2 byte start address are consumed from the data out
+    FIFO, the index holds the page size in its high byte and the page count
+    in its low byte. The device is selected with Match ROM and read with
+    Extended Read Memory; each page goes to the data in FIFO once its CRC16
+    checked, and a page failing it ends the command with RR_CRC.
+    """
+    bus = self.bus
+    header = [self._data_out.popleft() for i in xrange(10)]
+    if value & ds2490.COMM_RST and not self._Reset(value):
+      return
+    for byte in [GenericOneWireMaster.ROM_MATCH] + header[:8]:
+      bus.TouchByte(byte)
+    command = [GenericOneWireMaster.MEM_EXTENDED_READ] + header[8:]
+    for byte in command:
+      bus.TouchByte(byte)
+    seed = crc.Crc16(command)
+    page_size = index >> 8
+    for i in xrange(index & 0xff):
+      data = [bus.TouchByte(0xff) for j in xrange(page_size + 2)]
+      if not crc.CheckCrc16(data, seed):
+        self._regs.append(ds2490.RR_CRC)
+        return
+      seed = 0
+      while len(self._data_in) > ds2490.FIFO_SIZE - page_size:
+        yield
+      self._data_in.extend(data[:page_size])
+      yield
+
+  def _Search(self, value, index):
+    """ROM search following the DS2490 COMM_SEARCH_ACCESS conventions.
+
+    The 8 byte start id is consumed from the data out FIFO. Its bits give the
+    direction to take at every discrepancy of the first pass; later passes
+    follow the usual search order. With COMM_RTS, and more devices than the
+    limit, the discrepancy bits of the last pass follow the returned ids.
+    Without COMM_SM only one pass is made, and with COMM_RTS its discrepancy
+    bits always follow the id.
+    """
+    bus = self.bus
+    search_type = index & 0xff
+    limit = index >> 8
+    start = struct.unpack('<Q', struct.pack('8B', *[self._data_out.popleft()
+                                                     for i in xrange(8)]))[0]
+    if not value & ds2490.COMM_SM:
+      limit = 1
+    last_rn = start
+    desc_bit = 64
+    found = 0
+    while True:
+      if not bus.Reset():
+        self._regs.append(ds2490.RR_NRS)
+        return
+      bus.TouchByte(search_type)
+      rn = 0L
+      discrepancies = 0L
+      last_zero = -1
+      for i in xrange(64):
+        if i == desc_bit:
+          bdir = 1
+        elif i > desc_bit:
+          bdir = 0
+        else:
+          bdir = (last_rn >> i) & 1
+        ret = bus.Triplet(bdir)
+        if ret == 0x03:
+          self._regs.append(ds2490.RR_NRS)
+          return
+        if not ret & 0x03:
+          discrepancies |= 1L << i
+          if not ret & 0x04:
+            last_zero = i
+        rn |= long(ret >> 2) << i
+      while len(self._data_in) > ds2490.FIFO_SIZE - 8:
+        yield
+      self._data_in.extend(struct.unpack('8B', struct.pack('<Q', rn)))
+      found += 1
+      yield
+      single = not value & ds2490.COMM_SM
+      if last_zero < 0 and not single:
+        return
+      if limit and found >= limit:
+        if value & ds2490.COMM_RTS:
+          while len(self._data_in) > ds2490.FIFO_SIZE - 8:
+            yield
+          self._data_in.extend(struct.unpack('8B', struct.pack('<Q',
+                                                               discrepancies)))
+        return
+      last_rn = rn
+      desc_bit = last_zero
+
+
+def _Benchmark(count):
+  import time
+  bus = SimulatedOneWireMaster.SimulatedBus(
+      SimulatedOneWireMaster.MakeSensorBus(count))
+  handle = FakeDS2490Handle(bus)
+  master = ds2490.DS2490Master(handle=handle)
+  tests = [('hardware search', lambda: master.Search())]
+  if count <= 100:
+    # one SEARCH_ACCESS command per device
+    tests.append(('pass search',
+                  lambda: GenericOneWireMaster.GenericOneWireMaster.Search(
+                      master, master.SEARCH_NORMAL)))
+    tests.append(('triplet search',
+                  lambda: SimulatedOneWireMaster.TripletSearch(master)))
+  for name, fn in tests:
+    handle.transfers = 0
+    start = time.time()
+    ids = fn()
+    assert len(ids) == count
+    print '  %-18s wall %8.3fs  usb transfers %7i' % (
+        name, time.time() - start, handle.transfers)
+
+
+if __name__ == '__main__':
+  import logging
+  logging.getLogger('ds2490').setLevel(logging.WARNING)
+  for count in (10, 100, 1000):
+    print '%i devices' % count
+    _Benchmark(count)
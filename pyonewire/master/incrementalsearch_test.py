@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""
+Tests of GenericOneWireMaster.IncrementalSearch
+
+  Copyright 2008 mike wakerly <opensource@hoho.com>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+"""
+
+import logging
+import unittest
+
+from pyonewire.master import ds2480b
+from pyonewire.master import ds2480bsim
+from pyonewire.master import ds2490
+from pyonewire.master import ds2490sim
+from pyonewire.master import GenericOneWireMaster
+from pyonewire.master import SimulatedOneWireMaster
+
+ADDED = GenericOneWireMaster.DEVICE_ADDED
+REMOVED = GenericOneWireMaster.DEVICE_REMOVED
+
+
+class IncrementalSearchTest(unittest.TestCase):
+  def setUp(self):
+    self.devices = SimulatedOneWireMaster.MakeSensorBus(52, seed=7)
+    self.bus = SimulatedOneWireMaster.SimulatedBus(self.devices[:50])
+
+  def _Masters(self):
+    yield SimulatedOneWireMaster.SimulatedOneWireMaster(bus=self.bus)
+    yield ds2490.DS2490Master(handle=ds2490sim.FakeDS2490Handle(self.bus))
+    yield ds2480b.DS2480BMaster(port=ds2480bsim.FakeSerialPort(self.bus))
+
+  def _CountPasses(self, master):
+    # count the search passes run through |master|
+    passes = []
+    search_pass = master.SearchPass
+    def SearchPass(*args, **kwargs):
+      passes.append(args)
+      return search_pass(*args, **kwargs)
+    master.SearchPass = SearchPass
+    return passes
+
+  def _Start(self, master):
+    search = GenericOneWireMaster.IncrementalSearch(master)
+    events = search.Update()
+    self.assertEqual(events, [(ADDED, device.rom)
+                              for device in sorted(self.devices[:50],
+                                                   key=lambda d: d.rom)])
+    return search
+
+  def _BusRoms(self):
+    return sorted(device.rom for device in self.bus.devices)
+
+  def testStable(self):
+    for master in self._Masters():
+      search = self._Start(master)
+      passes = self._CountPasses(master)
+      self.assertEqual(search.Update(), [])
+      self.assertEqual(passes, [])
+      self.assertEqual(search.GetDevices(), self._BusRoms())
+
+  def testChanges(self):
+    for master in self._Masters():
+      self.bus.devices = list(self.devices[:50])
+      self.bus._by_rom = None
+      search = self._Start(master)
+      passes = self._CountPasses(master)
+      self.bus.RemoveDevice(self.devices[3])
+      self.bus.AddDevice(self.devices[50])
+      self.assertEqual(search.Update(), [(REMOVED, self.devices[3].rom),
+                                         (ADDED, self.devices[50].rom)])
+      self.assertEqual(search.GetDevices(), self._BusRoms())
+      # only the subtree of the new device is searched
+      self.assertTrue(0 < len(passes) <= 2, passes)
+
+  def testReplaceAll(self):
+    master = SimulatedOneWireMaster.SimulatedOneWireMaster(bus=self.bus)
+    search = self._Start(master)
+    old = list(self.bus.devices)
+    for device in old:
+      self.bus.RemoveDevice(device)
+    self.assertEqual(search.Update(),
+                     [(REMOVED, rom) for rom in sorted(d.rom for d in old)])
+    self.assertEqual(search.GetDevices(), [])
+    for device in self.devices[50:]:
+      self.bus.AddDevice(device)
+    self.assertEqual(search.Update(), [(ADDED, rom) for rom in
+                                       self._BusRoms()])
+
+
+if __name__ == '__main__':
+  logging.getLogger('ds2490').setLevel(logging.WARNING)
+  unittest.main()
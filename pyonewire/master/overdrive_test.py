@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+Tests of overdrive on a bus mixing overdrive and regular speed devices
+
+  Copyright 2008 mike wakerly <opensource@hoho.com>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+
+Every master is run against the same simulated bus: a DS2433, which
+supports overdrive, and two DS18B20s, which do not. After the DS2433 was
+selected at overdrive speed, everything addressing the whole bus has to go
+back to regular speed, or the DS18B20s never see it.
+"""
+
+import logging
+import unittest
+
+from pyonewire.device import ds18x20
+from pyonewire.master import ds2480b
+from pyonewire.master import ds2480bsim
+from pyonewire.master import ds2490
+from pyonewire.master import ds2490sim
+from pyonewire.master import GenericOneWireMaster
+from pyonewire.master import SimulatedOneWireMaster
+
+
+class OverdriveMixTest(unittest.TestCase):
+  def setUp(self):
+    self.eeprom = SimulatedOneWireMaster.VirtualDS2433(1)
+    self.sensors = [SimulatedOneWireMaster.VirtualDS18B20(2, 21.5),
+                    SimulatedOneWireMaster.VirtualDS18B20(3, 22.0)]
+    self.bus = SimulatedOneWireMaster.SimulatedBus([self.eeprom] +
+                                                   self.sensors)
+    self.eeprom.memory[:4] = [1, 2, 3, 4]
+    self.roms = sorted(device.rom for device in self.bus.devices)
+
+  def _Masters(self):
+    yield SimulatedOneWireMaster.SimulatedOneWireMaster(bus=self.bus)
+    yield ds2490.DS2490Master(handle=ds2490sim.FakeDS2490Handle(self.bus))
+    yield ds2480b.DS2480BMaster(port=ds2480bsim.FakeSerialPort(self.bus))
+
+  def _SelectInOverdrive(self, master):
+    master.EnableOverdrive()
+    self.assertEqual(master.ReadMemory(self.eeprom.rom, 0, 4), [1, 2, 3, 4])
+    self.assertTrue(master.GetOverdriveCapability(self.eeprom.rom))
+    self.assertEqual(master.GetSpeed(), GenericOneWireMaster.SPEED_OVERDRIVE)
+
+  def testSearch(self):
+    for master in self._Masters():
+      self._SelectInOverdrive(master)
+      self.assertEqual(sorted(master.Search(master.SEARCH_NORMAL)), self.roms)
+      self.assertEqual(master.GetSpeed(), GenericOneWireMaster.SPEED_REGULAR)
+
+  def testFamilySearch(self):
+    for master in self._Masters():
+      self._SelectInOverdrive(master)
+      found = master.Search(master.SEARCH_NORMAL, family=0x28)
+      self.assertEqual(sorted(found),
+                       sorted(sensor.rom for sensor in self.sensors))
+
+  def testVerify(self):
+    for master in self._Masters():
+      self._SelectInOverdrive(master)
+      self.assertEqual(sorted(master.VerifyRoms(self.roms)), self.roms)
+      self._SelectInOverdrive(master)
+      self.assertTrue(master.VerifyRom(self.sensors[0].rom))
+
+  def testConvert(self):
+    for master in self._Masters():
+      self._SelectInOverdrive(master)
+      group = ds18x20.DS18x20(master, [sensor.rom for sensor in self.sensors])
+      readings = group.Read()
+      self.assertEqual(readings[self.sensors[0].rom], 21.5)
+      self.assertEqual(readings[self.sensors[1].rom], 22.0)
+
+  def testOverdriveAgain(self):
+    for master in self._Masters():
+      self._SelectInOverdrive(master)
+      master.Search(master.SEARCH_NORMAL)
+      self._SelectInOverdrive(master)
+
+
+if __name__ == '__main__':
+  logging.getLogger('ds2490').setLevel(logging.WARNING)
+  unittest.main()
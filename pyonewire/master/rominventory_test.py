@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""
+Tests of RomInventory against SimulatedOneWireMaster
+
+  Copyright 2008 mike wakerly <opensource@hoho.com>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from pyonewire.core import inventory
+from pyonewire.master import RomInventory
+from pyonewire.master import SimulatedOneWireMaster
+
+
+class RomInventoryTest(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.dir, 'onewire.inv')
+    self.devices = SimulatedOneWireMaster.MakeSensorBus(12, seed=2)
+    self.bus = SimulatedOneWireMaster.SimulatedBus(self.devices[:10])
+    self.master = SimulatedOneWireMaster.SimulatedOneWireMaster(bus=self.bus)
+    self.now = 100.0
+    # the file lists the first 10 devices and one that is not on the bus
+    self.cached = [device.rom for device in self.devices[:10]]
+    self.gone = self.devices[11].rom
+    inventory.Save(self.path, {
+      'bus0': inventory.Inventory(50.0, dict.fromkeys(self.cached +
+                                                      [self.gone], 50.0)),
+      'other': inventory.Inventory(20.0, {1L: 20.0}),
+    })
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def _Inventory(self):
+    return RomInventory.RomInventory(self.master, self.path, 'bus0',
+                                     clock=lambda: self.now)
+
+  def testLoadVerifyRefresh(self):
+    roms = self._Inventory()
+    self.assertEqual(roms.Load(), sorted(self.cached + [self.gone]))
+    self.assertEqual(roms.GetSearchTime(), 50.0)
+
+    self.assertEqual(sorted(roms.Verify()), sorted(self.cached))
+    self.assertEqual(roms.GetRoms(), sorted(self.cached))
+    self.assertEqual(roms.GetSearchTime(), 50.0)
+
+    self.bus.RemoveDevice(self.devices[0])
+    self.bus.AddDevice(self.devices[10])
+    self.now = 200.0
+    expected = sorted(device.rom for device in self.bus.devices)
+    self.assertEqual(roms.Refresh(), expected)
+    self.assertEqual(roms.GetSearchTime(), 200.0)
+
+    # the file now holds the search, and the other adapter is kept
+    saved = inventory.Load(self.path)
+    self.assertEqual(saved['bus0'].GetRoms(), expected)
+    self.assertEqual(saved['bus0'].searched, 200.0)
+    self.assertEqual(saved['other'].GetRoms(), [1L])
+    self.assertEqual(self._Inventory().Load(), expected)
+
+  def testStart(self):
+    roms = self._Inventory()
+    self.bus.AddDevice(self.devices[10])
+    self.assertEqual(roms.Start(), sorted(self.cached))
+    self.assertTrue(roms.Wait(10))
+    self.assertEqual(roms.GetRoms(),
+                     sorted(device.rom for device in self.bus.devices))
+
+  def testNoFile(self):
+    os.remove(self.path)
+    roms = self._Inventory()
+    self.assertEqual(roms.Start(refresh=False), [])
+    self.assertEqual(len(roms.Refresh()), 10)
+    self.assertTrue(os.path.exists(self.path))
+
+
+if __name__ == '__main__':
+  unittest.main()
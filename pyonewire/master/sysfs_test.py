@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+"""
+Tests of SysfsOneWireMaster against a copy of the w1 sysfs tree
+
+  Copyright 2008 mike wakerly <opensource@hoho.com>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from pyonewire.core import crc
+from pyonewire.core import util
+from pyonewire.device import ds18x20
+from pyonewire.master import GenericOneWireMaster
+from pyonewire.master import SysfsOneWireMaster
+
+MASTER = 'w1_bus_master2'
+
+
+def _WriteFile(path, data):
+  f = open(path, 'w')
+  try:
+    f.write(data)
+  finally:
+    f.close()
+
+
+def _ReadFile(path):
+  f = open(path)
+  try:
+    return f.read()
+  finally:
+    f.close()
+
+
+class SysfsTest(unittest.TestCase):
+  def setUp(self):
+    # the tree as left by the kernel's last search: three DS18B20s bound to
+    # w1_therm, and a DS2433 with an rw file
+    self.root = tempfile.mkdtemp()
+    for name in (MASTER, 'w1_bus_master10', 'other'):
+      os.mkdir(os.path.join(self.root, name))
+    self.sensors = [util.MakeId(0x28, 0x1234 + i) for i in xrange(3)]
+    self.eeprom = util.MakeId(0x23, 0x77)
+    self.roms = sorted(self.sensors + [self.eeprom])
+    self.temperatures = {}
+    for i, rom in enumerate(self.sensors):
+      raw = 400 + 16 * i
+      scratchpad = [raw & 0xff, raw >> 8, 0x4b, 0x46, 0x7f, 0xff, 0x01, 0x10]
+      scratchpad.append(crc.Crc8(scratchpad))
+      text = ' '.join('%02x' % byte for byte in scratchpad)
+      self._Write(rom, 'w1_slave', '%s : crc=%02x YES\n%s t=%d\n' % (
+          text, scratchpad[-1], text, raw * 62.5))
+      self.temperatures[rom] = raw / 16.0
+    self._Write(self.eeprom, 'rw', '')
+    self._WriteMaster('w1_master_slaves', ''.join(
+        util.FormatId(rom, util.FORMAT_W1) + '\n' for rom in self.roms))
+    self._WriteMaster('w1_master_search', '-1\n')
+    self._WriteMaster('therm_bulk_read', '0\n')
+    self.master = SysfsOneWireMaster.SysfsOneWireMaster(root=self.root,
+                                                         rescan=False)
+
+  def tearDown(self):
+    shutil.rmtree(self.root)
+
+  def _DeviceDir(self, rom):
+    path = os.path.join(self.root, util.FormatId(rom, util.FORMAT_W1))
+    if not os.path.isdir(path):
+      os.mkdir(path)
+    return path
+
+  def _Write(self, rom, attribute, data):
+    _WriteFile(os.path.join(self._DeviceDir(rom), attribute), data)
+
+  def _Read(self, rom, attribute):
+    return _ReadFile(os.path.join(self._DeviceDir(rom), attribute))
+
+  def _WriteMaster(self, attribute, data):
+    _WriteFile(os.path.join(self.root, MASTER, attribute), data)
+
+  def _ReadMaster(self, attribute):
+    return _ReadFile(os.path.join(self.root, MASTER, attribute))
+
+  def testFindMasters(self):
+    self.assertEqual(SysfsOneWireMaster.FindMasters(self.root),
+                     [MASTER, 'w1_bus_master10'])
+    self.assertEqual(self.master.GetName(), MASTER)
+    self.assertEqual(SysfsOneWireMaster.FindMasters(
+        os.path.join(self.root, 'missing')), [])
+    empty = SysfsOneWireMaster.SysfsOneWireMaster(
+        root=os.path.join(self.root, 'other'))
+    self.assertRaises(SysfsOneWireMaster.SysfsError, empty.GetSlaves)
+
+  def testSearch(self):
+    search = self.master.Search
+    self.assertEqual(search(), self.roms)
+    self.assertEqual(search(family=0x23), [self.eeprom])
+    self.assertEqual(search(skip_families=[0x28]), [self.eeprom])
+    self.assertEqual(list(self.master.IterSearch(family=0x28)),
+                     sorted(self.sensors))
+    # nothing asked the kernel for a search
+    self.assertEqual(self._ReadMaster('w1_master_search'), '-1\n')
+    self._WriteMaster('w1_master_slaves', 'not found.\n')
+    self.assertEqual(search(), [])
+    self.assertFalse(self.master.ResetBus())
+
+  def testVerifyRoms(self):
+    missing = self.sensors[0] ^ (1L << 40)
+    self.assertEqual(self.master.VerifyRoms(self.roms + [missing]),
+                     self.roms)
+    self.assertTrue(self.master.VerifyRom(self.eeprom))
+    self.assertFalse(self.master.VerifyRom(missing))
+
+  def testHeldWrite(self):
+    self.assertTrue(self.master.Select(self.eeprom))
+    self.master.WriteBlock([0x0f, 0x00, 0x00])
+    self.master.WriteByte(0x55)
+    # held until the bus is reset
+    self.assertEqual(self._Read(self.eeprom, 'rw'), '')
+    self.master.ResetBus()
+    self.assertEqual(self._Read(self.eeprom, 'rw'), '\x0f\x00\x00\x55')
+
+  def testWriteThenRead(self):
+    # the write goes out in one piece before the read
+    self.master.ResetBus()
+    self.master.WriteBlock([GenericOneWireMaster.ROM_MATCH] +
+                           list(bytearray(util.IdsToBuffer([self.eeprom]))) +
+                           [0xf0, 0x00])
+    self.master.WriteByte(0x00)
+    self.assertEqual(self.master.ReadBlock(4), [0xf0, 0x00, 0x00, 0xff])
+    self.assertRaises(SysfsOneWireMaster.SysfsError, self.master.WriteByte,
+                      0x00)
+    self.assertFalse(self.master.Select(util.MakeId(0x28, 999)))
+
+  def testUnsupported(self):
+    master = self.master
+    overdrive = GenericOneWireMaster.SPEED_OVERDRIVE
+    for fn, args in ((master.SetSpeed, (overdrive,)),
+                     (master.TouchBit, (1,)),
+                     (master.Triplet, (0,)),
+                     (master.SearchPass, (GenericOneWireMaster.ROM_SEARCH,)),
+                     (master.Search, (master.SEARCH_ALARM,))):
+      self.assertRaises(SysfsOneWireMaster.SysfsError, fn, *args)
+    master.ResetBus()
+    self.assertRaises(SysfsOneWireMaster.SysfsError, master.WriteBlock,
+                      [GenericOneWireMaster.ROM_SEARCH])
+
+  def testTherm(self):
+    readings = ds18x20.DS18x20(self.master, self.sensors).Read()
+    self.assertEqual(readings, self.temperatures)
+    # Skip ROM Convert T became one bulk conversion
+    self.assertEqual(self._ReadMaster('therm_bulk_read'), 'trigger\n')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+"""
+USB transfer recording and replay for the pyonewire package
+
+  Copyright 2008 mike wakerly <opensource@hoho.com>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+
+RecordingHandle sits between DS2490Master and a libusb handle and logs every
+transfer, with its timing, to a trace file; ReplayHandle serves a trace back
+in place of the adapter, so that the code which made the recording runs
+again, identically, without hardware:
+
+  master = ds2490.DS2490Master(record='search.trace')
+  master.Search()
+  master.Close()
+
+  master = ds2490.DS2490Master(handle=usbtrace.ReplayHandle('search.trace'))
+  master.Search()
+
+A trace is a header, '1WUT' and a version byte, followed by one record per
+transfer: kind (B), request or endpoint (B), value (H), index (H), result
+(i), start and duration in seconds (d, d), lengths of the data sent and
+received (H, H), then that data. For a failed transfer the kind has
+KIND_ERROR set and the data received is the error message.
+
+Run this module with a trace file to print a summary of its transfers.
+"""
+
+import struct
+import time
+
+MAGIC = '1WUT'
+VERSION = 1
+
+# transfer kinds
+KIND_CONTROL = 0
+KIND_INTERRUPT_READ = 1
+KIND_BULK_READ = 2
+KIND_BULK_WRITE = 3
+KIND_ERROR = 0x80
+
+KIND_NAMES = {
+  KIND_CONTROL: 'control',
+  KIND_INTERRUPT_READ: 'interrupt read',
+  KIND_BULK_READ: 'bulk read',
+  KIND_BULK_WRITE: 'bulk write',
+}
+
+_HEADER = struct.Struct('<4sB')
+_RECORD = struct.Struct('<BBHHiddHH')
+
+
+class TraceError(Exception):
+  """A trace file is damaged, or a replay departed from it"""
+
+
+class ReplayedError(IOError):
+  """A transfer that failed when the trace was recorded"""
+
+
+class Transfer(object):
+  """One recorded transfer."""
+  __slots__ = ('kind', 'request', 'value', 'index', 'result', 'start',
+               'duration', 'sent', 'received')
+
+  def __init__(self, kind, request, value, index, result, start, duration,
+               sent, received):
+    self.kind = kind
+    self.request = request
+    self.value = value
+    self.index = index
+    self.result = result
+    self.start = start
+    self.duration = duration
+    self.sent = sent
+    self.received = received
+
+  def __str__(self):
+    name = KIND_NAMES.get(self.kind & ~KIND_ERROR, 'kind %i' % self.kind)
+    if self.kind & KIND_ERROR:
+      name += ' (failed)'
+    return '%10.6f %-24s 0x%02x value 0x%04x index 0x%04x out %i in %i' % (
+        self.start, name, self.request, self.value, self.index,
+        len(self.sent), len(self.received))
+
+
+def ReadTrace(path):
+  """Load a trace file.
+
+  Returns
+    list of Transfer objects
+  Raises
+    TraceError if the file is not a trace or is truncated
+  """
+  f = open(path, 'rb')
+  try:
+    data = f.read()
+  finally:
+    f.close()
+  if len(data) < _HEADER.size:
+    raise TraceError, "not a trace"
+  magic, version = _HEADER.unpack_from(data)
+  if magic != MAGIC or version != VERSION:
+    raise TraceError, "unknown format %r version %i" % (magic, version)
+  ret = []
+  pos = _HEADER.size
+  while pos < len(data):
+    if pos + _RECORD.size > len(data):
+      raise TraceError, "truncated record at %i" % pos
+    fields = _RECORD.unpack_from(data, pos)
+    pos += _RECORD.size
+    nsent, nreceived = fields[-2:]
+    if pos + nsent + nreceived > len(data):
+      raise TraceError, "truncated record data at %i" % pos
+    sent = data[pos:pos+nsent]
+    received = data[pos+nsent:pos+nsent+nreceived]
+    pos += nsent + nreceived
+    ret.append(Transfer(*(fields[:-2] + (sent, received))))
+  return ret
+
+
+class RecordingHandle(object):
+  """Wraps a libusb handle, logging its transfers to a trace file."""
+  def __init__(self, handle, path, clock=time.time):
+    self._handle = handle
+    self._clock = clock
+    self._file = open(path, 'wb')
+    self._file.write(_HEADER.pack(MAGIC, VERSION))
+    self._start = clock()
+    self.transfers = 0
+
+  def GetHandle(self):
+    """Returns the wrapped handle."""
+    return self._handle
+
+  def Close(self):
+    """Flush and close the trace file."""
+    if not self._file.closed:
+      self._file.close()
+
+  def _Record(self, kind, request, value, index, sent, call):
+    start = self._clock()
+    try:
+      ret = call()
+    except Exception, e:
+      end = self._clock()
+      self._Write(kind | KIND_ERROR, request, value, index, 0, start, end,
+                  sent, str(e))
+      raise
+    end = self._clock()
+    if isinstance(ret, (int, long)):
+      result, received = ret, ''
+    else:
+      result, received = len(ret), str(bytearray(ret))
+    self._Write(kind, request, value, index, result, start, end, sent,
+                received)
+    return ret
+
+  def _Write(self, kind, request, value, index, result, start, end, sent,
+             received):
+    self.transfers += 1
+    self._file.write(_RECORD.pack(kind, request, value, index, result,
+                                  start - self._start, end - start,
+                                  len(sent), len(received)))
+    self._file.write(sent)
+    self._file.write(received)
+
+  # libusb handle interface
+
+  def controlMsg(self, requestType, request, buffer, value=0, index=0,
+                 timeout=100):
+    return self._Record(KIND_CONTROL, request, value, index,
+                        str(bytearray(buffer)),
+                        lambda: self._handle.controlMsg(
+                            requestType=requestType, request=request,
+                            buffer=buffer, value=value, index=index,
+                            timeout=timeout))
+
+  def interruptRead(self, endpoint, size, timeout=100):
+    return self._Record(KIND_INTERRUPT_READ, endpoint, 0, size, '',
+                        lambda: self._handle.interruptRead(endpoint, size,
+                                                           timeout))
+
+  def bulkRead(self, endpoint, size, timeout=100):
+    return self._Record(KIND_BULK_READ, endpoint, 0, size, '',
+                        lambda: self._handle.bulkRead(endpoint, size,
+                                                      timeout))
+
+  def bulkWrite(self, endpoint, buf, timeout=100):
+    return self._Record(KIND_BULK_WRITE, endpoint, 0, 0,
+                        str(bytearray(buf)),
+                        lambda: self._handle.bulkWrite(endpoint, buf,
+                                                       timeout))
+
+  def releaseInterface(self):
+    self._handle.releaseInterface()
+    self.Close()
+
+  def __getattr__(self, name):
+    # the setup calls made while opening are not recorded
+    return getattr(self._handle, name)
+
+
+class ReplayHandle(object):
+  """Plays a trace back in place of a libusb handle.
+
+  Every transfer must be the one recorded at that point, with the same
+  parameters and data sent, or TraceError is raised. Data read and results
+  are those recorded, and failed transfers raise ReplayedError.
+  """
+  def __init__(self, trace, realtime=False):
+    """
+    Args
+      trace - path of a trace file, or a list of Transfer objects
+      realtime - if True, each transfer takes as long as when recorded
+    """
+    if isinstance(trace, basestring):
+      trace = ReadTrace(trace)
+    self._trace = trace
+    self._pos = 0
+    self._realtime = realtime
+    self.transfers = 0
+
+  def GetRemaining(self):
+    """Returns the number of recorded transfers not replayed yet."""
+    return len(self._trace) - self._pos
+
+  def _Replay(self, kind, request, value, index, sent):
+    if self._pos >= len(self._trace):
+      raise TraceError, "trace ended, got %s 0x%02x" % (
+          KIND_NAMES[kind], request)
+    transfer = self._trace[self._pos]
+    expected = (transfer.kind & ~KIND_ERROR, transfer.request,
+                transfer.value, transfer.index, transfer.sent)
+    if (kind, request, value, index, sent) != expected:
+      raise TraceError, "transfer %i differs from the trace: %s" % (
+          self._pos, transfer)
+    self._pos += 1
+    self.transfers += 1
+    if self._realtime and transfer.duration > 0:
+      time.sleep(transfer.duration)
+    if transfer.kind & KIND_ERROR:
+      raise ReplayedError, transfer.received
+    return transfer
+
+  # libusb handle interface
+
+  def reset(self):
+    pass
+
+  def setConfiguration(self, conf):
+    pass
+
+  def claimInterface(self, intf):
+    pass
+
+  def releaseInterface(self):
+    pass
+
+  def setAltInterface(self, alt):
+    pass
+
+  def controlMsg(self, requestType, request, buffer, value=0, index=0,
+                 timeout=100):
+    return self._Replay(KIND_CONTROL, request, value, index,
+                        str(bytearray(buffer))).result
+
+  def interruptRead(self, endpoint, size, timeout=100):
+    transfer = self._Replay(KIND_INTERRUPT_READ, endpoint, 0, size, '')
+    return tuple(bytearray(transfer.received))
+
+  def bulkRead(self, endpoint, size, timeout=100):
+    transfer = self._Replay(KIND_BULK_READ, endpoint, 0, size, '')
+    return tuple(bytearray(transfer.received))
+
+  def bulkWrite(self, endpoint, buf, timeout=100):
+    return self._Replay(KIND_BULK_WRITE, endpoint, 0, 0,
+                        str(bytearray(buf))).result
+
+
+def Summarize(trace):
+  """Count the transfers of a trace by kind.
+
+  Returns
+    dict mapping kind names to (count, bytes, total seconds) tuples
+  """
+  ret = {}
+  for transfer in trace:
+    name = KIND_NAMES.get(transfer.kind & ~KIND_ERROR, 'other')
+    count, nbytes, seconds = ret.get(name, (0, 0, 0.0))
+    ret[name] = (count + 1, nbytes + len(transfer.sent) +
+                 len(transfer.received), seconds + transfer.duration)
+  return ret
+
+
+if __name__ == '__main__':
+  import sys
+  trace = ReadTrace(sys.argv[1])
+  if trace:
+    print '%i transfers over %.3fs' % (
+        len(trace), trace[-1].start + trace[-1].duration)
+  for name, (count, nbytes, seconds) in sorted(Summarize(trace).iteritems()):
+    print '  %-16s %7i transfers %9i bytes %9.3fs' % (name, count, nbytes,
+                                                      seconds)
+  if '-v' in sys.argv[2:]:
+    for transfer in trace:
+      print transfer
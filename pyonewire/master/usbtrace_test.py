@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""
+Tests of usbtrace recording and replay against the ds2490sim emulator
+
+  Copyright 2008 mike wakerly <opensource@hoho.com>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+from pyonewire.master import ds2490
+from pyonewire.master import ds2490sim
+from pyonewire.master import SimulatedOneWireMaster
+from pyonewire.master import usbtrace
+
+
+class UsbTraceTest(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.dir, 'search.trace')
+    self.bus = SimulatedOneWireMaster.SimulatedBus(
+        SimulatedOneWireMaster.MakeSensorBus(20, seed=5))
+    self.roms = sorted(device.rom for device in self.bus.devices)
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def _Record(self):
+    handle = usbtrace.RecordingHandle(ds2490sim.FakeDS2490Handle(self.bus),
+                                      self.path)
+    master = ds2490.DS2490Master(handle=handle)
+    found = master.Search(master.SEARCH_NORMAL)
+    handle.Close()
+    return handle, found
+
+  def testRoundTrip(self):
+    recorder, found = self._Record()
+    self.assertEqual(sorted(found), self.roms)
+    trace = usbtrace.ReadTrace(self.path)
+    self.assertEqual(len(trace), recorder.transfers)
+
+    replay = usbtrace.ReplayHandle(self.path)
+    master = ds2490.DS2490Master(handle=replay)
+    self.assertEqual(master.Search(master.SEARCH_NORMAL), found)
+    self.assertEqual(replay.GetRemaining(), 0)
+    self.assertEqual(replay.transfers, recorder.transfers)
+
+    summary = usbtrace.Summarize(trace)
+    self.assertEqual(sum(count for count, nbytes, seconds
+                         in summary.itervalues()), len(trace))
+
+  def testMismatch(self):
+    self._Record()
+    master = ds2490.DS2490Master(handle=usbtrace.ReplayHandle(self.path))
+    # a different operation departs from the trace at once
+    self.assertRaises(usbtrace.TraceError, master.ReadByte)
+
+  def testTraceEnded(self):
+    self._Record()
+    replay = usbtrace.ReplayHandle(self.path)
+    master = ds2490.DS2490Master(handle=replay)
+    master.Search(master.SEARCH_NORMAL)
+    self.assertRaises(usbtrace.TraceError, master.ResetBus)
+
+  def testRecordedFailure(self):
+    handle = usbtrace.RecordingHandle(ds2490sim.FakeDS2490Handle(self.bus),
+                                      self.path)
+    # nothing is waiting in the FIFO
+    self.assertRaises(ds2490sim.FakeUsbError, handle.bulkRead,
+                      ds2490.EP_DATA_IN, 1)
+    handle.Close()
+    trace = usbtrace.ReadTrace(self.path)
+    self.assertTrue(trace[0].kind & usbtrace.KIND_ERROR)
+
+    replay = usbtrace.ReplayHandle(self.path)
+    try:
+      replay.bulkRead(ds2490.EP_DATA_IN, 1)
+    except usbtrace.ReplayedError, e:
+      self.assertEqual(str(e), trace[0].received)
+    else:
+      self.fail('the recorded failure was not replayed')
+
+  def testTruncated(self):
+    self._Record()
+    f = open(self.path, 'rb')
+    data = f.read()
+    f.close()
+    for size in (0, 3, len(data) - 1, len(data) - usbtrace._RECORD.size):
+      f = open(self.path, 'wb')
+      f.write(data[:size])
+      f.close()
+      self.assertRaises(usbtrace.TraceError, usbtrace.ReadTrace, self.path)
+    f = open(self.path, 'wb')
+    f.write('XXXX' + data[4:])
+    f.close()
+    self.assertRaises(usbtrace.TraceError, usbtrace.ReplayHandle, self.path)
+
+
+if __name__ == '__main__':
+  logging.getLogger('ds2490').setLevel(logging.WARNING)
+  unittest.main()
@@ -1,6 +1,9 @@
 #!/usr/bin/env python
 
-from distutils.core import setup
+try:
+  from setuptools import setup
+except ImportError:
+  from distutils.core import setup
 
 setup(
     name = "pyonewire",
@@ -12,9 +15,14 @@ setup(
     packages = [
       'pyonewire',
       'pyonewire.core',
+      'pyonewire.device',
       'pyonewire.master',
     ],
     package_dir = {
       'pyonewire': '',
     },
+    extras_require = {
+      # AsyncOneWireMaster
+      'async': ['trollius'],
+    },
 )